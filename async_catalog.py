@@ -0,0 +1,162 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import helpers
+
+
+# How many requests run at once (on that many threads) by default. Cone searches spend most of their time
+# in numpy, which releases the GIL, so a few threads keep a few cores busy:
+DEFAULT_CONCURRENCY = 4
+
+
+class CatalogBusy(Exception):
+	"""
+	Raised (instead of queueing the request) when an AsyncCatalog already has `max_waiting` requests waiting to run.
+	"""
+
+
+class AsyncCatalog:
+	"""
+	Queries the FIRST catalog from asyncio code without blocking the event loop:
+
+		catalog = AsyncCatalog()
+		table = await catalog.cone_search(338.12, 11.53, 0.25)
+		ra, dec, name = await catalog.lookup('J223235.3+114213')
+
+	Loading the catalog, the searches and the lookups all run on a thread pool (the helpers functions do the work,
+	so results come from the same query cache and include ingested sources). At most `concurrency` requests run
+	at a time; the rest wait their turn without holding up the loop, or if `max_waiting` requests are already
+	waiting, are turned away with CatalogBusy. Identical requests made while one is already running share its
+	result, rather than doing the same work again. Nothing ever prompts: sources that can't be found raise a KeyError.
+
+	The catalog is the one in `filename` (helpers.FILENAME by default), unless a FIRSTCatalog is given.
+	"""
+
+	def __init__(self, filename=None, catalog=None, concurrency=DEFAULT_CONCURRENCY, max_waiting=None, executor=None):
+		self.filename = filename
+		self.catalog = catalog
+		self.concurrency = concurrency
+		self.max_waiting = max_waiting
+		self._own_executor = executor is None
+		self.executor = executor or ThreadPoolExecutor(concurrency, thread_name_prefix='catalog')
+		self._slots = None  # Semaphore of the running requests, made on first use so it belongs to the running loop
+		self._running = {}  # Future of every request started and not yet finished, keyed by what was asked for
+
+	async def __aenter__(self):
+		return self
+
+	async def __aexit__(self, *exc_info):
+		self.close()
+
+	def close(self):
+		"""
+		Shuts down the thread pool (if the AsyncCatalog made its own) once the requests running on it finish.
+		"""
+		if self._own_executor:
+			self.executor.shutdown(wait=False)
+
+	@property
+	def pending(self):
+		# The number of different requests running or waiting to run.
+		return len(self._running)
+
+	async def cone_search(self, ra1, dec1, radius=1, min_flux=None, max_flux=None, classes=None, columns=None):
+		"""
+		Returns a Table of the FIRST sources within `radius` degrees of (ra1, dec1), as helpers.get_FIRST_sources_within_radius,
+		which describes the filters.
+		"""
+		key = ('cone', float(ra1), float(dec1), float(radius), min_flux, max_flux, as_key(classes), as_key(columns))
+		table = await self.request(key, lambda catalog: helpers.get_FIRST_sources_within_radius(ra1, dec1, radius, catalog,
+			min_flux=min_flux, max_flux=max_flux, classes=classes, columns=columns))
+		# Requests that were merged all get the same table, so give every caller their own copy to change:
+		return table.copy()
+
+	async def nearest(self, ra1, dec1, k=1, max_radius=None, min_flux=None, max_flux=None, classes=None, columns=None):
+		"""
+		Returns a Table of the `k` FIRST sources closest to (ra1, dec1), as helpers.get_nearest_FIRST_sources.
+		"""
+		key = ('nearest', float(ra1), float(dec1), int(k), max_radius, min_flux, max_flux, as_key(classes), as_key(columns))
+		table = await self.request(key, lambda catalog: helpers.get_nearest_FIRST_sources(ra1, dec1, k, max_radius, catalog,
+			min_flux=min_flux, max_flux=max_flux, classes=classes, columns=columns))
+		return table.copy()
+
+	async def lookup(self, FIRST):
+		"""
+		Returns the (ra, dec, name) of the FIRST source with the given name.
+
+		Raises a KeyError if no matching FIRST source is found.
+		"""
+		return await self.request(('lookup', FIRST), lambda catalog: helpers.get_coordinates_for_FIRST_source(FIRST, catalog))
+
+	async def lookup_many(self, names):
+		"""
+		Returns arrays of the ra and dec of each of the named sources, with NaN for names that aren't in the catalog.
+		"""
+		key = ('lookup_many', as_key(names))
+		ra, dec = await self.request(key, lambda catalog: helpers.get_coordinates_for_FIRST_sources(names, catalog))
+		return ra.copy(), dec.copy()
+
+	async def search_coordinates(self, ra1=None, dec1=None, source=None):
+		"""
+		Returns the (ra, dec, source) to search around, like helpers.get_search_coordinates, but without ever asking
+		for input: the named source's position if it's found, otherwise the given ra and dec (with None for the source).
+
+		Raises a KeyError if the source isn't found and there's no ra and dec to fall back to,
+		or a ValueError if neither was given.
+		"""
+		if source:
+			try:
+				return await self.lookup(source)
+			except KeyError:
+				if ra1 is None or dec1 is None:
+					raise
+
+		if ra1 is None or dec1 is None:
+			raise ValueError('Give a FIRST source name, or both ra and dec')
+
+		return float(ra1), float(dec1), None
+
+	async def request(self, key, work):
+		"""
+		Runs `work(catalog)` on the thread pool, or if a request with the same `key` is already running,
+		waits for that one's result instead.
+		"""
+		future = self._running.get(key)
+		if future is None:
+			# Only the requests beyond the `concurrency` that can run at once are waiting:
+			waiting = len(self._running) - self.concurrency
+			if self.max_waiting is not None and waiting >= self.max_waiting:
+				raise CatalogBusy('{} requests are already waiting'.format(waiting))
+
+			future = asyncio.ensure_future(self.run(work))
+			self._running[key] = future
+			future.add_done_callback(lambda done: self.finished(key, done))
+
+		# Shielded, so that a caller giving up (e.g. on a timeout) doesn't cancel the request for everyone sharing it:
+		return await asyncio.shield(future)
+
+	async def run(self, work):
+		if self._slots is None:
+			self._slots = asyncio.Semaphore(self.concurrency)
+
+		async with self._slots:
+			return await asyncio.get_running_loop().run_in_executor(self.executor, self.call, work)
+
+	def call(self, work):
+		# On a pool thread: loading (or picking up changes to) the catalog reads files, so that's done here too.
+		if self.catalog is not None:
+			self.catalog = self.catalog.refreshed()
+			return work(self.catalog)
+		return work(helpers.get_catalog(self.filename))
+
+	def finished(self, key, future):
+		if self._running.get(key) is future:
+			del self._running[key]
+		# Every caller may have given up on the request, so mark its error (if any) as seen to keep asyncio quiet:
+		if not future.cancelled():
+			future.exception()
+
+
+def as_key(values):
+	# Lists (of classes, columns or names) as something hashable, for telling identical requests apart:
+	return None if values is None else tuple(values)
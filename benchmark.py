@@ -0,0 +1,280 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+
+# Catalog sizes to benchmark: a small catalog, about the size of the real FIRST catalog, and ten times that.
+SIZES = (10_000, 1_000_000, 10_000_000)
+RADII = (0.1, 0.25, 1, 3)
+
+# Where the synthetic catalogs are written (and reused from on later runs):
+DATA_DIR = 'benchmark_data'
+
+# The FIRST survey covers most of the sky north of -11 degrees, up to about +68 at most right ascensions:
+FOOTPRINT_DEC = (-11, 68)
+
+# A benchmark is reported as a regression when its median gets this much slower:
+REGRESSION_THRESHOLD = 0.2
+
+
+def source_names(ra, dec):
+	"""
+	Returns FIRST style names (e.g. J223235.3+114213) for the given positions, as 16 byte strings.
+	Built digit by digit with numpy, since formatting ten million strings one at a time takes minutes.
+	"""
+	tenths = np.floor(ra / 15 * 36000).astype(np.int64) % (24 * 36000)
+	arcseconds = np.floor(np.abs(dec) * 3600).astype(np.int64)
+
+	def digits(values, width):
+		return [(values // 10**power % 10 + ord('0')).astype(np.uint8) for power in range(width - 1, -1, -1)]
+
+	n = len(ra)
+	characters = [np.full(n, ord('J'), dtype=np.uint8)]
+	characters += digits(tenths // 36000, 2) + digits(tenths // 600 % 60, 2) + digits(tenths // 10 % 60, 2)
+	characters += [np.full(n, ord('.'), dtype=np.uint8)] + digits(tenths % 10, 1)
+	characters += [np.where(dec < 0, ord('-'), ord('+')).astype(np.uint8)]
+	characters += digits(arcseconds // 3600, 2) + digits(arcseconds // 60 % 60, 2) + digits(arcseconds % 60, 2)
+
+	return np.ascontiguousarray(np.column_stack(characters)).view('S16').ravel()
+
+
+def generate_catalog(filename, rows, seed=0):
+	"""
+	Writes a synthetic catalog with the columns of FIRST_data.fit (see FIRST_data_columns.txt) to `filename`:
+	positions spread evenly over the survey footprint, log-normal fluxes and a realistic mix of classifications.
+	"""
+	from astropy.io import fits
+
+	rng = np.random.default_rng(seed)
+	low, high = np.sin(np.radians(FOOTPRINT_DEC))
+	ra = rng.uniform(0, 360, rows)
+	dec = np.degrees(np.arcsin(rng.uniform(low, high, rows)))
+	fint = np.round(rng.lognormal(1.5, 1.2, rows), 2).astype(np.float32)
+	c1 = rng.choice(np.array([b' ', b'g', b's']), rows, p=[0.6, 0.3, 0.1])
+
+	columns = [
+		fits.Column(name='FIRST', format='16A', array=source_names(ra, dec)),
+		fits.Column(name='RAJ2000', format='D', unit='deg', array=ra),
+		fits.Column(name='DEJ2000', format='D', unit='deg', array=dec),
+		fits.Column(name='Fint', format='E', unit='mJy', array=fint),
+		fits.Column(name='c1', format='1A', array=c1),
+	]
+	fits.BinTableHDU.from_columns(columns).writeto(filename, overwrite=True)
+
+
+def search_positions(count, seed=1):
+	# The same positions on every run, so results can be compared between commits:
+	rng = np.random.default_rng(seed)
+	low, high = np.sin(np.radians(FOOTPRINT_DEC))
+	return list(zip(rng.uniform(0, 360, count), np.degrees(np.arcsin(rng.uniform(low, high, count)))))
+
+
+def summarize(times, peak, rows=None):
+	milliseconds = np.array(times) * 1000
+	summary = {
+		'runs': len(times),
+		'median_ms': float(np.median(milliseconds)),
+		'mean_ms': float(milliseconds.mean()),
+		'p95_ms': float(np.percentile(milliseconds, 95)),
+		'peak_mb': peak / 2**20,
+	}
+	if rows is not None:
+		summary['mean_rows'] = float(np.mean(rows))
+	return summary
+
+
+def measure(function, arguments):
+	"""
+	Calls `function` with each of the `arguments` tuples, timing every call, then calls it once more with the
+	first of them under tracemalloc to find the peak memory allocated during a call.
+	Returns the time each call took, the peak memory (in bytes) and the result of each call.
+	"""
+	times = []
+	results = []
+	for args in arguments:
+		start = time.perf_counter()
+		results.append(function(*args))
+		times.append(time.perf_counter() - start)
+
+	tracemalloc.start()
+	function(*arguments[0])
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+
+	return times, peak, results
+
+
+def run_size(filename, repeat=20, radii=RADII):
+	"""
+	Benchmarks the tools against the catalog in `filename`, in this process. Returns a dict of results.
+	"""
+	import matplotlib
+	matplotlib.use('Agg')
+	import matplotlib.pyplot as plt
+
+	import helpers
+	import table_tool
+	import visualization_tool
+
+	helpers.FILENAME = filename
+	helpers.clear_catalog_cache()
+	results = {}
+
+	# Loading the catalog, first building the column cache, then from the cache as a new process would:
+	tracemalloc.start()
+	start = time.perf_counter()
+	catalog = helpers.get_catalog()
+	results['open_cold'] = {'median_ms': (time.perf_counter() - start) * 1000, 'peak_mb': tracemalloc.get_traced_memory()[1] / 2**20}
+	tracemalloc.stop()
+	helpers.clear_catalog_cache()
+	start = time.perf_counter()
+	catalog = helpers.get_catalog()
+	results['open_warm'] = {'median_ms': (time.perf_counter() - start) * 1000}
+
+	positions = search_positions(repeat)
+
+	def cone_search(ra1, dec1, radius):
+		# Every search goes to the catalog, rather than being answered by the query cache:
+		helpers.QUERY_CACHE.clear()
+		return len(helpers.get_FIRST_sources_within_radius(ra1, dec1, radius=radius))
+
+	for radius in radii:
+		times, peak, rows = measure(cone_search, [(ra1, dec1, radius) for ra1, dec1 in positions])
+		results['get_FIRST_sources_within_radius r={}'.format(radius)] = summarize(times, peak, rows)
+
+	rng = np.random.default_rng(2)
+	names = [name.decode('ascii') for name in np.asarray(catalog.columns['FIRST'])[rng.integers(0, len(catalog), repeat)]]
+	times, peak, _ = measure(helpers.get_coordinates_for_FIRST_source, [(name,) for name in names])
+	results['get_coordinates_for_FIRST_source'] = summarize(times, peak)
+
+	# The tools write their output to the current directory, so run them in a temporary one:
+	def run_table_tool(ra1, dec1, radius):
+		helpers.QUERY_CACHE.clear()
+		with contextlib.redirect_stdout(io.StringIO()):
+			table_tool.main(ra1, dec1, radius)
+
+	def run_visualization_tool(ra1, dec1, radius):
+		helpers.QUERY_CACHE.clear()
+		with contextlib.redirect_stdout(io.StringIO()):
+			fig, ax = visualization_tool.main(ra1, dec1, radius)
+		plt.close(fig)
+
+	tool_positions = positions[:max(1, repeat // 4)]
+	cwd = os.getcwd()
+	with tempfile.TemporaryDirectory() as directory:
+		os.chdir(directory)
+		try:
+			for radius in radii:
+				times, peak, _ = measure(run_table_tool, [(ra1, dec1, radius) for ra1, dec1 in tool_positions])
+				results['table_tool.main r={}'.format(radius)] = summarize(times, peak)
+				times, peak, _ = measure(run_visualization_tool, [(ra1, dec1, radius) for ra1, dec1 in tool_positions])
+				results['visualization_tool.main r={}'.format(radius)] = summarize(times, peak)
+		finally:
+			os.chdir(cwd)
+
+	return {'rows': len(catalog), 'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 'benchmarks': results}
+
+
+def environment():
+	try:
+		commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+			cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		commit = None
+	return {'commit': commit, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+		'numpy': np.__version__, 'machine': platform.machine(), 'cpus': os.cpu_count()}
+
+
+def main(sizes=SIZES, repeat=20, data_dir=DATA_DIR, output='benchmark.json'):
+	"""
+	Benchmarks every catalog size (each in a fresh process, so the peak memory of one doesn't hide the next's)
+	and writes the results, along with the commit they were measured at, to `output` as JSON.
+	"""
+	os.makedirs(data_dir, exist_ok=True)
+	report = dict(environment(), sizes={})
+
+	for rows in sizes:
+		filename = os.path.join(data_dir, 'synthetic_{}.fit'.format(rows))
+		if not os.path.exists(filename):
+			print('Generating {} rows in {}'.format(rows, filename))
+			generate_catalog(filename, rows)
+
+		print('Benchmarking {} rows'.format(rows))
+		result = subprocess.run([sys.executable, os.path.abspath(__file__), '--run', filename, '--repeat', str(repeat)],
+			capture_output=True, text=True, check=True)
+		report['sizes'][str(rows)] = json.loads(result.stdout)
+		print_size(report['sizes'][str(rows)])
+
+	with open(output, 'w') as file:
+		json.dump(report, file, indent=1)
+	print('Results written to {}'.format(output))
+
+	return report
+
+
+def print_size(result):
+	print('  {} rows, peak RSS {:.0f} MB'.format(result['rows'], result['max_rss_mb']))
+	for name, summary in result['benchmarks'].items():
+		extra = ''
+		if 'peak_mb' in summary:
+			extra = '   peak {:8.2f} MB'.format(summary['peak_mb'])
+		if 'mean_rows' in summary:
+			extra += '   {:9.0f} rows'.format(summary['mean_rows'])
+		print('  {:<45} {:10.2f} ms{}'.format(name, summary['median_ms'], extra))
+
+
+def compare(old, new, threshold=REGRESSION_THRESHOLD):
+	"""
+	Compares two benchmark reports, printing the change in every median time.
+	Returns the (size, benchmark) pairs that got more than `threshold` slower.
+	"""
+	print('{} -> {}'.format(old.get('commit'), new.get('commit')))
+	regressions = []
+	for size, result in new['sizes'].items():
+		if size not in old['sizes']:
+			continue
+		print('{} rows'.format(size))
+		for name, summary in result['benchmarks'].items():
+			before = old['sizes'][size]['benchmarks'].get(name)
+			if before is None or not before['median_ms']:
+				continue
+			change = summary['median_ms'] / before['median_ms'] - 1
+			flag = ''
+			if change > threshold:
+				regressions.append((size, name))
+				flag = '  REGRESSION'
+			print('  {:<45} {:10.2f} -> {:10.2f} ms  {:+7.1%}{}'.format(name, before['median_ms'], summary['median_ms'], change, flag))
+
+	return regressions
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Benchmarks cone searches, lookups and the command line tools on synthetic FIRST catalogs")
+	parser.add_argument('--rows', type=int, nargs='+', default=SIZES, help='catalog sizes to benchmark (default: {}).'.format(' '.join(str(size) for size in SIZES)))
+	parser.add_argument('-n', '--repeat', type=int, default=20, help='number of search positions per radius (default: 20).')
+	parser.add_argument('-d', '--data-dir', type=str, default=DATA_DIR, help='directory for the synthetic catalogs (default: {}).'.format(DATA_DIR))
+	parser.add_argument('-o', '--output', type=str, default='benchmark.json', help='file to write the results to (default: benchmark.json).')
+	parser.add_argument('--compare', type=str, nargs=2, metavar=('OLD', 'NEW'), help='compare two results files instead, exiting with an error if anything got slower.')
+	parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD, help='slowdown counted as a regression by --compare (default: {}).'.format(REGRESSION_THRESHOLD))
+	parser.add_argument('--run', type=str, help=argparse.SUPPRESS)  # Used by main() to benchmark one catalog in a new process.
+
+	args = parser.parse_args()
+	if args.run:
+		print(json.dumps(run_size(args.run, args.repeat)))
+	elif args.compare:
+		with open(args.compare[0]) as old, open(args.compare[1]) as new:
+			regressions = compare(json.load(old), json.load(new), args.threshold)
+		sys.exit(1 if regressions else 0)
+	else:
+		main(args.rows, args.repeat, args.data_dir, args.output)
@@ -0,0 +1,122 @@
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from query_client import QueryClient
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# How quickly a command line tool should get to its first output when it doesn't have to search the catalog itself:
+TARGET_MS = 200
+
+
+def run(command, cwd, env=None):
+	"""
+	Runs one of the command line tools, returning its wall time in milliseconds.
+	"""
+	start = time.perf_counter()
+	subprocess.run([sys.executable] + command, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+	return (time.perf_counter() - start) * 1000
+
+
+def import_costs(module, count=10):
+	"""
+	Returns the `count` slowest top level imports of `module`, as (cumulative milliseconds, name) pairs, using python -X importtime.
+	"""
+	result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module], cwd=HERE, capture_output=True, text=True, check=True)
+	children = []
+	for line in result.stderr.splitlines():
+		# Lines look like "import time:       self |  cumulative | <indentation>name", in microseconds,
+		# with every module listed after the modules it imported (which are indented one level deeper):
+		if not line.startswith('import time:') or 'cumulative' in line:
+			continue
+		_, cumulative, name = line[len('import time:'):].split('|')
+		depth = (len(name) - len(name.lstrip())) // 2
+		cost = (int(cumulative) / 1000, name.strip())
+		if depth == 1:
+			children.append(cost)
+		elif depth == 0:
+			if cost[1] == module:
+				return [cost] + sorted(children, reverse=True)[:count]
+			children = []
+
+	return []
+
+
+def free_port():
+	with socket.socket() as sock:
+		sock.bind(('127.0.0.1', 0))
+		return sock.getsockname()[1]
+
+
+def start_server(catalog, port):
+	server = subprocess.Popen([sys.executable, os.path.join(HERE, 'query_server.py'), '-p', str(port), '-c', catalog],
+		stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+	client = QueryClient('http://127.0.0.1:{}'.format(port))
+	for _ in range(600):
+		if client.is_running():
+			return server
+		if server.poll() is not None:
+			break
+		time.sleep(0.1)
+	server.kill()
+	raise RuntimeError('The query server did not start (is {} there?)'.format(catalog))
+
+
+def report(name, times):
+	median = statistics.median(times)
+	print('{:<55} median {:7.1f} ms   min {:7.1f} ms   {}'.format(name, median, min(times), 'ok' if median < TARGET_MS else 'over {} ms'.format(TARGET_MS)))
+
+
+def main(catalog, repeat=5, ra1=338.12, dec1=11.53, radius=0.25):
+	"""
+	Times how long the command line tools take to start: printing their help, and answering a search through a
+	running query server (the second time round, so the server's query cache answers it). Also lists the
+	slowest imports of each tool.
+	"""
+	with tempfile.TemporaryDirectory() as cwd:
+		table_tool = os.path.join(HERE, 'table_tool.py')
+		visualization_tool = os.path.join(HERE, 'visualization_tool.py')
+
+		print('Python itself')
+		report('python -c pass', [run(['-c', 'pass'], cwd) for _ in range(repeat)])
+
+		print('\nHelp')
+		report('table_tool.py --help', [run([table_tool, '--help'], cwd) for _ in range(repeat)])
+		report('visualization_tool.py --help', [run([visualization_tool, '--help'], cwd) for _ in range(repeat)])
+
+		if catalog:
+			port = free_port()
+			server = start_server(os.path.abspath(catalog), port)
+			try:
+				env = dict(os.environ, FIRST_SERVER='http://127.0.0.1:{}'.format(port))
+				search = ['-ra', str(ra1), '-dec', str(dec1), '-r', str(radius)]
+				run([table_tool] + search, cwd, env)  # Warm up the server's query cache
+				run([visualization_tool] + search, cwd, env)
+
+				print('\nSearches answered by a query server')
+				report('table_tool.py ' + ' '.join(search), [run([table_tool] + search, cwd, env) for _ in range(repeat)])
+				report('visualization_tool.py ' + ' '.join(search), [run([visualization_tool] + search, cwd, env) for _ in range(repeat)])
+			finally:
+				server.terminate()
+				server.wait()
+
+	for module in ('table_tool', 'visualization_tool'):
+		print('\nSlowest imports of {}'.format(module))
+		for milliseconds, name in import_costs(module):
+			print('  {:7.1f} ms  {}'.format(milliseconds, name))
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Measures how long the command line tools take to start")
+	parser.add_argument('-c', '--catalog', type=str, help='FIRST catalog fit file to start a query server with, to time searches answered by the server.')
+	parser.add_argument('-n', '--repeat', type=int, default=5, help='number of times to run each command (default: 5).')
+
+	args = parser.parse_args()
+	main(args.catalog, args.repeat)
@@ -0,0 +1,558 @@
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import os
+import sys
+
+# astropy takes most of a second to import, so it's only imported by the functions that use it.
+# That way the command line tools start quickly when they don't need it (e.g. --help, or when a query server answers).
+
+import column_cache
+import ingest
+from name_index import NameIndex
+import profiling
+import zone_index
+
+
+class Selection:
+	"""
+	Which sources and columns a query wants, so they can be picked out before any separations are computed
+	and only the wanted columns copied into the result.
+
+	Flux bounds are on the integrated flux density (Fint, in mJy), and include the bounds themselves.
+	`classes` holds the SDSS classifications (c1) to keep: 'g', 's' and/or ' ' for unclassified sources.
+	`columns` lists the catalog columns to return, in that order (all of them if None); the angular
+	separation is always added.
+	"""
+
+	def __init__(self, min_flux=None, max_flux=None, classes=None, columns=None):
+		self.min_flux = min_flux
+		self.max_flux = max_flux
+		self.classes = classes
+		self.columns = columns
+
+	@property
+	def filters(self):
+		return self.min_flux is not None or self.max_flux is not None or self.classes is not None
+
+	def mask(self, columns, rows):
+		"""
+		Returns which of the given catalog rows pass the flux and classification filters.
+		"""
+		keep = np.ones(len(rows), dtype=bool)
+		if self.min_flux is not None or self.max_flux is not None:
+			flux = columns['Fint'][rows]
+			if self.min_flux is not None:
+				keep &= flux >= self.min_flux
+			if self.max_flux is not None:
+				keep &= flux <= self.max_flux
+		if self.classes is not None:
+			# Compare the byte value of each classification against a lookup table. Blank classifications are
+			# stored as b'' (byte value 0) or b' ', so ' ' matches both:
+			wanted = np.zeros(256, dtype=bool)
+			for code in self.classes:
+				wanted[ord(code)] = True
+			wanted[0] = wanted[ord(' ')]
+			keep &= wanted[np.asarray(columns['c1'][rows]).astype('S1').view(np.uint8)]
+
+		return keep
+
+
+class FIRSTCatalog:
+	"""
+	The FIRST catalog held in memory as one numpy array per column.
+
+	Opening and decoding FIRST_data.fit is by far the most expensive part of a query,
+	so a FIRSTCatalog is loaded once and then used to answer as many cone searches and
+	name lookups as needed without touching the file again.
+
+	Rows ingested since the file was written (see ingest.py) are held in `delta`, a small FIRSTCatalog
+	of their own, and merged into every query. They're numbered after the rows of the file.
+	"""
+
+	def __init__(self, columns, units=None, index=None, unit_vectors=None, names=None, version=None):
+		# Keep the columns in the same order as the file so that result tables look the same:
+		self.columns = {name: np.asarray(data) for name, data in columns.items()}
+		self.colnames = list(self.columns)
+		self.units = dict(units or {})
+		# Identifies the contents of the catalog, for anything cached from it (None if unknown):
+		self.version = version
+		self._index = index
+		self._unit_vectors = unit_vectors
+		self._name_index = names
+		self._pool = None
+		self._pool_workers = 0
+		# Set by watch() for catalogs loaded from a file:
+		self.filename = None
+		self.base_version = version
+		self.delta = None
+		self.delta_seq = 0
+		self._source_stat = None
+		self._segments = ()
+
+	@classmethod
+	def open(cls, filename):
+		"""
+		Loads the catalog from its memory-mapped column cache (see column_cache.py), building the cache 
+		first if needed. Only the pages a query actually touches are read from disk.
+
+		Falls back to reading the fit file directly if the cache can't be used.
+		"""
+		with profiling.span('load column cache'):
+			cache = column_cache.load(filename)
+		if cache is None:
+			return cls.from_fits(filename)
+
+		catalog = cls(cache['columns'], index=cache['index'], unit_vectors=cache['unit_vectors'], names=cache['names'],
+			version=cache['meta']['source_sha1'][:16])
+		return catalog.watch(filename, cache['meta'].get('delta_seq', 0))
+
+	@classmethod
+	def from_fits(cls, filename):
+		from astropy.io import fits
+
+		with profiling.span('read fits'), fits.open(filename) as hdul:
+			data = hdul[1].data
+			columns = column_cache.fits_columns(data)
+			delta_seq = hdul[1].header.get('DELTASEQ', 0)
+
+		index = zone_index.load_or_build(filename, columns['RAJ2000'], columns['DEJ2000'])
+
+		try:
+			stat = os.stat(filename)
+			version = '{:x}-{:x}'.format(stat.st_size, stat.st_mtime_ns)
+		except OSError:
+			version = None
+
+		return cls(columns, index=index, version=version).watch(filename, delta_seq)
+
+	def watch(self, filename, delta_seq=0):
+		"""
+		Ties the catalog to the fit file it was loaded from, whose delta segments after `delta_seq` (the last one
+		folded into the file) hold the rows ingested since. Returns the catalog with those rows merged in.
+		"""
+		self.filename = filename
+		self.delta_seq = delta_seq
+		self._source_stat = ingest.source_stat(filename)
+		return self.refreshed()
+
+	def refreshed(self):
+		"""
+		Returns the catalog as it is now: this one if nothing has changed, a copy with the rows ingested
+		since merged in, or the whole catalog loaded again if the fit file itself was replaced (by a compaction).
+
+		Checking costs a stat and a directory listing, and only new delta segments are read, so this can be
+		called before every query. Catalogs that weren't loaded from a file are returned as they are.
+		"""
+		if self.filename is None:
+			return self
+		if ingest.source_stat(self.filename) != self._source_stat:
+			return type(self).open(self.filename)
+
+		segments = ingest.segments(self.filename, after=self.delta_seq)
+		if segments == self._segments:
+			return self
+
+		# Segments are only ever added (until a compaction folds them into a new fit file),
+		# so usually only the new ones need reading:
+		known = self._segments if segments[:len(self._segments)] == self._segments else ()
+		try:
+			with profiling.span('read delta segments', segments=len(segments) - len(known)):
+				columns = ingest.read_segments(self.filename, segments[len(known):])
+		except OSError:
+			columns = None
+		# A compaction may have folded the segments into a new fit file (and removed them) in the meantime:
+		if columns is None or ingest.source_stat(self.filename) != self._source_stat:
+			return type(self).open(self.filename)
+
+		if known and self.delta is not None:
+			columns = {name: np.concatenate([self.delta.columns[name], column]) for name, column in columns.items()}
+
+		catalog = copy.copy(self)
+		catalog.delta = FIRSTCatalog(columns, self.units,
+			index=zone_index.ZoneIndex.build(columns['RAJ2000'], columns['DEJ2000'], self.index.zone_height))
+		catalog._segments = segments
+		# Anything cached from the catalog (e.g. query results) has to be redone with the new rows:
+		catalog.version = None if self.base_version is None else '{}+{}'.format(self.base_version, segments[-1])
+		return catalog
+
+	@property
+	def index(self):
+		# Catalogs that weren't loaded from a file build their spatial index on first use:
+		if self._index is None:
+			self._index = zone_index.ZoneIndex.build(self.columns['RAJ2000'], self.columns['DEJ2000'])
+		return self._index
+
+	@property
+	def name_index(self):
+		# Like the spatial index, this is built on first use if it didn't come from the cache:
+		if self._name_index is None:
+			self._name_index = NameIndex.build(self.columns['FIRST'])
+		return self._name_index
+
+	@property
+	def unit_vectors(self):
+		"""
+		(N, 3) float32 array of the cartesian unit vector of every source (see zone_index.unit_vectors).
+		"""
+		if self._unit_vectors is None:
+			self._unit_vectors = zone_index.unit_vectors(self.columns['RAJ2000'], self.columns['DEJ2000'])
+		return self._unit_vectors
+
+	def __len__(self):
+		return self.base_size + (len(self.delta) if self.delta is not None else 0)
+
+	@property
+	def base_size(self):
+		# The number of rows loaded from the file, after which the ingested rows in `delta` are numbered:
+		return len(self.columns['RAJ2000'])
+
+	def take(self, name, rows):
+		"""
+		Returns column `name` of the given rows, which can include ingested rows.
+		"""
+		if self.delta is None:
+			return self.columns[name][rows]
+
+		rows = np.asarray(rows, dtype=np.intp)
+		ingested = rows >= self.base_size
+		values = np.empty(len(rows), dtype=self.columns[name].dtype)
+		values[~ingested] = self.columns[name][rows[~ingested]]
+		values[ingested] = self.delta.columns[name][rows[ingested] - self.base_size]
+		return values
+
+	def cone_search(self, ra1, dec1, radius=1, workers=1, selection=None):
+		"""
+		Returns a Table of the FIRST sources within `radius` degrees of (ra1, dec1),
+		in catalog order, with an extra 'Angular Separation' column.
+
+		A `selection` (see Selection) limits the sources and columns returned.
+		With more than one worker, the cone is split into declination bands that are searched in parallel.
+		"""
+		import_astropy()
+
+		bands = []
+		if workers > 1:
+			first_zone, last_zone = self.index.zone_range(dec1, radius)
+			bands = [(band[0], band[-1]) for band in np.array_split(np.arange(first_zone, last_zone + 1), workers) if len(band)]
+		if bands:
+			results = list(self.pool(workers).map(lambda zones: self.cone_rows(ra1, dec1, radius, zones, selection), bands))
+			rows, separations = merge_shards(results)
+		else:
+			# One worker, or no zones to split the cone over (a negative radius, which finds nothing):
+			rows, separations = self.cone_rows(ra1, dec1, radius, selection=selection)
+
+		return self.make_table(rows, separations, selection.columns if selection else None)
+
+	def cone_rows(self, ra1, dec1, radius, zones=None, selection=None):
+		"""
+		Returns the catalog rows (in catalog order) within `radius` degrees of (ra1, dec1), along with their separations.
+		`zones` can restrict the search to a (first, last) range of the index's declination zones, and a
+		`selection` to the sources that pass its filters.
+		"""
+		from astropy import units as u
+		from astropy.coordinates import Angle
+
+		# Only the sources in the index cells that overlap the cone need an exact separation:
+		with profiling.span('index candidates'):
+			candidates = self.index.candidates(ra1, dec1, radius, zones)
+		# ...and of those, only the ones that pass the (much cheaper) flux and classification filters:
+		if selection is not None and selection.filters:
+			with profiling.span('filter', rows=len(candidates)):
+				candidates = candidates[selection.mask(self.columns, candidates)]
+		# ...and of those, only the ones whose unit vectors put them anywhere near the cone. The exact separations
+		# of the rest are then computed from their ra and dec, so the results keep full precision:
+		if radius < 180:
+			with profiling.span('prefilter', rows=len(candidates)):
+				candidates = candidates[self.near(candidates, zone_index.unit_vectors([ra1], [dec1])[0], radius)]
+		with profiling.span('separations', rows=len(candidates)):
+			separations = self.separations(ra1, dec1, candidates)
+		with profiling.span('mask'):
+			catalogmsk = separations < radius
+			candidates, separations = candidates[catalogmsk], Angle(separations[catalogmsk], unit=u.degree)
+
+		if self.delta is not None:
+			with profiling.span('delta', rows=len(self.delta)):
+				delta_rows, delta_separations = self.delta.cone_rows(ra1, dec1, radius, zones, selection)
+			candidates, separations = merge_shards([(candidates, separations), (delta_rows + self.base_size, delta_separations)])
+
+		return candidates, separations
+
+	def nearest(self, ra1, dec1, k=1, max_radius=None, selection=None):
+		"""
+		Returns a Table of the `k` FIRST sources closest to (ra1, dec1), nearest first, with an extra
+		'Angular Separation' column. Sources `max_radius` degrees or further away are left out, if it's given,
+		so there may be fewer than `k` rows. A `selection` (see Selection) limits the sources and columns returned.
+		"""
+		import_astropy()
+		rows, separations = self.nearest_rows(ra1, dec1, k, max_radius, selection)
+
+		return self.make_table(rows, separations, selection.columns if selection else None)
+
+	def nearest_rows(self, ra1, dec1, k=1, max_radius=None, selection=None):
+		"""
+		Returns the catalog rows of the `k` sources closest to (ra1, dec1), nearest first, along with their separations.
+
+		Searches a cone just big enough to hold about k sources (if they were spread evenly over the sky),
+		widening it until it holds at least k, so the work done depends on k rather than on how crowded the
+		field is. The k nearest are then picked out with a partial sort.
+		"""
+		if k < 0:
+			raise ValueError('Can not find the {} nearest sources: k must be at least 0'.format(k))
+
+		from astropy import units as u
+		from astropy.coordinates import Angle
+
+		# Just past 180 degrees, so that with no max_radius even a source on the opposite side of the sky is found:
+		limit = 180 + zone_index.PADDING if max_radius is None else min(max_radius, 180 + zone_index.PADDING)
+
+		with profiling.span('nearest', k=k):
+			fraction = min(1, 2 * k / max(len(self), 1))
+			radius = min(limit, max(np.degrees(np.arccos(1 - 2 * fraction)), 1e-3))
+			while True:
+				rows, separations = self.cone_rows(ra1, dec1, radius, selection=selection)
+				if len(rows) >= k or radius >= limit:
+					break
+				radius = min(limit, radius * 2)
+
+			separations = separations.degree
+			if len(rows) > k:
+				with profiling.span('partition', rows=len(rows)):
+					closest = np.argpartition(separations, k - 1)[:k] if k > 0 else np.zeros(0, dtype=np.intp)
+					rows, separations = rows[closest], separations[closest]
+
+			order = np.lexsort((rows, separations))
+
+		return rows[order], Angle(separations[order], unit=u.degree)
+
+	def batch_cone_search(self, ras, decs, radii, ids=None, workers=1):
+		"""
+		Cone searches around many positions in one pass over the catalog.
+
+		`radii` can be a single radius or one per position. Returns a single Table with a 'Target' 
+		column holding the id of the position each row was found around (its position in the input 
+		if no ids are given). Rows are grouped by target in the order given, nearest first.
+
+		With more than one worker, the targets are split into shards that are searched in parallel.
+		"""
+		import_astropy()
+		from astropy import units as u
+		from astropy.coordinates import Angle
+		from astropy.table import Table
+
+		ras = np.asarray(ras, dtype=np.float64)
+		decs = np.asarray(decs, dtype=np.float64)
+		radii = np.broadcast_to(np.asarray(radii, dtype=np.float64), ras.shape)
+		ids = np.arange(len(ras)) if ids is None else np.asarray(ids)
+
+		if workers > 1 and len(ras) > 1:
+			shards = [shard for shard in np.array_split(np.arange(len(ras)), workers) if len(shard)]
+			results = list(self.pool(workers).map(lambda shard: self.batch_rows(ras, decs, radii, shard), shards))
+			targets = np.concatenate([result[0] for result in results])
+			rows = np.concatenate([result[1] for result in results])
+			separations = Angle(np.concatenate([result[2].degree for result in results]), unit=u.degree)
+		else:
+			targets, rows, separations = self.batch_rows(ras, decs, radii, np.arange(len(ras)))
+
+		order = np.lexsort((separations.degree, targets))
+		table = self.make_table(rows[order], separations[order])
+		table.add_column(Table.Column(name='Target', data=ids[targets[order]]), index=0)
+
+		return table
+
+	def batch_rows(self, ras, decs, radii, targets):
+		"""
+		Cone searches around the given `targets` (positions in ras, decs and radii).
+		Returns the target, catalog row and separation of every match.
+		"""
+		from astropy import units as u
+		from astropy.coordinates import Angle
+
+		searched = targets
+		# Gather the index candidates of every cone, remembering which target each one came from,
+		# and then check all of them with a single vectorized separation computation:
+		candidates = [self.index.candidates(ras[target], decs[target], radii[target]) for target in targets]
+		targets = np.repeat(targets, [len(rows) for rows in candidates])
+		candidates = np.concatenate(candidates or [np.zeros(0, dtype=np.intp)])
+		# Rule out most of the candidates cheaply, as in cone_rows:
+		keep = self.near(candidates, zone_index.unit_vectors(ras, decs)[targets], radii[targets])
+		targets, candidates = targets[keep], candidates[keep]
+
+		separations = self.separations(ras[targets], decs[targets], candidates)
+		catalogmsk = separations < radii[targets]
+		targets, candidates, separations = targets[catalogmsk], candidates[catalogmsk], Angle(separations[catalogmsk], unit=u.degree)
+
+		if self.delta is not None:
+			delta_targets, delta_rows, delta_separations = self.delta.batch_rows(ras, decs, radii, searched)
+			targets = np.concatenate([targets, delta_targets])
+			candidates = np.concatenate([candidates, delta_rows + self.base_size])
+			separations = Angle(np.concatenate([separations.degree, delta_separations.degree]), unit=u.degree)
+
+		return targets, candidates, separations
+
+	def near(self, rows, centers, radii):
+		"""
+		Returns which of the `rows` may be within `radii` degrees of `centers` (unit vectors, either one for every row
+		or one per row), going by the dot products of their unit vectors. That takes much less work and memory
+		than computing exact separations, and, with some padding for the rounding error of the single precision
+		vectors, can only let through a few too many rows, never too few.
+		"""
+		min_dots = np.cos(np.radians(np.minimum(radii, 180))) - zone_index.DOT_PADDING
+		keep = np.empty(len(rows), dtype=bool)
+		for start in range(0, len(rows), zone_index.BLOCK_SIZE):
+			block = slice(start, start + zone_index.BLOCK_SIZE)
+			vectors = self.unit_vectors.take(rows[block], axis=0)
+			if centers.ndim == 1:
+				keep[block] = vectors @ centers >= min_dots
+			else:
+				keep[block] = np.einsum('ij,ij->i', vectors, centers[block]) >= min_dots[block]
+
+		return keep
+
+	def separations(self, ra1, dec1, rows):
+		"""
+		Returns the exact angular separations, in degrees, between (ra1, dec1) and each of the given rows.
+		(ra1, dec1) can also be arrays, with a position per row.
+
+		Computed a block of rows at a time, so that the handful of temporary arrays astropy needs for it
+		stay small even when a search covers a large part of the catalog.
+		"""
+		separations = np.empty(len(rows))
+		for start in range(0, len(rows), zone_index.BLOCK_SIZE):
+			block = slice(start, start + zone_index.BLOCK_SIZE)
+			separations[block] = angular_separations(ra1 if np.ndim(ra1) == 0 else ra1[block], dec1 if np.ndim(dec1) == 0 else dec1[block],
+				self.columns['RAJ2000'][rows[block]], self.columns['DEJ2000'][rows[block]]).degree
+
+		return separations
+
+	def pool(self, workers):
+		"""
+		Returns this catalog's thread pool, (re)creating it with the given number of workers if needed.
+		Threads are enough since the heavy lifting is done by numpy, which releases the GIL.
+		"""
+		if self._pool_workers != workers:
+			if self._pool is not None:
+				self._pool.shutdown(wait=False)
+			self._pool = ThreadPoolExecutor(workers)
+			self._pool_workers = workers
+		return self._pool
+
+	def make_table(self, rows, separations=None, columns=None):
+		"""
+		Builds the result Table for the given row indexes, with only the given `columns` (all of them by default),
+		appending `separations` (if given) as the 'Angular Separation' column.
+		"""
+		import_astropy()
+		from astropy.table import Table
+
+		# (The angular separation is always there, so it's fine to ask for it too.)
+		columns = self.colnames if columns is None else [name for name in columns if name != 'Angular Separation']
+		unknown = [name for name in columns if name not in self.columns]
+		if unknown:
+			raise ValueError('Unknown column: {} (the columns are {})'.format(', '.join(unknown), ', '.join(self.colnames)))
+
+		with profiling.span('build table', rows=len(rows)):
+			table = Table([as_text(self.take(name, rows)) for name in columns], names=columns)
+			for name, unit in self.units.items():
+				if name in columns:
+					table[name].unit = unit
+
+			if separations is not None:
+				separations_col = Table.Column(name='Angular Separation', data=separations)
+				table.add_column(separations_col)
+
+		return table
+
+	def lookup(self, FIRST):
+		"""
+		Returns the (ra, dec, name) of the FIRST source with the given name.
+
+		Raises a KeyError if no matching FIRST source is found.
+		"""
+		try:
+			row = self.name_index.lookup(FIRST)
+		except KeyError:
+			if self.delta is None:
+				raise
+			return self.delta.lookup(FIRST)
+
+		return self.columns['RAJ2000'][row], self.columns['DEJ2000'][row], FIRST
+
+	def lookup_many(self, names):
+		"""
+		Looks up a whole list of FIRST source names at once.
+
+		Returns arrays of the ra and dec of each source, with NaN for names that aren't in the catalog.
+		"""
+		rows = self.name_index.find(names)
+		found = rows >= 0
+
+		ra = np.full(len(rows), np.nan)
+		dec = np.full(len(rows), np.nan)
+		ra[found] = self.columns['RAJ2000'][rows[found]]
+		dec[found] = self.columns['DEJ2000'][rows[found]]
+
+		if self.delta is not None and not found.all():
+			ra[~found], dec[~found] = self.delta.lookup_many(np.asarray(names)[~found])
+
+		return ra, dec
+
+	def search(self, pattern):
+		"""
+		Returns a Table of every FIRST source whose name matches the shell-style `pattern` (e.g. 'J2232*'),
+		in catalog order.
+		"""
+		rows = self.name_index.search(pattern)
+		if self.delta is not None:
+			rows = np.concatenate([rows, self.delta.name_index.search(pattern) + self.base_size])
+
+		return self.make_table(rows)
+
+
+def import_astropy():
+	"""
+	Imports the parts of astropy the searches use, in a profiling span of its own the first time, so that
+	a profile of the first search shows the (often long) import instead of leaving it unaccounted for.
+	"""
+	if 'astropy.coordinates' not in sys.modules or 'astropy.table' not in sys.modules:
+		with profiling.span('import astropy'):
+			import astropy.coordinates
+			import astropy.table
+
+
+def merge_shards(results):
+	"""
+	Merges the (rows, separations) found in each shard of a parallel search back into catalog order.
+	"""
+	from astropy import units as u
+	from astropy.coordinates import Angle
+
+	rows = np.concatenate([result[0] for result in results])
+	separations = np.concatenate([result[1].degree for result in results])
+	order = np.argsort(rows, kind='stable')
+
+	return rows[order], Angle(separations[order], unit=u.degree)
+
+
+def as_text(column):
+	"""
+	Decodes a column of fixed-width bytes (as stored in the fit file and the column cache) to unicode strings.
+	Any other column is returned as is.
+	"""
+	if column.dtype.kind == 'S':
+		return np.char.decode(column, 'ascii')
+	return column
+
+
+def angular_separations(ra1, dec1, ra, dec):
+	"""
+	Returns the angular separations (as an Angle, in degrees) between (ra1, dec1) and each of (ra, dec).
+
+	This gives exactly the same numbers as SkyCoord(ra1, dec1).separation(SkyCoord(ra, dec)), 
+	without having to build SkyCoord objects for the whole catalog.
+	"""
+	from astropy import units as u
+	from astropy.coordinates import Angle, Latitude, Longitude, angular_separation
+
+	return Angle(angular_separation(Longitude(ra1*u.degree), Latitude(dec1*u.degree), Longitude(ra*u.degree), Latitude(dec*u.degree)), unit=u.degree)
@@ -0,0 +1,209 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+import name_index
+import profiling
+import zone_index
+
+
+# Bumped whenever the layout of the cache directory changes, so old caches get rebuilt:
+CACHE_VERSION = 3
+
+# Set to False to always read the fit file directly (e.g. in tests that mock out astropy.io.fits.open):
+ENABLED = True
+
+
+def cache_path(filename):
+	return filename + '.cache'
+
+
+def checksum(filename):
+	"""
+	Returns the sha1 of the given file, read in 1MB chunks.
+	"""
+	sha1 = hashlib.sha1()
+	with open(filename, 'rb') as file:
+		for chunk in iter(lambda: file.read(1 << 20), b''):
+			sha1.update(chunk)
+	return sha1.hexdigest()
+
+
+def build(filename, zone_height=zone_index.DEFAULT_ZONE_HEIGHT):
+	"""
+	Converts the FIRST catalog in `filename` into a directory of .npy files (one per column),
+	which can then be memory-mapped by load() instead of decoding the fit file on every run.
+
+	Along with the catalog's own columns, the cache holds precomputed (single precision) unit vectors
+	for every source, the zone index used for cone searches and the sorted name index used for source lookups.
+	"""
+	from astropy.io import fits  # Only needed when (re)building, so loading the cache doesn't pay for importing it.
+
+	stat = os.stat(filename)
+	with fits.open(filename) as hdul:
+		data = hdul[1].data
+		# The last delta segment already folded into the file, if it has been compacted (see ingest.py):
+		delta_seq = hdul[1].header.get('DELTASEQ', 0)
+		columns = fits_columns(data)
+
+	unit_vectors = zone_index.unit_vectors(columns['RAJ2000'], columns['DEJ2000'])
+	index = zone_index.ZoneIndex.build(columns['RAJ2000'], columns['DEJ2000'], zone_height)
+	names = name_index.NameIndex.build(columns['FIRST'])
+
+	meta = {
+		'version': CACHE_VERSION,
+		'columns': list(columns),
+		'zone_height': zone_height,
+		'source_mtime_ns': stat.st_mtime_ns,
+		'source_size': stat.st_size,
+		'source_sha1': checksum(filename),
+		'delta_seq': delta_seq,
+	}
+
+	# Write everything into a temporary directory first, and only swap it in once it's complete:
+	path = cache_path(filename)
+	temp_path = '{}.{}.tmp'.format(path, os.getpid())
+	shutil.rmtree(temp_path, ignore_errors=True)
+	os.makedirs(temp_path)
+	try:
+		for name, column in columns.items():
+			np.save(os.path.join(temp_path, name + '.npy'), column)
+		np.save(os.path.join(temp_path, 'unit_vectors.npy'), unit_vectors)
+		np.save(os.path.join(temp_path, 'zone_keys.npy'), index.keys)
+		np.save(os.path.join(temp_path, 'zone_order.npy'), index.order)
+		np.save(os.path.join(temp_path, 'name_sorted.npy'), names.names)
+		np.save(os.path.join(temp_path, 'name_order.npy'), names.order)
+		with open(os.path.join(temp_path, 'meta.json'), 'w') as file:
+			json.dump(meta, file)
+
+		old_path = '{}.{}.old'.format(path, os.getpid())
+		if os.path.exists(path):
+			os.rename(path, old_path)
+		os.rename(temp_path, path)
+		shutil.rmtree(old_path, ignore_errors=True)
+	finally:
+		# Only still there if writing the cache failed part way:
+		shutil.rmtree(temp_path, ignore_errors=True)
+
+	return meta
+
+
+def is_plain(column):
+	# Float and string columns without any scaling, whose values are stored in the file exactly as numpy reads them:
+	return column.format[-1:] in ('D', 'E', 'A') and column.bscale in (None, 1) and column.bzero in (None, 0)
+
+
+def fits_columns(data):
+	"""
+	Returns the columns of a FITS table (the data of a fits BinTableHDU) as numpy arrays, in native byte order so
+	they can be used straight from a memory map, and with strings kept as the fixed-width bytes stored in the file
+	(much smaller than unicode).
+
+	Plain float and string columns are copied straight out of the file's records: going through astropy's
+	data.field() would keep a converted copy of each column (four times bigger, for strings) around as well.
+	"""
+	from astropy.io import fits
+
+	records = data.view(np.ndarray) if isinstance(data, fits.FITS_rec) else None
+	columns = {}
+	for name in data.dtype.names:
+		if records is not None and is_plain(data.columns[name]):
+			values = records[name]
+		else:
+			values = np.asarray(data[name])
+		columns[name] = values.astype(values.dtype.newbyteorder('='))
+
+	return columns
+
+
+def is_fresh(filename, meta):
+	"""
+	Checks whether the cache described by `meta` was built from the current contents of `filename`.
+
+	The file's size and mtime are checked first. If only the mtime changed (say the file was copied
+	or touched), the checksum decides, and the cache's recorded mtime is updated to match.
+	"""
+	if meta.get('version') != CACHE_VERSION:
+		return False
+
+	try:
+		stat = os.stat(filename)
+	except OSError:
+		# The fit file is gone, but the cache still holds the whole catalog.
+		return True
+
+	if stat.st_size != meta['source_size']:
+		return False
+	if stat.st_mtime_ns == meta['source_mtime_ns']:
+		return True
+	if checksum(filename) != meta['source_sha1']:
+		return False
+
+	meta['source_mtime_ns'] = stat.st_mtime_ns
+	try:
+		with open(os.path.join(cache_path(filename), 'meta.json'), 'w') as file:
+			json.dump(meta, file)
+	except OSError:
+		pass
+
+	return True
+
+
+def read_meta(filename):
+	try:
+		with open(os.path.join(cache_path(filename), 'meta.json')) as file:
+			return json.load(file)
+	except (OSError, ValueError):
+		return None
+
+
+def load(filename, build_if_missing=True):
+	"""
+	Memory-maps the cached columns for `filename`, building (or rebuilding) the cache first
+	if it's missing or out of date.
+
+	Returns a dict with the 'columns', 'unit_vectors', 'index', 'names' and 'meta' of the cache,
+	or None if there is no usable cache (e.g. the fit file can't be found, the cache
+	can't be written, or ENABLED is off), in which case the caller should read the fit file itself.
+	"""
+	if not ENABLED:
+		return None
+
+	meta = read_meta(filename)
+	if meta is None or not is_fresh(filename, meta):
+		if not build_if_missing or not os.path.exists(filename):
+			return None
+		try:
+			with profiling.span('build column cache'):
+				meta = build(filename)
+		except OSError:
+			return None
+
+	path = cache_path(filename)
+	try:
+		columns = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in meta['columns']}
+		unit_vectors = np.load(os.path.join(path, 'unit_vectors.npy'), mmap_mode='r')
+		index = zone_index.ZoneIndex(meta['zone_height'],
+			np.load(os.path.join(path, 'zone_keys.npy'), mmap_mode='r'),
+			np.load(os.path.join(path, 'zone_order.npy'), mmap_mode='r'))
+		names = name_index.NameIndex(
+			np.load(os.path.join(path, 'name_sorted.npy'), mmap_mode='r'),
+			np.load(os.path.join(path, 'name_order.npy'), mmap_mode='r'))
+	except (OSError, ValueError):
+		return None
+
+	return {'columns': columns, 'unit_vectors': unit_vectors, 'index': index, 'names': names, 'meta': meta}
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Builds the memory-mapped column cache for a FIRST catalog fit file")
+	parser.add_argument('filename', nargs='?', default='FIRST_data.fit', help='FIRST catalog fit file (default: FIRST_data.fit)')
+
+	args = parser.parse_args()
+
+	meta = build(args.filename)
+	print('Cached {} columns of {} in {}'.format(len(meta['columns']), args.filename, cache_path(args.filename)))
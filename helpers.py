@@ -1,42 +1,179 @@
-from astropy import units as u
-from astropy.coordinates import SkyCoord, Angle
-from astropy.io import fits 
-from astropy.table import Table
-import numpy as np
+import threading
+
+import profiling
+from query_cache import QueryCache
 
 
 FILENAME = 'FIRST_data.fit'
 
-def get_FIRST_sources_within_radius(ra1, dec1, radius=1):
-	c1 = SkyCoord(ra=ra1*u.degree, dec=dec1*u.degree)
-	with fits.open(FILENAME) as hdul:  
-		data = hdul[1].data	
+# How many threads cone searches are split over (see FIRSTCatalog.cone_search). 
+# The command line tools set this from their --workers option.
+WORKERS = 1
+
+# The SDSS classifications (c1) that searches can be limited to, by name:
+CLASS_CODES = {'galaxy': 'g', 'star': 's', 'other': ' '}
+
+# Results of recent cone searches, reused for repeated or overlapping searches (see query_cache.py).
+# The command line tools replace this with one that's saved to disk when given --query-cache.
+QUERY_CACHE = QueryCache()
+
+# Catalogs that have already been loaded, keyed by filename, so that repeated queries
+# in the same process don't have to re-read the fit file:
+_catalogs = {}
+# Held while loading or refreshing one, so threads asking for the same catalog at once only load it once:
+_catalogs_lock = threading.Lock()
+
 
-	# Get the 2nd and 3rd columns into their own numpy arrays and then create a catalog with the coordinates:
-	ra = data['RAJ2000']
-	dec = data['DEJ2000']
-	catalog = SkyCoord(ra=ra*u.degree, dec=dec*u.degree)
+def get_catalog(filename=None):
+	"""
+	Returns the FIRSTCatalog for the given fit file (FILENAME by default), loading it the first time it is asked for.
+	After that, rows ingested since (see ingest_FIRST_sources) are merged into it as they arrive.
+	"""
+	# Imported here so that the command line tools only load numpy and astropy once they need the catalog:
+	from catalog import FIRSTCatalog
+
+	filename = filename or FILENAME
+	with _catalogs_lock:
+		if filename not in _catalogs:
+			with profiling.span('load catalog'):
+				_catalogs[filename] = FIRSTCatalog.open(filename)
+		else:
+			_catalogs[filename] = _catalogs[filename].refreshed()
 
-	# Get indexes of FIRST sources that are within the given radius:
-	separations = c1.separation(catalog)
-	catalogmsk = separations < radius*u.degree
+		return _catalogs[filename]
 
-	# Use catalogmsk to get the relevant rows from data. 
-	masked_data = np.compress(catalogmsk, data, axis=0)
-	masked_separations = np.compress(catalogmsk, separations, axis=0)
 
-	# Using the AstroPy Table class in order to concat the column with angular separation from the user-defined position. 
-	# Technically not necessary for the visualization, but computation cost is not very much 
-	# and we already have everything we need right here.
-	table = Table(data=masked_data)
-	separations_col = Table.Column(name='Angular Separation', data=masked_separations)
-	table.add_column(separations_col)
+def clear_catalog_cache():
+	"""
+	Forgets every loaded catalog (and every cached search result), so the next query re-reads the fit file.
+	"""
+	_catalogs.clear()
+	QUERY_CACHE.clear()
+
+
+
+def get_FIRST_sources_within_radius(ra1, dec1, radius=1, catalog=None, min_flux=None, max_flux=None, classes=None, columns=None):
+	"""
+	Returns a Table of the FIRST sources within `radius` degrees of (ra1, dec1), 
+	with an extra column for the angular separation from the given position.
+
+	The search can be limited to sources with an integrated flux (Fint, in mJy) between `min_flux` and `max_flux`,
+	and to the SDSS `classes` given (c1 codes, see CLASS_CODES). Only the catalog `columns` listed are returned,
+	if given. Sources are filtered before their separations are computed, so selective searches are quicker.
+	"""
+	if catalog is None:
+		catalog = get_catalog()
+
+	selection = make_selection(min_flux, max_flux, classes, columns)
+	with profiling.span('cone search', radius=radius):
+		if selection is not None:
+			# Only unfiltered results are kept in the query cache:
+			return catalog.cone_search(ra1, dec1, radius, workers=WORKERS, selection=selection)
+
+		with profiling.span('query cache'):
+			table = QUERY_CACHE.get(catalog.version, ra1, dec1, radius)
+		if table is None:
+			table = catalog.cone_search(ra1, dec1, radius, workers=WORKERS)
+			QUERY_CACHE.put(catalog.version, ra1, dec1, radius, table)
 
 	return table
 
 
 
-def get_search_coordinates(ra1, dec1, source):
+def make_selection(min_flux=None, max_flux=None, classes=None, columns=None):
+	"""
+	Returns the catalog.Selection for the given filters and columns, or None if there are none.
+	"""
+	if min_flux is None and max_flux is None and classes is None and columns is None:
+		return None
+
+	from catalog import Selection
+
+	return Selection(min_flux, max_flux, classes, columns)
+
+
+
+def get_nearest_FIRST_sources(ra1, dec1, k=1, max_radius=None, catalog=None, min_flux=None, max_flux=None, classes=None, columns=None):
+	"""
+	Returns a Table of the `k` FIRST sources closest to (ra1, dec1), nearest first, with an extra column 
+	for the angular separation. If `max_radius` is given, sources that far away or further are left out.
+	The other arguments filter the sources and columns as for get_FIRST_sources_within_radius.
+	"""
+	if catalog is None:
+		catalog = get_catalog()
+
+	return catalog.nearest(ra1, dec1, k, max_radius, make_selection(min_flux, max_flux, classes, columns))
+
+
+
+def get_FIRST_sources_for_targets(targets, radius=1, catalog=None):
+	"""
+	Runs a cone search around every target in `targets` (a Table as returned by read_targets) at once.
+
+	Targets without their own radius use `radius`. Returns one Table with a 'Target' column, 
+	grouped by target and sorted by angular separation within each target.
+	"""
+	if catalog is None:
+		catalog = get_catalog()
+
+	radii = targets['radius'] if 'radius' in targets.colnames else radius
+	ids = targets['id'] if 'id' in targets.colnames else None
+
+	return catalog.batch_cone_search(targets['ra'], targets['dec'], radii, ids, workers=WORKERS)
+
+
+
+def ingest_FIRST_sources(rows, filename=None):
+	"""
+	Adds new sources to the catalog in the given fit file (FILENAME by default) without rebuilding it.
+
+	`rows` is a Table (or a dict of columns) with the catalog's columns. The sources are written to a small
+	delta segment next to the fit file (see ingest.py), and every search and name lookup from then on
+	finds them, in this process and in any other using the same catalog. Returns the number of sources added.
+	"""
+	import ingest
+
+	filename = filename or FILENAME
+	catalog = get_catalog(filename)
+	with profiling.span('ingest'):
+		ingest.append(filename, rows, {name: column.dtype for name, column in catalog.columns.items()})
+	# Merge the new segment in now, rather than on the next query:
+	get_catalog(filename)
+
+	return len(rows['RAJ2000'])
+
+
+
+def read_table(filename):
+	"""
+	Reads a Table from a FITS file (.fit or .fits) or, otherwise, a CSV file.
+	"""
+	from astropy.table import Table
+
+	if filename.lower().endswith(('.fit', '.fits')):
+		return Table.read(filename, format='fits')
+	return Table.read(filename, format='ascii.csv')
+
+
+
+def read_targets(filename):
+	"""
+	Reads a list of search positions from a CSV or FITS file.
+
+	The file needs ra and dec columns (in decimal degrees), and can also have radius (in degrees) 
+	and id columns. Column names are not case sensitive.
+	"""
+	targets = read_table(filename)
+	targets.rename_columns(targets.colnames, [name.lower() for name in targets.colnames])
+	for name in ('ra', 'dec'):
+		if name not in targets.colnames:
+			raise ValueError('{} has no {} column'.format(filename, name))
+
+	return targets
+
+
+
+def get_search_coordinates(ra1, dec1, source, lookup=None):
 	"""
 	Returns the right ascension (ra) and declination (dec) of the search query, along with the name of the source if appropriate.
 
@@ -45,10 +182,13 @@ def get_search_coordinates(ra1, dec1, source):
 	If a source is given and can not be found, requests a new set of coordinates from the user and returns None as the source name.
 	If a source is not given, and a right ascension and declination have been provided, then returns those and None as the source name.
 	If no search criteria has been provided, requests a right ascension and declination from the user (in degrees).
+
+	Sources are looked up with get_coordinates_for_FIRST_source, unless another `lookup` function 
+	(such as QueryClient.lookup) is given.
 	"""
 	if source:
 		try:
-			return get_coordinates_for_FIRST_source(source)
+			return (lookup or get_coordinates_for_FIRST_source)(source)
 		except KeyError:
 			print('No matching FIRST source found.')
 			source = None
@@ -63,23 +203,41 @@ def get_search_coordinates(ra1, dec1, source):
 
 
 
-def get_coordinates_for_FIRST_source(FIRST):
+def get_coordinates_for_FIRST_source(FIRST, catalog=None):
 	"""
 	Used for extension #2, which allows the user to specify a FIRST source around which
 	to perform the query.
 
-	This implementation is less efficient because we are opening and reading the fit file twice - 
-	but during testing, this hasn't made a noticable difference in terms of speed and it has the
-	benefit of separating the code for extension #2 out from the rest of the code. 
+	The lookup is done against the same loaded catalog used for the cone search, 
+	so the fit file is only read once per process.
 
 	Raises a KeyError if no matching FIRST source is found.
 	"""
-	with fits.open(FILENAME) as hdul:
-		data=hdul[1].data
+	if catalog is None:
+		catalog = get_catalog()
+
+	return catalog.lookup(FIRST)
+
+
+
+def get_coordinates_for_FIRST_sources(names, catalog=None):
+	"""
+	Looks up many FIRST sources by name in one go.
+
+	Returns arrays of the ra and dec of each source, with NaN for names that aren't in the catalog.
+	"""
+	if catalog is None:
+		catalog = get_catalog()
+
+	return catalog.lookup_many(names)
 
-	table = Table(data=data)
-	table.add_index('FIRST')
-	
-	row = table.loc[FIRST]
 
-	return row['RAJ2000'], row['DEJ2000'], FIRST
+
+def find_FIRST_sources(pattern, catalog=None):
+	"""
+	Returns a Table of the FIRST sources whose names match the given pattern, e.g. 'J2232*'.
+	"""
+	if catalog is None:
+		catalog = get_catalog()
+
+	return catalog.search(pattern)
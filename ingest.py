@@ -0,0 +1,263 @@
+import argparse
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+
+import numpy as np
+
+import column_cache
+
+
+# Rows added to a catalog since its fit file was written are kept in small "delta segments" next to it,
+# one .npz file per ingest, numbered in the order they were added:
+#
+#	FIRST_data.fit.deltas/0000000001.npz
+#	FIRST_data.fit.deltas/0000000002.npz
+#
+# Catalogs loaded with FIRSTCatalog.open merge these into every query (see FIRSTCatalog.refreshed), and
+# compact() folds them into the fit file (and its column cache) every so often. The fit file records the
+# last segment folded into it in its DELTASEQ header keyword, so segments already in it are never counted twice.
+SEGMENT_PATTERN = re.compile(r'^(\d{10})\.npz$')
+
+# The last segment folded into the fit file by a compaction, so new segments are numbered after it
+# even once the folded ones are gone:
+FOLDED_FILENAME = 'folded'
+
+# A compaction lock older than this is assumed to have been left behind by a compaction that crashed:
+STALE_LOCK_SECONDS = 3600
+
+# How often the background compactor folds new rows into the fit file, in seconds:
+DEFAULT_COMPACT_INTERVAL = 300
+
+
+def delta_path(filename):
+	return filename + '.deltas'
+
+
+def source_stat(filename):
+	"""
+	Returns the (size, mtime) of the fit file, which changes whenever a compaction replaces it (None if it's missing).
+	"""
+	try:
+		stat = os.stat(filename)
+	except OSError:
+		return None
+	return stat.st_size, stat.st_mtime_ns
+
+
+def segments(filename, after=0):
+	"""
+	Returns the numbers of the delta segments of `filename` after segment `after`, in order.
+	"""
+	try:
+		names = os.listdir(delta_path(filename))
+	except OSError:
+		return ()
+
+	matches = [SEGMENT_PATTERN.match(name) for name in names]
+	return tuple(sorted(seq for seq in (int(match.group(1)) for match in matches if match) if seq > after))
+
+
+def segment_path(filename, seq):
+	return os.path.join(delta_path(filename), '{:010d}.npz'.format(seq))
+
+
+def read_segments(filename, seqs):
+	"""
+	Reads the given delta segments of `filename`, returning their columns joined together in order
+	(or None if there are none).
+	"""
+	parts = []
+	for seq in seqs:
+		with np.load(segment_path(filename, seq)) as segment:
+			parts.append({name: segment[name] for name in segment.files})
+	if not parts:
+		return None
+
+	return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+
+def folded(filename):
+	try:
+		with open(os.path.join(delta_path(filename), FOLDED_FILENAME)) as file:
+			return int(file.read())
+	except (OSError, ValueError):
+		return 0
+
+
+def to_schema(rows, dtypes):
+	"""
+	Converts new rows (an astropy Table, or a dict of columns) to the catalog's columns and types, given as a
+	dict of column name to numpy dtype. Every column has to be there, and no others; names can be str or bytes.
+	"""
+	names = list(rows.colnames if hasattr(rows, 'colnames') else rows)
+	missing = [name for name in dtypes if name not in names]
+	if missing:
+		raise ValueError('New rows are missing the catalog columns: {}'.format(', '.join(missing)))
+	unknown = [name for name in names if name not in dtypes]
+	if unknown:
+		raise ValueError('New rows have columns the catalog does not: {} (the columns are {})'.format(', '.join(unknown), ', '.join(dtypes)))
+
+	columns = {}
+	for name, dtype in dtypes.items():
+		dtype = np.dtype(dtype).newbyteorder('=')
+		column = rows[name]
+		if hasattr(column, 'filled'):
+			# Blank cells (e.g. sources without an SDSS classification in a CSV file) come back masked:
+			column = column.filled(' ' if dtype.kind == 'S' else np.nan)
+		column = np.asarray(column)
+		if dtype.kind == 'S':
+			if column.dtype.kind == 'U':
+				column = np.char.encode(column, 'ascii')
+			if len(column) and np.char.str_len(column).max() > dtype.itemsize:
+				raise ValueError('Column {} holds values longer than the catalog allows ({} characters)'.format(name, dtype.itemsize))
+		columns[name] = column.astype(dtype)
+
+	for name in ('RAJ2000', 'DEJ2000'):
+		if not np.isfinite(columns[name]).all():
+			raise ValueError('Every new row needs a position, but {} has blank values'.format(name))
+
+	return columns
+
+
+def append(filename, rows, dtypes):
+	"""
+	Adds new rows to the catalog in `filename` as a new delta segment, which every catalog opened from it
+	picks up on its next query. `dtypes` gives the catalog's columns and their types (see to_schema).
+
+	Returns the number of the new segment.
+	"""
+	columns = to_schema(rows, dtypes)
+
+	path = delta_path(filename)
+	os.makedirs(path, exist_ok=True)
+	# Write the segment under a temporary name first, so no reader ever sees half of it:
+	temp_path = os.path.join(path, '.{}.{}.tmp.npz'.format(os.getpid(), threading.get_ident()))
+	np.savez(temp_path, **columns)
+	try:
+		seq = max(segments(filename) + (folded(filename),)) + 1
+		while True:
+			# Linking fails if another process took this number first, in which case try the next one:
+			try:
+				os.link(temp_path, segment_path(filename, seq))
+				return seq
+			except FileExistsError:
+				seq += 1
+	finally:
+		os.remove(temp_path)
+
+
+def compact(filename):
+	"""
+	Folds the delta segments of `filename` into the fit file itself, and rebuilds its column cache to match,
+	so they no longer have to be merged into every query. Meant to be run in the background (see Compactor):
+	queries carry on against the old fit file and segments until the new ones are swapped in.
+
+	Returns the number of rows folded in (0 if there was nothing to do, or another compaction is running).
+	"""
+	from astropy.io import fits
+
+	path = delta_path(filename)
+	lock_path = os.path.join(path, '.compacting')
+	try:
+		if time.time() - os.path.getmtime(lock_path) > STALE_LOCK_SECONDS:
+			os.remove(lock_path)
+	except OSError:
+		pass
+	try:
+		os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+	except OSError:
+		return 0
+
+	temp_path = '{}.{}.compacting'.format(filename, os.getpid())
+	try:
+		with fits.open(filename) as hdul:
+			already = hdul[1].header.get('DELTASEQ', 0)
+			seqs = segments(filename, after=already)
+			delta = read_segments(filename, seqs)
+			if delta is None:
+				return 0
+
+			# Copy the catalog's columns (with their formats and units) into a longer table and fill in the new rows:
+			size = len(hdul[1].data)
+			hdu = fits.BinTableHDU.from_columns(hdul[1].columns, header=hdul[1].header, nrows=size + len(delta['RAJ2000']))
+			for name in hdul[1].columns.names:
+				hdu.data[name][size:] = delta[name]
+			hdu.header['DELTASEQ'] = (seqs[-1], 'last delta segment folded into this file')
+			fits.HDUList([hdul[0].copy(), hdu]).writeto(temp_path)
+
+		column_cache.build(temp_path)
+
+		# Swap in the new cache and then the new fit file. A query that sees one without the other just rebuilds
+		# the cache, and the segments are only removed once the fit file holding them is in place:
+		cache = column_cache.cache_path(filename)
+		old_cache = '{}.{}.old'.format(cache, os.getpid())
+		if os.path.exists(cache):
+			os.rename(cache, old_cache)
+		os.rename(column_cache.cache_path(temp_path), cache)
+		os.replace(temp_path, filename)
+		shutil.rmtree(old_cache, ignore_errors=True)
+
+		with open(os.path.join(path, FOLDED_FILENAME), 'w') as file:
+			file.write(str(seqs[-1]))
+		for seq in segments(filename):
+			if seq <= seqs[-1]:
+				os.remove(segment_path(filename, seq))
+
+		return len(delta['RAJ2000'])
+	finally:
+		if os.path.exists(temp_path):
+			os.remove(temp_path)
+		shutil.rmtree(column_cache.cache_path(temp_path), ignore_errors=True)
+		os.remove(lock_path)
+
+
+class Compactor(threading.Thread):
+	"""
+	Runs compact() on a catalog every `interval` seconds in the background, for a long-running service
+	(e.g. the query server) that keeps taking in new rows:
+
+		compactor = Compactor('FIRST_data.fit')
+		compactor.start()
+		...
+		compactor.stop()
+	"""
+
+	def __init__(self, filename, interval=DEFAULT_COMPACT_INTERVAL):
+		super().__init__(name='compactor', daemon=True)
+		self.filename = filename
+		self.interval = interval
+		self.stopped = threading.Event()
+
+	def run(self):
+		while not self.stopped.wait(self.interval):
+			try:
+				compact(self.filename)
+			except Exception as e:
+				# Keep going: the rows stay in their segments until a later compaction manages to fold them in.
+				print('Compacting {} failed: {}'.format(self.filename, e), file=sys.stderr)
+
+	def stop(self):
+		self.stopped.set()
+		self.join()
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Adds new sources to a FIRST catalog without rebuilding it, or folds the ones added so far into its fit file")
+	parser.add_argument('rows', nargs='?', help='CSV or FITS file of new sources, with the same columns as the catalog.')
+	parser.add_argument('-c', '--catalog', type=str, default='FIRST_data.fit', help='FIRST catalog fit file (default: FIRST_data.fit)')
+	parser.add_argument('--compact', action='store_true', help='fold every source added so far into the fit file (after adding the new rows, if any).')
+
+	args = parser.parse_args()
+	if not args.rows and not args.compact:
+		parser.error('give a file of new rows, --compact, or both')
+
+	if args.rows:
+		import helpers
+		count = helpers.ingest_FIRST_sources(helpers.read_table(args.rows), args.catalog)
+		print('Added {} sources to {}'.format(count, args.catalog))
+	if args.compact:
+		print('Folded {} sources into {}'.format(compact(args.catalog), args.catalog))
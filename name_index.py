@@ -0,0 +1,104 @@
+import fnmatch
+
+import numpy as np
+
+from zone_index import row_dtype
+
+
+class NameIndex:
+	"""
+	Index of the FIRST source names, for looking sources up by name.
+
+	The names are kept sorted (as fixed-width bytes) alongside `order`, which maps each position
+	in the sorted array back to its catalog row, so a name is found with a binary search.
+	Both arrays are saved in the column cache, so they only need to be sorted once.
+	"""
+
+	def __init__(self, names, order):
+		self.names = names
+		self.order = order
+
+	@classmethod
+	def build(cls, names):
+		names = np.asarray(names)
+		if names.dtype.kind != 'S':
+			names = np.char.encode(names, 'ascii')
+
+		order = np.argsort(names, kind='stable').astype(row_dtype(len(names)))
+
+		return cls(names[order], order)
+
+	def __len__(self):
+		return len(self.order)
+
+	def encode(self, names):
+		"""
+		Converts names to the fixed-width bytes of the index. Names that can't be in the index
+		(too long, or not ascii) come back as None.
+		"""
+		encoded = []
+		for name in names:
+			if isinstance(name, str):
+				try:
+					name = name.encode('ascii')
+				except UnicodeEncodeError:
+					name = None
+			if name is not None and len(name) > self.names.dtype.itemsize:
+				name = None
+			encoded.append(name)
+		return encoded
+
+	def find(self, names):
+		"""
+		Returns the catalog row of each of the given names, or -1 for names that aren't in the catalog.
+		"""
+		encoded = self.encode(names)
+		keys = np.array([b'' if name is None else name for name in encoded], dtype=self.names.dtype)
+		valid = np.array([name is not None for name in encoded], dtype=bool)
+		if len(self.names) == 0:
+			return np.full(len(keys), -1)
+
+		positions = np.minimum(np.searchsorted(self.names, keys), len(self.names) - 1)
+		found = valid & (self.names[positions] == keys)
+
+		return np.where(found, self.order[positions], -1)
+
+	def lookup(self, name):
+		"""
+		Returns the catalog row of the source with the given name.
+
+		Raises a KeyError if no matching FIRST source is found.
+		"""
+		row = self.find([name])[0]
+		if row < 0:
+			raise KeyError(name)
+		return row
+
+	def search(self, pattern):
+		"""
+		Returns the (sorted) catalog rows of every source whose name matches the shell-style
+		`pattern`, e.g. 'J2232*'.
+
+		Only the names sharing the pattern's literal prefix are looked at.
+		"""
+		prefix_end = min([pattern.index(c) for c in '*?[' if c in pattern] or [len(pattern)])
+		prefix = self.encode([pattern[:prefix_end]])[0]
+		if prefix is None:
+			return np.zeros(0, dtype=np.intp)
+
+		start = np.searchsorted(self.names, np.array(prefix, dtype=self.names.dtype), side='left')
+		if prefix_end == len(pattern):
+			# No wildcards at all, so only the names equal to the pattern match (and none, for an empty pattern):
+			end = np.searchsorted(self.names, np.array(prefix, dtype=self.names.dtype), side='right') if prefix else start
+		elif len(prefix) < self.names.dtype.itemsize:
+			end = np.searchsorted(self.names, np.array(prefix + b'\xff', dtype=self.names.dtype), side='left')
+		else:
+			end = np.searchsorted(self.names, np.array(prefix, dtype=self.names.dtype), side='right')
+
+		rows = self.order[start:end]
+		if prefix_end < len(pattern) and pattern[prefix_end:] != '*':
+			# Something more than a plain prefix search, so check the rest of the pattern too:
+			matches = [fnmatch.fnmatchcase(name.decode('ascii'), pattern) for name in self.names[start:end]]
+			rows = rows[np.array(matches, dtype=bool)]
+
+		return np.sort(rows)
@@ -0,0 +1,226 @@
+import contextlib
+import json
+import sys
+import threading
+import time
+import tracemalloc
+
+
+# Functions called with every finished span (see add_hook). While there are none, span() does nothing.
+_hooks = []
+
+_local = threading.local()
+
+
+class Span:
+	"""
+	One timed stage of a query, e.g. the cone search or writing the html table.
+
+	Records the wall time, the (process) CPU time and, when tracemalloc is tracing, how much memory the stage
+	left allocated and the most it had allocated at once, relative to when it started. Spans opened while
+	another is open on the same thread are nested inside it, and named with its path, e.g. 'main/cone search'.
+	"""
+
+	def __init__(self, name, attributes):
+		self.name = name
+		self.attributes = attributes
+
+	def __enter__(self):
+		stack = getattr(_local, 'stack', None)
+		if stack is None:
+			stack = _local.stack = []
+		self.path = '/'.join([span.path for span in stack[-1:]] + [self.name])
+		self.depth = len(stack)
+		stack.append(self)
+
+		self.tracing = tracemalloc.is_tracing()
+		if self.tracing:
+			current, peak = tracemalloc.get_traced_memory()
+			if stack[:-1] and stack[-2].tracing:
+				stack[-2].child_peak = max(stack[-2].child_peak, peak)
+			tracemalloc.reset_peak()
+			self.start_memory = current
+			self.child_peak = current
+
+		self.start_cpu = time.process_time()
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, *exc_info):
+		wall = time.perf_counter() - self.start
+		cpu = time.process_time() - self.start_cpu
+		record = {'name': self.path, 'depth': self.depth, 'start': self.start, 'wall_ms': wall * 1000, 'cpu_ms': cpu * 1000}
+
+		_local.stack.pop()
+		if self.tracing and tracemalloc.is_tracing():
+			current, peak = tracemalloc.get_traced_memory()
+			peak = max(peak, self.child_peak)
+			record['alloc_bytes'] = current - self.start_memory
+			record['peak_bytes'] = peak - self.start_memory
+			# The enclosing span's peak includes this one's:
+			if _local.stack and _local.stack[-1].tracing:
+				_local.stack[-1].child_peak = max(_local.stack[-1].child_peak, peak)
+
+		record.update(self.attributes)
+		for hook in list(_hooks):
+			hook(record)
+
+
+class NoSpan:
+	# What span() returns while nothing is listening, so instrumented code costs next to nothing.
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		pass
+
+
+_NO_SPAN = NoSpan()
+
+
+def span(name, **attributes):
+	"""
+	Times the stage run inside the `with` block, e.g.
+
+		with profiling.span('sort'):
+			table.sort('Angular Separation')
+
+	Extra keyword arguments (such as the number of rows) are added to the span's record.
+	"""
+	if not _hooks:
+		return _NO_SPAN
+	return Span(name, attributes)
+
+
+def add_hook(hook):
+	"""
+	Calls `hook` with the record (a dict) of every span that finishes from now on, on the thread that ran it.
+	Memory is only recorded while tracemalloc is tracing.
+	"""
+	_hooks.append(hook)
+
+
+def remove_hook(hook):
+	_hooks.remove(hook)
+
+
+class Recorder:
+	"""
+	Collects the records of every span finished while it's in use:
+
+		with profiling.Recorder() as recorder:
+			table_tool.main(...)
+		print_breakdown(recorder.spans)
+	"""
+
+	def __init__(self, trace_memory=False):
+		self.trace_memory = trace_memory
+		self.spans = []
+		self._started_tracing = False
+
+	def __enter__(self):
+		if self.trace_memory and not tracemalloc.is_tracing():
+			tracemalloc.start()
+			self._started_tracing = True
+		add_hook(self.spans.append)
+		return self
+
+	def __exit__(self, *exc_info):
+		remove_hook(self.spans.append)
+		if self._started_tracing:
+			tracemalloc.stop()
+
+
+class Aggregator:
+	"""
+	Thread-safe running totals per span name, for a long-running service (e.g. the query server):
+
+		aggregator = profiling.Aggregator()
+		profiling.add_hook(aggregator.record)
+	"""
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._totals = {}
+
+	def record(self, span):
+		with self._lock:
+			totals = self._totals.setdefault(span['name'], {'count': 0, 'wall_ms': 0.0, 'cpu_ms': 0.0, 'max_wall_ms': 0.0})
+			totals['count'] += 1
+			totals['wall_ms'] += span['wall_ms']
+			totals['cpu_ms'] += span['cpu_ms']
+			totals['max_wall_ms'] = max(totals['max_wall_ms'], span['wall_ms'])
+
+	def summary(self):
+		with self._lock:
+			return {name: dict(totals, mean_wall_ms=totals['wall_ms'] / totals['count']) for name, totals in self._totals.items()}
+
+
+def json_lines_hook(file=None):
+	"""
+	Returns a hook that writes every span to `file` (stderr by default) as a line of JSON.
+	"""
+	def write(span):
+		print(json.dumps(span), file=file or sys.stderr, flush=True)
+	return write
+
+
+def print_breakdown(spans, file=None):
+	"""
+	Prints the time (and memory, if it was traced) of each stage, indented under the stage it was part of.
+	Spans with the same name are added up.
+	"""
+	file = file or sys.stderr
+	totals = {}
+	for span in spans:
+		total = totals.setdefault(span['name'], {'depth': span['depth'], 'start': span['start'], 'count': 0, 'wall_ms': 0.0, 'cpu_ms': 0.0})
+		total['start'] = min(total['start'], span['start'])
+		total['count'] += 1
+		total['wall_ms'] += span['wall_ms']
+		total['cpu_ms'] += span['cpu_ms']
+		if 'peak_bytes' in span:
+			total['alloc_mb'] = total.get('alloc_mb', 0) + span['alloc_bytes'] / 2**20
+			total['peak_mb'] = max(total.get('peak_mb', 0), span['peak_bytes'] / 2**20)
+
+	print('{:<40} {:>6} {:>10} {:>10} {:>10} {:>10}'.format('stage', 'calls', 'wall ms', 'cpu ms', 'alloc MB', 'peak MB'), file=file)
+	# Parents finish after their children, so order the stages by when they (and the stages they're part of)
+	# first started, which lists each stage after the one it's part of:
+	def order(name):
+		parts = name.split('/')
+		return [totals.get('/'.join(parts[:depth + 1]), {'start': 0})['start'] for depth in range(len(parts))]
+
+	for name in sorted(totals, key=order):
+		total = totals[name]
+		label = '  ' * total['depth'] + name.rsplit('/', 1)[-1]
+		memory = '{:>10.2f} {:>10.2f}'.format(total['alloc_mb'], total['peak_mb']) if 'peak_mb' in total else '{:>10} {:>10}'.format('-', '-')
+		print('{:<40} {:>6} {:>10.2f} {:>10.2f} {}'.format(label, total['count'], total['wall_ms'], total['cpu_ms'], memory), file=file)
+
+
+OUTPUTS = ('text', 'json')
+
+
+@contextlib.contextmanager
+def profiled(output, name, file=None):
+	"""
+	Profiles everything run inside the `with` block as one span called `name`, for the --profile option
+	of the command line tools. With output 'text', a breakdown of the stages is printed at the end;
+	with 'json', each stage is written as a line of JSON as it finishes. With no output, does nothing.
+	"""
+	if output is None:
+		yield
+		return
+
+	recorder = Recorder(trace_memory=True)
+	hook = json_lines_hook(file) if output == 'json' else None
+	with recorder:
+		if hook:
+			add_hook(hook)
+		try:
+			with span(name):
+				yield
+		finally:
+			if hook:
+				remove_hook(hook)
+
+	if output == 'text':
+		print_breakdown(recorder.spans, file)
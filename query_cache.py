@@ -0,0 +1,208 @@
+from collections import OrderedDict
+import os
+import threading
+
+# helpers creates a QueryCache when it's imported, so numpy, astropy and the catalog module are only
+# imported by the methods that need them, to keep the command line tools quick to start.
+
+# Default bound on the memory held by cached results:
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Safety margin (in degrees) when deciding whether a cached cone contains a new one:
+CONTAINMENT_MARGIN = 1e-9
+
+
+def table_bytes(table):
+	import numpy as np
+
+	return sum(np.asarray(table[name]).nbytes for name in table.colnames)
+
+
+class QueryCache:
+	"""
+	Memoizes cone search results, for users who keep coming back to the same fields.
+
+	Results are kept per catalog version, least recently used first out once they take up more than
+	`max_bytes`. A search that falls entirely inside a cached cone is answered from the cached rows
+	(just checking their separations from the new center) instead of searching the catalog again,
+	so a 1 degree search followed by a 0.25 degree search around the same point only searches once.
+
+	If `directory` is given, results are also saved there (as .npz files) and reused across processes,
+	with the same bound on their total size.
+	"""
+
+	def __init__(self, max_bytes=DEFAULT_MAX_BYTES, directory=None):
+		self.max_bytes = max_bytes
+		self.directory = directory
+		self.version = None
+		self.hits = 0
+		self.superset_hits = 0
+		self.misses = 0
+		self._entries = OrderedDict()  # (ra, dec, radius) -> Table, most recently used last
+		self._bytes = 0
+		self._lock = threading.Lock()
+		if directory:
+			os.makedirs(directory, exist_ok=True)
+
+	def stats(self):
+		with self._lock:
+			return {'hits': self.hits, 'superset_hits': self.superset_hits, 'misses': self.misses,
+				'entries': len(self._entries), 'bytes': self._bytes}
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+			self._bytes = 0
+
+	def get(self, version, ra1, dec1, radius):
+		"""
+		Returns the cached result (a copy, so callers are free to sort it) of the search, or None if
+		it has to be done against the catalog. Results are never shared between catalog versions.
+		"""
+		if version is None:
+			return None
+
+		key = (float(ra1), float(dec1), float(radius))
+		with self._lock:
+			self.check_version(version)
+			table = self._entries.get(key)
+			if table is None and self.directory:
+				table = self.load(version, key)
+			if table is not None:
+				self._entries.move_to_end(key)
+				self.hits += 1
+				return table.copy()
+
+			container = self.find_container(key)
+			if container is None:
+				self.misses += 1
+				return None
+			self.superset_hits += 1
+
+		return filter_cone(container, *key)
+
+	def put(self, version, ra1, dec1, radius, table):
+		if version is None:
+			return
+
+		key = (float(ra1), float(dec1), float(radius))
+		table = table.copy()
+		with self._lock:
+			self.check_version(version)
+			if key in self._entries:
+				return
+			self.add(key, table)
+			if self.directory:
+				self.save(version, key, table)
+
+	def check_version(self, version):
+		# A new catalog version makes every cached result stale:
+		if version != self.version:
+			self._entries.clear()
+			self._bytes = 0
+			self.version = version
+			if self.directory:
+				for filename in os.listdir(self.directory):
+					if filename.endswith('.npz') and not filename.startswith(version + '_'):
+						os.remove(os.path.join(self.directory, filename))
+
+	def add(self, key, table):
+		size = table_bytes(table)
+		if size > self.max_bytes:
+			return
+		self._entries[key] = table
+		self._bytes += size
+		while self._bytes > self.max_bytes:
+			_, evicted = self._entries.popitem(last=False)
+			self._bytes -= table_bytes(evicted)
+
+	def find_container(self, key):
+		"""
+		Returns the smallest cached result whose cone contains the cone of `key`, if there is one.
+		"""
+		import numpy as np
+		from catalog import angular_separations
+
+		ra1, dec1, radius = key
+		entries = [(cached, table) for cached, table in self._entries.items() if cached[2] >= radius]
+		if not entries:
+			return None
+
+		# The distances to every cached cone that's big enough, in one go (a call per cone adds up with many cached):
+		cached = np.array([entry[0] for entry in entries])
+		distances = angular_separations(cached[:, 0], cached[:, 1], ra1, dec1).degree
+		contained = ((cached[:, 0] == ra1) & (cached[:, 1] == dec1)) | (distances + radius <= cached[:, 2] - CONTAINMENT_MARGIN)
+
+		best = None
+		for (_, table), inside in zip(entries, contained):
+			if inside and (best is None or len(table) < len(best)):
+				best = table
+		return best
+
+	def path(self, version, key):
+		return os.path.join(self.directory, '{}_{!r}_{!r}_{!r}.npz'.format(version, *key))
+
+	def save(self, version, key, table):
+		import numpy as np
+
+		path = self.path(version, key)
+		temp_path = '{}.{}.tmp'.format(path, os.getpid())
+		try:
+			with open(temp_path, 'wb') as file:
+				np.savez(file, colnames=np.array(table.colnames), **{'column_{}'.format(i): np.asarray(table[name]) for i, name in enumerate(table.colnames)})
+			os.replace(temp_path, path)
+		except OSError:
+			return
+		self.trim_directory()
+
+	def load(self, version, key):
+		import numpy as np
+		from astropy import units as u
+		from astropy.table import Table
+
+		path = self.path(version, key)
+		try:
+			with np.load(path) as saved:
+				names = list(saved['colnames'])
+				table = Table([saved['column_{}'.format(i)] for i in range(len(names))], names=names)
+			os.utime(path)  # Keep the least recently used files first in line for removal.
+		except (OSError, KeyError, ValueError):
+			return None
+
+		if 'Angular Separation' in table.colnames:
+			table['Angular Separation'].unit = u.degree
+		self.add(key, table)
+		return table
+
+	def trim_directory(self):
+		# Remove the least recently used files until the directory fits in max_bytes again:
+		files = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith('.npz')]
+		files = sorted((os.stat(path).st_mtime_ns, os.stat(path).st_size, path) for path in files)
+		total = sum(size for _, size, _ in files)
+		for _, size, path in files:
+			if total <= self.max_bytes:
+				break
+			os.remove(path)
+			total -= size
+
+
+def filter_cone(table, ra1, dec1, radius):
+	"""
+	Cuts a cached cone search result down to the sources within `radius` degrees of (ra1, dec1).
+
+	The separations are recomputed from the new center (with the same formula as the catalog's cone search),
+	so the result is exactly what searching the catalog would have returned.
+	"""
+	from astropy import units as u
+	from astropy.table import Table
+	import numpy as np
+
+	from catalog import angular_separations
+
+	separations = angular_separations(ra1, dec1, np.asarray(table['RAJ2000']), np.asarray(table['DEJ2000']))
+	catalogmsk = separations < radius*u.degree
+
+	table = table[catalogmsk]
+	table.replace_column('Angular Separation', Table.Column(name='Angular Separation', data=separations[catalogmsk]))
+
+	return table
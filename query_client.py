@@ -0,0 +1,68 @@
+import json
+import os
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+
+# Where to find the query server (see query_server.py). Can be changed with the FIRST_SERVER environment variable.
+DEFAULT_URL = 'http://127.0.0.1:8765'
+
+
+class QueryClient:
+	"""
+	Thin client for a running query_server, so the command line tools can skip loading
+	the catalog themselves. Only uses the standard library, so it's quick to import.
+	"""
+
+	def __init__(self, url=None, timeout=30):
+		self.url = (url or os.environ.get('FIRST_SERVER') or DEFAULT_URL).rstrip('/')
+		self.timeout = timeout
+
+	def get(self, endpoint, timeout=None, **params):
+		params = {key: value for key, value in params.items() if value is not None}
+		with urlopen('{}/{}?{}'.format(self.url, endpoint, urlencode(params)), timeout=timeout or self.timeout) as response:
+			return response.read()
+
+	def is_running(self):
+		"""
+		Checks (quickly) whether a server is answering at this client's url.
+		"""
+		try:
+			self.get('stats', timeout=0.5)
+			return True
+		except (URLError, OSError):
+			return False
+
+	def cone_search(self, ra1, dec1, radius=1, output_format='json'):
+		"""
+		Returns the sources within `radius` degrees of (ra1, dec1), sorted by angular separation:
+		as a dict of columns for the 'json' format, or the text of the page for 'html'.
+		"""
+		body = self.get('cone', ra=ra1, dec=dec1, radius=radius, format=output_format)
+		if output_format == 'json':
+			return json.loads(body)['rows']
+		return body.decode()
+
+	def lookup(self, FIRST):
+		"""
+		Same as helpers.get_coordinates_for_FIRST_source, including raising a KeyError if no matching FIRST source is found.
+		"""
+		try:
+			result = json.loads(self.get('lookup', name=FIRST))
+		except HTTPError as e:
+			if e.code == 404:
+				raise KeyError(FIRST)
+			raise
+
+		return result['ra'], result['dec'], FIRST
+
+	def plot(self, ra1, dec1, radius=0.25, source=None, density_threshold=None):
+		"""
+		Returns the PNG of the visualization_tool plot for the given search
+		(drawn with the server's default density threshold, unless one is given).
+		"""
+		return self.get('plot', ra=ra1, dec=dec1, radius=radius, source=source, density_threshold=density_threshold)
+
+	def stats(self):
+		return json.loads(self.get('stats'))
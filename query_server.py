@@ -0,0 +1,276 @@
+import argparse
+from collections import OrderedDict, defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import json
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+import matplotlib
+matplotlib.use('Agg')  # The server never has a screen to draw on.
+import matplotlib.pyplot as plt
+import numpy as np
+
+import helpers
+import ingest
+import profiling
+import visualization_tool
+
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# How many recent requests per endpoint the latency stats are computed over:
+STATS_WINDOW = 1000
+
+# How many rendered plots are kept, so asking for the same plot again doesn't draw it again:
+PLOT_CACHE_SIZE = 100
+
+
+class LatencyStats:
+	"""
+	Thread-safe record of how long recent requests took, per endpoint.
+	"""
+
+	def __init__(self, window=STATS_WINDOW):
+		self._lock = threading.Lock()
+		self._latencies = defaultdict(lambda: deque(maxlen=window))
+		self._counts = defaultdict(int)
+		self._errors = defaultdict(int)
+
+	def record(self, endpoint, seconds, error=False):
+		with self._lock:
+			self._latencies[endpoint].append(seconds)
+			self._counts[endpoint] += 1
+			if error:
+				self._errors[endpoint] += 1
+
+	def summary(self):
+		with self._lock:
+			stats = {}
+			for endpoint, latencies in self._latencies.items():
+				milliseconds = np.array(latencies) * 1000
+				stats[endpoint] = {
+					'count': self._counts[endpoint],
+					'errors': self._errors[endpoint],
+					'mean_ms': float(milliseconds.mean()),
+					'p50_ms': float(np.percentile(milliseconds, 50)),
+					'p95_ms': float(np.percentile(milliseconds, 95)),
+					'max_ms': float(milliseconds.max()),
+				}
+			return stats
+
+
+class QueryError(Exception):
+	"""
+	A request that can't be answered, along with the HTTP status to answer it with.
+	"""
+
+	def __init__(self, status, message):
+		super().__init__(message)
+		self.status = status
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+	"""
+	Answers the requests of one client connection. The catalog, stats and plot lock are shared
+	by every handler through the server.
+
+	Endpoints (all GET):
+		/cone?ra=..&dec=..&radius=..&format=json|html    (or source=.. instead of ra and dec)
+		/lookup?name=..
+		/plot?ra=..&dec=..&radius=..&density_threshold=.. (or source=..), returns a PNG
+		/stats                                            (including the query cache's hits and misses, and with
+		                                                   --profile, the time spent in each stage of the queries)
+	"""
+
+	def do_GET(self):
+		url = urlparse(self.path)
+		endpoint = url.path.strip('/')
+		params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+		handlers = {'cone': self.cone, 'lookup': self.lookup, 'plot': self.plot, 'stats': self.stats}
+
+		start = time.perf_counter()
+		error = False
+		try:
+			if endpoint not in handlers:
+				raise QueryError(404, 'Unknown endpoint: /{}'.format(endpoint))
+			with profiling.span(endpoint):
+				content_type, body = handlers[endpoint](params)
+			status = 200
+		except QueryError as e:
+			error = True
+			status, content_type, body = e.status, 'application/json', json.dumps({'error': str(e)}).encode()
+		except Exception as e:
+			# Still answer (and count) a request that fails unexpectedly, rather than dropping the connection:
+			error = True
+			status, content_type, body = 500, 'application/json', json.dumps({'error': 'Internal error: {}'.format(e)}).encode()
+
+		self.send_response(status)
+		self.send_header('Content-Type', content_type)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+		if endpoint != 'stats':
+			self.server.stats.record(endpoint, time.perf_counter() - start, error)
+
+	def log_message(self, format, *args):
+		# Keep the terminal quiet: /stats is how to see what the server is doing.
+		pass
+
+	def float_param(self, params, name, default=None, low=None, high=None):
+		if name not in params:
+			if default is None:
+				raise QueryError(400, 'Missing parameter: {}'.format(name))
+			return default
+		try:
+			value = float(params[name])
+		except ValueError:
+			raise QueryError(400, 'Parameter {} must be a number'.format(name))
+		# float() happily reads 'nan' and 'inf', which no search (or JSON answer) can use:
+		if not np.isfinite(value):
+			raise QueryError(400, 'Parameter {} must be a finite number'.format(name))
+		if (low is not None and value < low) or (high is not None and value > high):
+			raise QueryError(400, 'Parameter {} must be between {} and {}'.format(name, low, 'inf' if high is None else high))
+		return value
+
+	def search_position(self, params):
+		"""
+		Works out the (ra, dec, source) of a cone or plot request, which gives either a position or a source name.
+		"""
+		source = params.get('source')
+		if source and ('ra' not in params or 'dec' not in params):
+			try:
+				return helpers.get_coordinates_for_FIRST_source(source, catalog=self.server.current_catalog())
+			except KeyError:
+				raise QueryError(404, 'No matching FIRST source found.')
+
+		return self.float_param(params, 'ra'), self.float_param(params, 'dec', low=-90, high=90), source
+
+	def cone(self, params):
+		ra1, dec1, source = self.search_position(params)
+		radius = self.float_param(params, 'radius', 1, low=0)
+
+		table = helpers.get_FIRST_sources_within_radius(ra1, dec1, radius=radius, catalog=self.server.current_catalog())
+		table.sort('Angular Separation')
+
+		output_format = params.get('format', 'json')
+		if output_format == 'html':
+			# The same page table_tool.save_html writes:
+			html = io.StringIO()
+			table.write(html, format='html')
+			return 'text/html; charset=utf-8', html.getvalue().encode()
+		if output_format == 'json':
+			rows = {name: np.asarray(table[name]).tolist() for name in table.colnames}
+			return 'application/json', json.dumps({'ra': float(ra1), 'dec': float(dec1), 'radius': radius, 'source': source, 'rows': rows}).encode()
+
+		raise QueryError(400, 'Unknown format: {}'.format(output_format))
+
+	def lookup(self, params):
+		if 'name' not in params:
+			raise QueryError(400, 'Missing parameter: name')
+		try:
+			ra1, dec1, name = helpers.get_coordinates_for_FIRST_source(params['name'], catalog=self.server.current_catalog())
+		except KeyError:
+			raise QueryError(404, 'No matching FIRST source found.')
+
+		return 'application/json', json.dumps({'name': name, 'ra': float(ra1), 'dec': float(dec1)}).encode()
+
+	def plot(self, params):
+		ra1, dec1, source = self.search_position(params)
+		radius = self.float_param(params, 'radius', 0.25, low=0)
+		density_threshold = int(self.float_param(params, 'density_threshold', visualization_tool.DENSITY_THRESHOLD, low=0))
+		search_term = source if source else '{:.2f}° {:.2f}°'.format(ra1, dec1)
+		catalog = self.server.current_catalog()
+		key = (float(ra1), float(dec1), radius, search_term, density_threshold, catalog.version)
+
+		with self.server.plot_lock:
+			if key in self.server.plots:
+				self.server.plots.move_to_end(key)
+				return 'image/png', self.server.plots[key]
+
+		table = helpers.get_FIRST_sources_within_radius(ra1, dec1, radius=radius, catalog=catalog)
+
+		# pyplot keeps global state, so only one thread can draw at a time:
+		png = io.BytesIO()
+		with self.server.plot_lock:
+			fig, ax = visualization_tool.plot_sources(table, radius, search_term, density_threshold)
+			fig.savefig(png, format='png')
+			plt.close(fig)
+
+			if key[-1] is not None:
+				self.server.plots[key] = png.getvalue()
+				if len(self.server.plots) > PLOT_CACHE_SIZE:
+					self.server.plots.popitem(last=False)
+
+		return 'image/png', png.getvalue()
+
+	def stats(self, params):
+		stats = self.server.stats.summary()
+		stats['query_cache'] = helpers.QUERY_CACHE.stats()
+		if self.server.profile is not None:
+			stats['profile'] = self.server.profile.summary()
+		return 'application/json', json.dumps(stats).encode()
+
+
+class QueryServer(ThreadingHTTPServer):
+	"""
+	HTTP server that keeps one catalog loaded and answers every client's queries from it,
+	each client on its own thread.
+	"""
+	daemon_threads = True
+
+	def __init__(self, catalog, host=DEFAULT_HOST, port=DEFAULT_PORT, profile=False):
+		super().__init__((host, port), QueryHandler)
+		self.catalog = catalog
+		self.stats = LatencyStats()
+		self.plot_lock = threading.Lock()
+		self.plots = OrderedDict()  # Recently drawn PNGs, most recently used last (guarded by plot_lock)
+		# Running totals of the time spent in each stage of the queries (see profiling.py), if asked for:
+		self.profile = None
+		if profile:
+			self.profile = profiling.Aggregator()
+			profiling.add_hook(self.profile.record)
+
+	def current_catalog(self):
+		# Picks up sources ingested since the last request (and compactions of the catalog), see ingest.py:
+		self.catalog = self.catalog.refreshed()
+		return self.catalog
+
+	def server_close(self):
+		super().server_close()
+		if self.profile is not None:
+			profiling.remove_hook(self.profile.record)
+			self.profile = None
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Serves FIRST cone searches, name lookups and plots from a catalog kept in memory")
+	parser.add_argument('--host', type=str, default=DEFAULT_HOST, help='address to listen on (default: {})'.format(DEFAULT_HOST))
+	parser.add_argument('-p', '--port', type=int, default=DEFAULT_PORT, help='port to listen on (default: {})'.format(DEFAULT_PORT))
+	parser.add_argument('-c', '--catalog', type=str, default=helpers.FILENAME, help='FIRST catalog fit file (default: {})'.format(helpers.FILENAME))
+	parser.add_argument('--query-cache', type=str, help='reuse search results saved in this directory, and save new ones there.')
+	parser.add_argument('--profile', action='store_true', help='keep totals of the time spent in each stage of the queries, shown by /stats.')
+	parser.add_argument('--compact-every', type=float, metavar='SECONDS', help='fold newly ingested sources into the catalog file this often, in the background (see ingest.py).')
+
+	args = parser.parse_args()
+	if args.query_cache:
+		helpers.QUERY_CACHE = helpers.QueryCache(directory=args.query_cache)
+
+	catalog = helpers.get_catalog(args.catalog)
+	server = QueryServer(catalog, args.host, args.port, args.profile)
+	print('Serving {} sources from {} on http://{}:{}'.format(len(catalog), args.catalog, args.host, args.port))
+	compactor = None
+	if args.compact_every:
+		compactor = ingest.Compactor(args.catalog, args.compact_every)
+		compactor.start()
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		if compactor is not None:
+			compactor.stop()
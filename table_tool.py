@@ -1,37 +1,96 @@
 import argparse
 
-from astropy import units as u
-from astropy.coordinates import SkyCoord
-from astropy.io import fits 
-from astropy.table import Table
-import numpy as np
+# Only light modules are imported here: astropy is imported (by catalog.py) once a search is actually run
+# in this process, so --help and searches answered by a query server start quickly.
+import helpers
+import profiling
+from helpers import get_FIRST_sources_for_targets, get_FIRST_sources_within_radius, get_nearest_FIRST_sources, get_search_coordinates, read_targets
+from query_client import QueryClient
+import writers
 
-from helpers import get_FIRST_sources_within_radius, get_search_coordinates
 
-
-def main(ra1, dec1, radius=1, source=None):
+def main(ra1, dec1, radius=1, source=None, output_format='html', limit=None, offset=0, page_size=None, nearest=None, filters=None):
 	# Get the point from the user if no command line arguments were given:
 	# or get the coordinates of the named source if a name was given:
 	ra1, dec1, source = get_search_coordinates(ra1, dec1, source)
 	
 	# Display search criteria: 
 	search_term = source if source else '{:.2f} {:.2f}'.format(ra1, dec1)
-	print('Finding FIRST sources within a {} {} radius of {}'.format(radius, 'degree', search_term))
+	if nearest is not None:
+		# Only the closest few sources (within the radius, if there is one), which come already sorted:
+		within = ' within {} {}'.format(radius, 'degree') if radius is not None else ''
+		print('Finding the {} FIRST sources nearest to {}{}'.format(nearest, search_term, within))
+		table = get_nearest_FIRST_sources(ra1, dec1, nearest, max_radius=radius, **(filters or {}))
+	elif limit is not None:
+		print('Finding FIRST sources within a {} {} radius of {}'.format(radius, 'degree', search_term))
 
-	# Calculate which sources we want to show in the table
-	table = get_FIRST_sources_within_radius(ra1, dec1, radius=radius)
+		# Only the first offset + limit rows are output, so pick out just those (nearest first, like the sort below)
+		# rather than making a table of every source in the cone:
+		table = get_nearest_FIRST_sources(ra1, dec1, offset + limit, max_radius=radius, **(filters or {}))
+	else:
+		print('Finding FIRST sources within a {} {} radius of {}'.format(radius, 'degree', search_term))
+
+		# Calculate which sources we want to show in the table
+		# (filters holds any flux, classification and column arguments for the search)
+		table = get_FIRST_sources_within_radius(ra1, dec1, radius=radius, **(filters or {}))
 	
-	# Sort the table by distance from the given point
-	table.sort('Angular Separation')
+		# Sort the table by distance from the given point
+		with profiling.span('sort'):
+			table.sort('Angular Separation')
+
+	# Only keep the requested slice of the results:
+	if offset or limit is not None:
+		table = table[offset:None if limit is None else offset + limit]
+
+	with profiling.span('write ' + output_format):
+		if output_format == 'html':
+			save_html(table, page_size=page_size)
+		else:
+			save_table(table, output_format)
+
+	return table
+
+
+def remote_main(client, ra1, dec1, radius=1, source=None):
+	# Same as main, but the query is answered by a running query_server:
+	ra1, dec1, source = get_search_coordinates(ra1, dec1, source, lookup=client.lookup)
+
+	search_term = source if source else '{:.2f} {:.2f}'.format(ra1, dec1)
+	print('Finding FIRST sources within a {} {} radius of {}'.format(radius, 'degree', search_term))
+
+	html = client.cone_search(ra1, dec1, radius=radius, output_format='html')
+	with open('table.html', 'w') as file:
+		file.write(html)
+	print('Done! View your result by opening table.html')
 
-	save_html(table)
+
+def batch_main(filename, radius=1, split=False):
+	# Run the cone searches for every target in the file in one go:
+	targets = read_targets(filename)
+	print('Finding FIRST sources around {} targets from {}'.format(len(targets), filename))
+
+	table = get_FIRST_sources_for_targets(targets, radius=radius)
+
+	if split:
+		# One table per target (even if nothing was found around it), named after the target's id:
+		ids = targets['id'] if 'id' in targets.colnames else range(len(targets))
+		for target in ids:
+			save_html(table[table['Target'] == target], 'table_{}.html'.format(target))
+	else:
+		save_html(table)
 
 	return table
 
 
-def save_html(table):
-	table.write('table.html', format='html', overwrite=True)
-	print('Done! View your result by opening table.html')	
+def save_html(table, filename='table.html', page_size=None):
+	# Stream the rows out to the page(s) rather than building the whole html document in memory:
+	writers.write_html(table, filename, page_size=page_size)
+	print('Done! View your result by opening {}'.format(filename))
+
+
+def save_table(table, output_format):
+	filename = writers.write_table(table, 'table' + writers.EXTENSIONS[output_format], output_format)
+	print('Done! Your result is in {}'.format(filename))
 
 
 if __name__ == "__main__":
@@ -40,13 +99,71 @@ if __name__ == "__main__":
 	parser.add_argument('-dec', type=float, help='declination of your chosen position, in decimal degrees')
 
 	# Extension #1: allow user to pass in radius
-	parser.add_argument('-r', '--radius', type=float, default=1, help='search radius (in degrees)')
+	parser.add_argument('-r', '--radius', type=float, help='search radius (in degrees, default: 1). With --nearest, how far away sources can be (default: no limit).')
+
+	# Only the closest sources to the position:
+	parser.add_argument('-n', '--nearest', type=int, help='only find this many of the sources closest to the position.')
 
 	# Extension #2: allow user to specify FIRST source around which to perform the query
 	parser.add_argument('-s', '--source', type=str, help='FIRST source around which to perform the query.')
 
 	# See comments in visualization_tool.py for notes about extension3. 
 
+	# Batch mode: search around every position listed in a CSV or FITS file
+	parser.add_argument('-b', '--batch', type=str, help='CSV or FITS file of positions to search around, with ra, dec and optional radius and id columns.')
+	parser.add_argument('--split', action='store_true', help='in batch mode, write one table per target instead of one combined table.')
+
+	# Filters, applied before the separations are even computed, and which columns to output:
+	parser.add_argument('--min-flux', type=float, help='only sources with an integrated flux density of at least this many mJy.')
+	parser.add_argument('--max-flux', type=float, help='only sources with an integrated flux density of at most this many mJy.')
+	parser.add_argument('--class', dest='classes', nargs='+', choices=list(helpers.CLASS_CODES), help='only sources with these SDSS classifications.')
+	parser.add_argument('--columns', nargs='+', help='only output these columns (and the angular separation), e.g. FIRST Fint.')
+
+	# Output options, for large searches:
+	parser.add_argument('-f', '--format', choices=writers.FORMATS, default='html', help='format of the output table (default: html).')
+	parser.add_argument('--limit', type=int, help='only output this many of the nearest sources.')
+	parser.add_argument('--offset', type=int, default=0, help='skip this many of the nearest sources before output.')
+	parser.add_argument('--page-size', type=int, help='split the html table over pages of this many rows, linked from table.html.')
+
+	# Split the catalog scan over several threads, for large searches:
+	parser.add_argument('-w', '--workers', type=int, default=1, help='number of threads to split each search over (default: 1).')
+
+	# Keep search results on disk, to answer repeated (or smaller) searches of the same fields quickly:
+	parser.add_argument('--query-cache', type=str, help='reuse search results saved in this directory, and save new ones there.')
+
+	# Use a running query_server.py when there is one, unless told not to:
+	parser.add_argument('--local', action='store_true', help='always load the catalog in this process, even if a query server is running.')
+
+	# Show where the time (and memory) went, stage by stage:
+	parser.add_argument('--profile', nargs='?', const='text', choices=profiling.OUTPUTS, help='print the time and memory of each stage of the query to stderr, as a table (text, the default) or json lines. Implies --local.')
+
 	args = parser.parse_args()
+	filters = {'min_flux': args.min_flux, 'max_flux': args.max_flux, 'columns': args.columns,
+		'classes': [helpers.CLASS_CODES[name] for name in args.classes] if args.classes else None}
+	filters = {name: value for name, value in filters.items() if value is not None}
+	if args.batch and (args.nearest is not None or filters):
+		parser.error('--nearest, --min-flux, --max-flux, --class and --columns can not be used with --batch')
+	if args.nearest is not None and args.nearest < 1:
+		parser.error('--nearest must be at least 1')
+	# The output options only apply to a single search's table:
+	if args.batch and (args.format != 'html' or args.limit is not None or args.offset or args.page_size is not None):
+		parser.error('--format, --limit, --offset and --page-size can not be used with --batch')
+	if (args.limit is not None and args.limit < 0) or args.offset < 0:
+		parser.error('--limit and --offset can not be negative')
+	if args.page_size is not None and args.page_size < 1:
+		parser.error('--page-size must be at least 1')
+	# With --nearest, the radius is only a limit, and there is none unless it's given:
+	radius = args.radius if args.radius is not None or args.nearest is not None else 1
+	if args.query_cache:
+		helpers.QUERY_CACHE = helpers.QueryCache(directory=args.query_cache)
+	helpers.WORKERS = args.workers
 	
-	main(args.ra, args.dec, args.radius, args.source)
\ No newline at end of file
+	client = QueryClient()
+	plain_html = args.format == 'html' and args.limit is None and not args.offset and args.page_size is None
+	with profiling.profiled(args.profile, 'table_tool'):
+		if args.batch:
+			batch_main(args.batch, radius, args.split)
+		elif plain_html and args.nearest is None and not filters and not args.local and not args.profile and client.is_running():
+			remote_main(client, args.ra, args.dec, radius, args.source)
+		else:
+			main(args.ra, args.dec, radius, args.source, args.format, args.limit, args.offset, args.page_size, args.nearest, filters)
\ No newline at end of file
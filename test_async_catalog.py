@@ -0,0 +1,151 @@
+import numpy as np
+
+import asyncio
+import threading
+import time
+import unittest
+from unittest import mock
+
+from async_catalog import AsyncCatalog, CatalogBusy
+import helpers
+from test_catalog import random_catalog
+
+
+class TestAsyncCatalog(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        helpers.QUERY_CACHE.clear()
+        self.catalog = random_catalog(20000)
+        self.async_catalog = AsyncCatalog(catalog=self.catalog)
+
+    def tearDown(self):
+        self.async_catalog.close()
+        helpers.QUERY_CACHE.clear()
+
+    async def test_cone_search_and_lookup(self):
+        table = await self.async_catalog.cone_search(150, 20, 3)
+        expected = self.catalog.cone_search(150, 20, 3)
+        self.assertEqual(list(expected['FIRST']), list(table['FIRST']))
+
+        galaxies = await self.async_catalog.cone_search(150, 20, 3, classes='g', columns=['FIRST'])
+        self.assertEqual(['FIRST', 'Angular Separation'], galaxies.colnames)
+        self.assertLess(len(galaxies), len(table))
+
+        nearest = await self.async_catalog.nearest(150, 20, 5)
+        self.assertEqual(list(self.catalog.nearest(150, 20, 5)['FIRST']), list(nearest['FIRST']))
+
+        name = self.catalog.columns['FIRST'][5]
+        self.assertEqual((self.catalog.columns['RAJ2000'][5], self.catalog.columns['DEJ2000'][5], name), await self.async_catalog.lookup(name))
+        ra, dec = await self.async_catalog.lookup_many([name, 'missing'])
+        np.testing.assert_array_equal([self.catalog.columns['RAJ2000'][5], np.nan], ra)
+
+    async def test_never_prompts(self):
+        with mock.patch('builtins.input', side_effect=AssertionError('prompted')):
+            with self.assertRaises(KeyError):
+                await self.async_catalog.lookup('J000000.0+000000')
+            with self.assertRaises(KeyError):
+                await self.async_catalog.search_coordinates(source='J000000.0+000000')
+            with self.assertRaises(ValueError):
+                await self.async_catalog.search_coordinates()
+            self.assertEqual((338.12, 11.53, None), await self.async_catalog.search_coordinates(338.12, 11.53, 'J000000.0+000000'))
+
+    async def test_identical_requests_are_coalesced(self):
+        calls = []
+
+        def slow_search(ra1, dec1, radius, catalog, **filters):
+            calls.append((ra1, dec1, radius))
+            time.sleep(0.1)
+            return catalog.cone_search(ra1, dec1, radius)
+
+        with mock.patch('helpers.get_FIRST_sources_within_radius', side_effect=slow_search):
+            tables = await asyncio.gather(*[self.async_catalog.cone_search(150, 20, 1) for _ in range(10)],
+                self.async_catalog.cone_search(150, 20, 2))
+
+        self.assertEqual(2, len(calls))
+        self.assertEqual(0, self.async_catalog.pending)
+        # Every caller gets a table of their own:
+        tables[0].sort('FIRST', reverse=True)
+        self.assertEqual(list(tables[2]['FIRST']), list(self.catalog.cone_search(150, 20, 1)['FIRST']))
+
+    async def test_bounded_concurrency(self):
+        running = []
+        most = []
+        lock = threading.Lock()
+
+        def slow_lookup(name, catalog):
+            with lock:
+                running.append(name)
+                most.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.remove(name)
+            return 0.0, 0.0, name
+
+        async_catalog = AsyncCatalog(catalog=self.catalog, concurrency=2)
+        ticks = 0
+
+        async def tick():
+            # The event loop carries on while the lookups run:
+            nonlocal ticks
+            while async_catalog.pending:
+                ticks += 1
+                await asyncio.sleep(0.005)
+
+        with mock.patch('helpers.get_coordinates_for_FIRST_source', side_effect=slow_lookup):
+            results = await asyncio.gather(*[async_catalog.lookup('J{}'.format(i)) for i in range(6)], tick())
+        async_catalog.close()
+
+        self.assertEqual(['J{}'.format(i) for i in range(6)], [result[2] for result in results[:6]])
+        self.assertEqual(2, max(most))
+        self.assertGreater(ticks, 5)
+
+    async def test_back_pressure(self):
+        release = threading.Event()
+
+        def blocked_lookup(name, catalog):
+            release.wait(5)
+            return 0.0, 0.0, name
+
+        async_catalog = AsyncCatalog(catalog=self.catalog, concurrency=1, max_waiting=1)
+        with mock.patch('helpers.get_coordinates_for_FIRST_source', side_effect=blocked_lookup):
+            first = asyncio.ensure_future(async_catalog.lookup('a'))
+            await asyncio.sleep(0.05)  # 'a' is now running
+            second = asyncio.ensure_future(async_catalog.lookup('b'))
+            await asyncio.sleep(0)  # ...and 'b' waiting
+            with self.assertRaises(CatalogBusy):
+                await async_catalog.lookup('c')
+            # The same request as one already waiting doesn't add to the queue:
+            also_second = asyncio.ensure_future(async_catalog.lookup('b'))
+
+            release.set()
+            self.assertEqual([(0.0, 0.0, 'a'), (0.0, 0.0, 'b'), (0.0, 0.0, 'b')], await asyncio.gather(first, second, also_second))
+        async_catalog.close()
+
+    async def test_back_pressure_only_counts_requests_that_cannot_run(self):
+        release = threading.Event()
+
+        def blocked_lookup(name, catalog):
+            release.wait(5)
+            return 0.0, 0.0, name
+
+        with mock.patch('helpers.get_coordinates_for_FIRST_source', side_effect=blocked_lookup):
+            # A free slot means the request runs straight away, even when nothing may wait:
+            async_catalog = AsyncCatalog(catalog=self.catalog, concurrency=4, max_waiting=0)
+            release.set()
+            self.assertEqual((0.0, 0.0, 'a'), await async_catalog.lookup('a'))
+            async_catalog.close()
+
+            # A burst all at once: two run, three wait, and the rest are turned away.
+            release.clear()
+            async_catalog = AsyncCatalog(catalog=self.catalog, concurrency=2, max_waiting=3)
+            futures = [asyncio.ensure_future(async_catalog.lookup('J{}'.format(i))) for i in range(10)]
+            await asyncio.sleep(0)
+            release.set()
+            results = await asyncio.gather(*futures, return_exceptions=True)
+            async_catalog.close()
+
+        self.assertEqual([(0.0, 0.0, 'J{}'.format(i)) for i in range(5)], results[:5])
+        self.assertTrue(all(isinstance(result, CatalogBusy) for result in results[5:]))
+
+
+if __name__ == '__main__':
+    unittest.main()
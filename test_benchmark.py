@@ -0,0 +1,41 @@
+from astropy.io import fits
+import numpy as np
+
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+import benchmark
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_source_names(self):
+        names = benchmark.source_names(np.array([338.146875, 0.0, 359.99999]), np.array([11.703889, -0.5, 89.99]))
+        self.assertEqual([b'J223235.2+114214', b'J000000.0-003000', b'J235959.9+895924'], list(names))
+
+    def test_generated_catalog_has_FIRST_columns(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'synthetic.fit')
+            benchmark.generate_catalog(filename, 1000)
+            with fits.open(filename) as hdul:
+                columns = hdul[1].columns
+                data = hdul[1].data
+
+                self.assertEqual(['FIRST', 'RAJ2000', 'DEJ2000', 'Fint', 'c1'], columns.names)
+                self.assertEqual(['16A', 'D', 'D', 'E', '1A'], [str(column.format) for column in columns])
+                self.assertEqual(1000, len(data))
+                self.assertTrue(np.all((data['DEJ2000'] >= -11) & (data['DEJ2000'] <= 68)))
+                self.assertTrue(set(data['c1']) <= {'', 'g', 's'})
+
+    def test_compare_finds_regressions(self):
+        old = {'commit': 'a', 'sizes': {'10': {'benchmarks': {'fast': {'median_ms': 10.0}, 'slow': {'median_ms': 10.0}}}}}
+        new = {'commit': 'b', 'sizes': {'10': {'benchmarks': {'fast': {'median_ms': 11.0}, 'slow': {'median_ms': 13.0}}}}}
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual([('10', 'slow')], benchmark.compare(old, new, threshold=0.2))
+
+
+if __name__ == '__main__':
+    unittest.main()
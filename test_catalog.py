@@ -0,0 +1,160 @@
+import numpy as np
+
+import unittest
+
+from catalog import FIRSTCatalog, Selection, angular_separations
+
+
+def random_catalog(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return FIRSTCatalog({
+        'FIRST': np.array(['J{:015d}'.format(i) for i in range(n)]),
+        'RAJ2000': rng.uniform(0, 360, n),
+        'DEJ2000': np.degrees(np.arcsin(rng.uniform(-1, 1, n))),
+        'Fint': rng.lognormal(1.5, 1.2, n).round(2),
+        'c1': rng.choice(np.array([' ', 'g', 's']), n),
+    })
+
+
+class TestBatchConeSearch(unittest.TestCase):
+    def setUp(self):
+        self.catalog = random_catalog(20000)
+
+    def test_matches_single_cone_searches(self):
+        ras, decs, radii = [338.12, 0.1, 45], [11.53, -0.1, 89], [2, 3, 4]
+        result = self.catalog.batch_cone_search(ras, decs, radii, ids=['a', 'b', 'c'])
+
+        for target, ra1, dec1, radius in zip(['a', 'b', 'c'], ras, decs, radii):
+            expected = self.catalog.cone_search(ra1, dec1, radius)
+            expected.sort('Angular Separation')
+            found = result[result['Target'] == target]
+
+            self.assertEqual(list(expected['FIRST']), list(found['FIRST']))
+            np.testing.assert_array_equal(expected['Angular Separation'], found['Angular Separation'])
+
+    def test_groups_by_target_in_given_order(self):
+        result = self.catalog.batch_cone_search([10, 200], [0, 0], 3)
+
+        self.assertEqual(['Target', 'FIRST', 'RAJ2000', 'DEJ2000', 'Fint', 'c1', 'Angular Separation'], result.colnames)
+        self.assertTrue(np.all(np.diff(result['Target']) >= 0))
+
+    def test_no_targets(self):
+        self.assertEqual(0, len(self.catalog.batch_cone_search([], [], 1)))
+
+
+class TestParallelSearch(unittest.TestCase):
+    def setUp(self):
+        self.catalog = random_catalog(20000)
+
+    def assertTablesEqual(self, expected, result):
+        self.assertEqual(expected.colnames, result.colnames)
+        for name in expected.colnames:
+            np.testing.assert_array_equal(expected[name], result[name])
+
+    def test_cone_search_matches_serial(self):
+        for ra1, dec1, radius in [(338.12, 11.53, 10), (0, 0, 30), (100, 85, 20), (10, 10, 180)]:
+            self.assertTablesEqual(self.catalog.cone_search(ra1, dec1, radius), self.catalog.cone_search(ra1, dec1, radius, workers=4))
+
+    def test_negative_radius(self):
+        # No zones to split over, so it's searched like a single worker would (finding nothing):
+        self.assertTablesEqual(self.catalog.cone_search(338.12, 11.53, -1), self.catalog.cone_search(338.12, 11.53, -1, workers=2))
+        self.assertEqual(0, len(self.catalog.cone_search(338.12, 11.53, -1, workers=2)))
+
+    def test_batch_cone_search_matches_serial(self):
+        ras, decs = np.arange(0, 360, 15), np.linspace(-80, 80, 24)
+        self.assertTablesEqual(self.catalog.batch_cone_search(ras, decs, 5), self.catalog.batch_cone_search(ras, decs, 5, workers=3))
+
+
+class TestSelection(unittest.TestCase):
+    def setUp(self):
+        self.catalog = random_catalog(20000)
+
+    def test_filters_match_filtering_afterwards(self):
+        everything = self.catalog.cone_search(338.12, 11.53, 10)
+        for selection, keep in [
+            (Selection(min_flux=10), everything['Fint'] >= 10),
+            (Selection(min_flux=2, max_flux=5), (everything['Fint'] >= 2) & (everything['Fint'] <= 5)),
+            (Selection(classes=['g']), everything['c1'] == 'g'),
+            (Selection(classes=[' ', 's'], min_flux=10), (everything['c1'] != 'g') & (everything['Fint'] >= 10)),
+        ]:
+            filtered = self.catalog.cone_search(338.12, 11.53, 10, selection=selection)
+            self.assertEqual(list(everything['FIRST'][keep]), list(filtered['FIRST']))
+            np.testing.assert_array_equal(everything['Angular Separation'][keep], filtered['Angular Separation'])
+
+    def test_blank_classification_stored_as_empty_bytes(self):
+        catalog = FIRSTCatalog({'RAJ2000': np.zeros(3), 'DEJ2000': np.zeros(3), 'Fint': np.ones(3), 'c1': np.array([b'', b'g', b' '])})
+        np.testing.assert_array_equal([True, False, True], Selection(classes=[' ']).mask(catalog.columns, np.arange(3)))
+
+    def test_columns(self):
+        table = self.catalog.cone_search(338.12, 11.53, 3, selection=Selection(columns=['Fint', 'FIRST']))
+        self.assertEqual(['Fint', 'FIRST', 'Angular Separation'], table.colnames)
+        self.assertEqual(len(self.catalog.cone_search(338.12, 11.53, 3)), len(table))
+
+        with self.assertRaises(ValueError):
+            self.catalog.cone_search(338.12, 11.53, 3, selection=Selection(columns=['Flux']))
+
+    def test_nearest(self):
+        galaxies = self.catalog.nearest(338.12, 11.53, 5, selection=Selection(classes=['g']))
+        everything = self.catalog.cone_search(338.12, 11.53, 20)
+        everything.sort('Angular Separation')
+        self.assertEqual(list(everything['FIRST'][everything['c1'] == 'g'][:5]), list(galaxies['FIRST']))
+
+
+class TestExactRefine(unittest.TestCase):
+    def test_sources_on_the_edge_of_the_cone(self):
+        # Sources just inside and just outside each cone, far closer to its edge than single precision unit vectors
+        # can tell apart: the exact separations have to decide, and are returned unrounded.
+        rng = np.random.default_rng(2)
+        for ra1, dec1, radius in [(338.12, 11.53, 1), (0.001, 0, 0.001), (200, 89.9, 0.5), (10, -45, 30), (90, 0, 2e-5)]:
+            offsets = radius * np.array([1 - 1e-9, 1 + 1e-9, 1 - 1e-12, 0.5, 1 + 1e-6] * 20)
+            bearings = rng.uniform(0, 2 * np.pi, len(offsets))
+            dec = np.degrees(np.arcsin(np.sin(np.radians(dec1)) * np.cos(np.radians(offsets))
+                + np.cos(np.radians(dec1)) * np.sin(np.radians(offsets)) * np.cos(bearings)))
+            ra = (ra1 + np.degrees(np.arctan2(np.sin(bearings) * np.sin(np.radians(offsets)) * np.cos(np.radians(dec1)),
+                np.cos(np.radians(offsets)) - np.sin(np.radians(dec1)) * np.sin(np.radians(dec))))) % 360
+            catalog = FIRSTCatalog({'FIRST': np.array(['J{:015d}'.format(i) for i in range(len(ra))]), 'RAJ2000': ra, 'DEJ2000': dec,
+                'Fint': np.ones(len(ra), dtype=np.float32), 'c1': np.full(len(ra), b'g')})
+
+            separations = angular_separations(ra1, dec1, ra, dec).degree
+            rows, found = catalog.cone_rows(ra1, dec1, radius)
+            np.testing.assert_array_equal(np.flatnonzero(separations < radius), rows)
+            np.testing.assert_array_equal(separations[rows], found.degree)
+            self.assertEqual(np.float32, catalog.unit_vectors.dtype)
+
+
+class TestNearest(unittest.TestCase):
+    def setUp(self):
+        self.catalog = random_catalog(20000)
+        self.ra = np.asarray(self.catalog.columns['RAJ2000'])
+        self.dec = np.asarray(self.catalog.columns['DEJ2000'])
+
+    def brute_force(self, ra1, dec1, k, max_radius=None):
+        separations = angular_separations(ra1, dec1, self.ra, self.dec).degree
+        rows = np.arange(len(separations)) if max_radius is None else np.flatnonzero(separations < max_radius)
+        return rows[np.lexsort((rows, separations[rows]))][:k]
+
+    def test_matches_brute_force(self):
+        for ra1, dec1 in [(338.12, 11.53), (0.01, -0.2), (120, 90), (359.9, -89.5)]:
+            for k in (1, 7, 300):
+                rows, separations = self.catalog.nearest_rows(ra1, dec1, k)
+                np.testing.assert_array_equal(self.brute_force(ra1, dec1, k), rows)
+                self.assertTrue(np.all(np.diff(separations.degree) >= 0))
+
+    def test_max_radius(self):
+        rows, separations = self.catalog.nearest_rows(338.12, 11.53, 1000, max_radius=2)
+        np.testing.assert_array_equal(self.brute_force(338.12, 11.53, 1000, 2), rows)
+        self.assertLess(len(rows), 1000)
+
+    def test_sparse_catalog(self):
+        # Far fewer sources than asked for: they're all returned, however far away.
+        catalog = random_catalog(3, seed=1)
+        table = catalog.nearest(0, 0, 10)
+        self.assertEqual(3, len(table))
+        self.assertEqual(['FIRST', 'RAJ2000', 'DEJ2000', 'Fint', 'c1', 'Angular Separation'], table.colnames)
+        self.assertEqual(0, len(catalog.nearest(0, 0, 0)))
+        with self.assertRaises(ValueError):
+            catalog.nearest(0, 0, -1)
+
+
+if __name__ == '__main__':
+    unittest.main()
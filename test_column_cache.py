@@ -0,0 +1,86 @@
+from astropy.io import fits
+import numpy as np
+
+import os
+import tempfile
+import unittest
+
+from catalog import FIRSTCatalog
+import column_cache
+
+
+def write_catalog(filename, ra, dec):
+    n = len(ra)
+    columns = [
+        fits.Column('FIRST', '16A', array=np.array(['J{:015d}'.format(i) for i in range(n)])),
+        fits.Column('RAJ2000', 'D', array=ra),
+        fits.Column('DEJ2000', 'D', array=dec),
+        fits.Column('Fint', 'E', array=np.linspace(1, 10, n)),
+        fits.Column('c1', '1A', array=np.array([' ', 'g', 's'] * (n // 3) + [' '] * (n % 3))),
+    ]
+    fits.BinTableHDU.from_columns(columns).writeto(filename, overwrite=True)
+
+
+class TestColumnCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'FIRST_data.fit')
+        write_catalog(self.filename, [338.12, 338.2, 10], [11.53, 11.6, 0])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_builds_and_memory_maps_columns(self):
+        cache = column_cache.load(self.filename)
+
+        self.assertTrue(os.path.isdir(column_cache.cache_path(self.filename)))
+        self.assertIsInstance(cache['columns']['RAJ2000'], np.memmap)
+        self.assertEqual(b'J000000000000001', cache['columns']['FIRST'][1])
+        np.testing.assert_allclose([np.cos(np.radians(10)), np.sin(np.radians(10)), 0], cache['unit_vectors'][2], atol=1e-12)
+
+    def test_compact_types(self):
+        cache = column_cache.load(self.filename)
+
+        self.assertEqual(np.float32, cache['unit_vectors'].dtype)
+        self.assertEqual(np.int32, cache['index'].order.dtype)
+        self.assertEqual(np.int32, cache['names'].order.dtype)
+        self.assertEqual(np.dtype('S16'), cache['columns']['FIRST'].dtype)
+        self.assertEqual(np.dtype('S1'), cache['columns']['c1'].dtype)
+        self.assertEqual(np.float32, cache['columns']['Fint'].dtype)
+
+    def test_columns_read_like_astropy_does(self):
+        with fits.open(self.filename) as hdul:
+            data = hdul[1].data
+            columns = column_cache.fits_columns(data)
+            for name in data.dtype.names:
+                np.testing.assert_array_equal(np.asarray(data.field(name)).astype(columns[name].dtype), columns[name])
+                self.assertTrue(columns[name].dtype.isnative)
+
+    def test_catalog_from_cache_matches_fit_file(self):
+        cached = FIRSTCatalog.open(self.filename).cone_search(338.12, 11.53, 1)
+        direct = FIRSTCatalog.from_fits(self.filename).cone_search(338.12, 11.53, 1)
+
+        self.assertEqual(direct.colnames, cached.colnames)
+        for name in direct.colnames:
+            np.testing.assert_array_equal(direct[name], cached[name])
+
+    def test_rebuilds_when_file_changes(self):
+        column_cache.load(self.filename)
+        write_catalog(self.filename, [1, 2, 3, 4], [0, 0, 0, 0])
+
+        cache = column_cache.load(self.filename)
+        np.testing.assert_array_equal([1, 2, 3, 4], cache['columns']['RAJ2000'])
+
+    def test_keeps_cache_when_only_mtime_changes(self):
+        meta = column_cache.load(self.filename)['meta']
+        os.utime(self.filename, ns=(meta['source_mtime_ns'] + 10**9, meta['source_mtime_ns'] + 10**9))
+
+        self.assertTrue(column_cache.is_fresh(self.filename, column_cache.read_meta(self.filename)))
+        self.assertEqual(meta['source_mtime_ns'] + 10**9, column_cache.read_meta(self.filename)['source_mtime_ns'])
+
+    def test_no_cache_without_fit_file(self):
+        self.assertIsNone(column_cache.load(os.path.join(self.directory.name, 'missing.fit')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,6 +7,14 @@ import unittest.mock as mock
 import helpers
 
 class TestGetFIRSTSourcesWithinRadius(unittest.TestCase):
+    def setUp(self):
+        helpers.clear_catalog_cache()
+        self.addCleanup(helpers.clear_catalog_cache)
+        # The mocked fit files have to be read as they are, not through the column cache of the real one:
+        patcher = mock.patch('column_cache.ENABLED', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     def test_reads_file_and_has_correct_columns(self):
         result = helpers.get_FIRST_sources_within_radius(338.12, 11.53)
         self.assertEqual(188, len(result))
@@ -32,7 +40,26 @@ class TestGetFIRSTSourcesWithinRadius(unittest.TestCase):
         result = helpers.get_FIRST_sources_within_radius(0, 0, 2)
         self.assertEqual(3, len(result))
 
+    @mock.patch('astropy.io.fits.open')
+    def test_reads_file_once_for_repeated_queries(self, mock_open):
+        mock_file = mock.MagicMock()
+        mock_table = Table([[0.086, 0.154, 0.127], [-0.0798, 0.100, -1.994]], names=['RAJ2000', 'DEJ2000'])
+        mock_file.data = mock_table
+        mock_open.return_value.__enter__.return_value = [None, mock_file]
+
+        self.assertEqual(2, len(helpers.get_FIRST_sources_within_radius(0, 0)))
+        self.assertEqual(3, len(helpers.get_FIRST_sources_within_radius(0, 0, 2)))
+        self.assertEqual(1, mock_open.call_count)
+
 class TestGetCoordinatesForFIRSTSource(unittest.TestCase):
+    def setUp(self):
+        helpers.clear_catalog_cache()
+        self.addCleanup(helpers.clear_catalog_cache)
+        # The mocked fit files have to be read as they are, not through the column cache of the real one:
+        patcher = mock.patch('column_cache.ENABLED', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     @mock.patch('astropy.io.fits.open')
     def test_when_found(self, mock_open):
         mock_file = mock.MagicMock()
@@ -55,6 +82,17 @@ class TestGetCoordinatesForFIRSTSource(unittest.TestCase):
         with self.assertRaises(KeyError):
             helpers.get_coordinates_for_FIRST_source('d')
 
+    @mock.patch('astropy.io.fits.open')
+    def test_many_names(self, mock_open):
+        mock_file = mock.MagicMock()
+        mock_table = Table([['a', 'b', 'c'], [1, 3, 5], [2, 4, 6]], names=['FIRST', 'RAJ2000', 'DEJ2000'])
+        mock_file.data = mock_table
+        mock_open.return_value.__enter__.return_value = [None, mock_file]
+
+        ra, dec = helpers.get_coordinates_for_FIRST_sources(['c', 'd', 'a'])
+        np.testing.assert_array_equal([5, np.nan, 1], ra)
+        np.testing.assert_array_equal([6, np.nan, 2], dec)
+
 
 class TestGetSearchCoordinates(unittest.TestCase):
     @mock.patch('builtins.input')
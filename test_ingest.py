@@ -0,0 +1,136 @@
+import numpy as np
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from astropy.table import Table
+
+import benchmark
+from catalog import FIRSTCatalog, Selection
+import helpers
+import ingest
+
+
+def new_rows(count, seed=5):
+    # Sources clustered around (150, 20), so that they turn up in the searches below:
+    rng = np.random.default_rng(seed)
+    ra = 150 + rng.uniform(-2, 2, count)
+    dec = 20 + rng.uniform(-2, 2, count)
+    return Table({
+        'FIRST': ['J{:06d}+NEW{:03d}'.format(seed, i) for i in range(count)],
+        'RAJ2000': ra,
+        'DEJ2000': dec,
+        'Fint': np.round(rng.uniform(1, 20, count), 2),
+        'c1': rng.choice(['g', 's', ' '], count),
+    })
+
+
+class TestIngest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'catalog.fit')
+        benchmark.generate_catalog(self.filename, 20000)
+        helpers.clear_catalog_cache()
+
+    def tearDown(self):
+        helpers.clear_catalog_cache()
+        shutil.rmtree(self.directory)
+
+    def everything(self, *tables):
+        # The catalog as it would be if it had been loaded with the new rows in it from the start:
+        catalog = FIRSTCatalog.open(self.filename)
+        dtypes = {name: column.dtype for name, column in catalog.columns.items()}
+        tables = [catalog.columns] + [ingest.to_schema(table, dtypes) for table in tables]
+        return FIRSTCatalog({name: np.concatenate([table[name] for table in tables]) for name in dtypes})
+
+    def assert_same_rows(self, expected, found):
+        self.assertEqual(expected.colnames, found.colnames)
+        self.assertEqual(list(expected['FIRST']), list(found['FIRST']))
+        np.testing.assert_array_equal(expected['Angular Separation'], found['Angular Separation'])
+
+    def test_searches_see_new_rows_immediately(self):
+        before = len(helpers.get_FIRST_sources_within_radius(150, 20, 3, catalog=helpers.get_catalog(self.filename)))
+        rows = new_rows(50)
+        self.assertEqual(helpers.ingest_FIRST_sources(rows, self.filename), 50)
+
+        catalog = helpers.get_catalog(self.filename)
+        self.assertEqual(len(catalog), 20050)
+        found = helpers.get_FIRST_sources_within_radius(150, 20, 3, catalog=catalog)
+        self.assertEqual(len(found), before + 50)
+        self.assert_same_rows(self.everything(rows).cone_search(150, 20, 3), found)
+
+        self.assertEqual(helpers.get_coordinates_for_FIRST_source(rows['FIRST'][7], catalog=catalog),
+            (rows['RAJ2000'][7], rows['DEJ2000'][7], rows['FIRST'][7]))
+        ra, dec = catalog.lookup_many([rows['FIRST'][3], catalog.columns['FIRST'][3].decode(), 'J000000+000000'])
+        np.testing.assert_array_equal(ra, [rows['RAJ2000'][3], catalog.columns['RAJ2000'][3], np.nan])
+        self.assertEqual(list(catalog.search('J000005+NEW*')['FIRST']), list(rows['FIRST']))
+
+    def test_rows_ingested_elsewhere(self):
+        # Another process adding rows to the same catalog only writes a segment, which the next query picks up:
+        catalog = helpers.get_catalog(self.filename)
+        first, second = new_rows(30, seed=1), new_rows(20, seed=2)
+        ingest.append(self.filename, first, {name: column.dtype for name, column in catalog.columns.items()})
+        ingest.append(self.filename, second, {name: column.dtype for name, column in catalog.columns.items()})
+
+        refreshed = helpers.get_catalog(self.filename)
+        self.assertIsNot(refreshed, catalog)
+        self.assertNotEqual(refreshed.version, catalog.version)
+        self.assertIs(helpers.get_catalog(self.filename), refreshed)
+
+        expected = self.everything(first, second)
+        self.assert_same_rows(expected.cone_search(150, 20, 2.5), refreshed.cone_search(150, 20, 2.5))
+        self.assert_same_rows(expected.cone_search(150, 20, 2.5), refreshed.cone_search(150, 20, 2.5, workers=3))
+        self.assert_same_rows(expected.nearest(150.5, 20.5, 10), refreshed.nearest(150.5, 20.5, 10))
+        self.assert_same_rows(expected.batch_cone_search([150, 151], [20, 21], 1), refreshed.batch_cone_search([150, 151], [20, 21], 1))
+
+        selection = Selection(min_flux=5, classes='g', columns=['FIRST', 'Fint'])
+        self.assert_same_rows(expected.cone_search(150, 20, 3, selection=selection), refreshed.cone_search(150, 20, 3, selection=selection))
+
+    def test_compaction(self):
+        rows = new_rows(40)
+        helpers.ingest_FIRST_sources(rows, self.filename)
+        expected = helpers.get_catalog(self.filename).cone_search(150, 20, 3)
+
+        self.assertEqual(ingest.compact(self.filename), 40)
+        self.assertEqual(ingest.segments(self.filename), ())
+        self.assertEqual(ingest.compact(self.filename), 0)
+
+        catalog = helpers.get_catalog(self.filename)
+        self.assertIsNone(catalog.delta)
+        self.assertEqual(len(catalog), 20040)
+        self.assert_same_rows(expected, catalog.cone_search(150, 20, 3))
+        # The fit file itself now holds the new rows, and keeps its units:
+        fits_catalog = FIRSTCatalog.from_fits(self.filename)
+        self.assertEqual(len(fits_catalog), 20040)
+        self.assertEqual(fits_catalog.delta_seq, 1)
+        self.assert_same_rows(expected, fits_catalog.cone_search(150, 20, 3))
+        self.assertEqual(Table.read(self.filename)['Fint'].unit, 'mJy')
+
+        # Rows added after a compaction are numbered after the ones folded in, so they aren't skipped:
+        helpers.ingest_FIRST_sources(new_rows(5, seed=9), self.filename)
+        self.assertEqual(ingest.segments(self.filename), (2,))
+        self.assertEqual(len(helpers.get_catalog(self.filename)), 20045)
+
+    def test_checks_columns(self):
+        rows = new_rows(3)
+        rows.remove_column('Fint')
+        with self.assertRaises(ValueError):
+            helpers.ingest_FIRST_sources(rows, self.filename)
+
+        rows = new_rows(3)
+        rows['extra'] = 1
+        with self.assertRaises(ValueError):
+            helpers.ingest_FIRST_sources(rows, self.filename)
+
+        rows = new_rows(3)
+        rows['DEJ2000'][1] = np.nan
+        with self.assertRaises(ValueError):
+            helpers.ingest_FIRST_sources(rows, self.filename)
+
+        self.assertEqual(ingest.segments(self.filename), ())
+
+
+if __name__ == '__main__':
+    unittest.main()
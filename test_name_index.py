@@ -0,0 +1,42 @@
+import numpy as np
+
+import unittest
+
+from name_index import NameIndex
+
+
+class TestNameIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = NameIndex.build(np.array(['J223235.3+114213', 'J000001.0+000001', 'J223299.9-000001', 'J223300.0+000000']))
+
+    def test_lookup(self):
+        self.assertEqual(0, self.index.lookup('J223235.3+114213'))
+        self.assertEqual(3, self.index.lookup(b'J223300.0+000000'))
+
+    def test_lookup_not_found(self):
+        for name in ['J223235.3+114214', 'J', 'Z', '', 'J223235.3+1142130', 'é']:
+            with self.assertRaises(KeyError):
+                self.index.lookup(name)
+
+    def test_find_many(self):
+        rows = self.index.find(['J223300.0+000000', 'missing', 'J000001.0+000001'])
+        np.testing.assert_array_equal([3, -1, 1], rows)
+
+    def test_prefix_search(self):
+        np.testing.assert_array_equal([0, 2], self.index.search('J2232*'))
+        np.testing.assert_array_equal([0, 1, 2, 3], self.index.search('J*'))
+        np.testing.assert_array_equal([], self.index.search('K*'))
+
+        # Without a wildcard, the name has to match exactly (not just start with the pattern):
+        index = NameIndex.build(np.array(['J12', 'J1', 'J123']))
+        np.testing.assert_array_equal([1], index.search('J1'))
+        np.testing.assert_array_equal([0, 1, 2], index.search('J1*'))
+        np.testing.assert_array_equal([], index.search(''))
+
+    def test_pattern_search(self):
+        np.testing.assert_array_equal([2], self.index.search('J2232*-000001'))
+        np.testing.assert_array_equal([1], self.index.search('J000001.0+000001'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import numpy as np
+
+import io
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+import profiling
+
+
+class TestProfiling(unittest.TestCase):
+    def test_spans_do_nothing_without_hooks(self):
+        self.assertIs(profiling._NO_SPAN, profiling.span('stage'))
+
+    def test_nested_spans(self):
+        with profiling.Recorder() as recorder:
+            with profiling.span('outer'):
+                with profiling.span('inner', rows=3):
+                    pass
+                with profiling.span('inner'):
+                    pass
+
+        self.assertEqual(['outer/inner', 'outer/inner', 'outer'], [span['name'] for span in recorder.spans])
+        self.assertEqual([1, 1, 0], [span['depth'] for span in recorder.spans])
+        self.assertEqual(3, recorder.spans[0]['rows'])
+        self.assertGreaterEqual(recorder.spans[2]['wall_ms'], recorder.spans[0]['wall_ms'])
+        self.assertNotIn('peak_bytes', recorder.spans[0])
+        self.assertIs(profiling._NO_SPAN, profiling.span('stage'))
+
+    def test_memory(self):
+        with profiling.Recorder(trace_memory=True) as recorder:
+            with profiling.span('outer'):
+                with profiling.span('allocate'):
+                    array = np.ones(1_000_000)
+                del array
+
+        allocate, outer = recorder.spans
+        self.assertGreaterEqual(allocate['alloc_bytes'], 8_000_000)
+        self.assertGreaterEqual(outer['peak_bytes'], 8_000_000)
+        self.assertLess(outer['alloc_bytes'], 1_000_000)
+
+    def test_aggregator(self):
+        aggregator = profiling.Aggregator()
+        profiling.add_hook(aggregator.record)
+        try:
+            for _ in range(3):
+                with profiling.span('stage'):
+                    pass
+        finally:
+            profiling.remove_hook(aggregator.record)
+
+        self.assertEqual(3, aggregator.summary()['stage']['count'])
+
+    def test_profiled_text(self):
+        output = io.StringIO()
+        with profiling.profiled('text', 'tool', file=output):
+            with profiling.span('search'):
+                pass
+
+        lines = output.getvalue().splitlines()
+        self.assertEqual(['stage', 'tool', 'search'], [line.split()[0] for line in lines])
+        self.assertEqual([], profiling._hooks)
+
+    def test_profiled_json(self):
+        output = io.StringIO()
+        with profiling.profiled('json', 'tool', file=output):
+            with profiling.span('search'):
+                pass
+
+        spans = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual(['tool/search', 'tool'], [span['name'] for span in spans])
+        self.assertIn('peak_bytes', spans[0])
+        self.assertEqual([], profiling._hooks)
+
+
+    def test_first_search_times_astropy_import(self):
+        # In a fresh process, the first search pays for importing astropy, which gets a stage of its own:
+        code = '''if True:
+            import numpy as np
+            import profiling
+            from catalog import FIRSTCatalog
+            catalog = FIRSTCatalog({'FIRST': np.array([b'a', b'b']), 'RAJ2000': np.array([1.0, 2.0]), 'DEJ2000': np.array([1.0, 2.0])})
+            for _ in range(2):
+                with profiling.Recorder() as recorder, profiling.span('cone search'):
+                    catalog.cone_search(1, 1, 1)
+                print([span['name'] for span in recorder.spans if 'import' in span['name']])
+        '''
+        result = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(profiling.__file__)), capture_output=True, text=True, check=True)
+        self.assertEqual(["['cone search/import astropy']", '[]'], result.stdout.splitlines())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import numpy as np
+
+import os
+import tempfile
+import unittest
+
+from query_cache import QueryCache
+from test_catalog import random_catalog
+
+
+def assert_same_result(test, expected, found):
+    expected.sort('Angular Separation')
+    found.sort('Angular Separation')
+    test.assertEqual(expected.colnames, found.colnames)
+    test.assertEqual(list(expected['FIRST']), list(found['FIRST']))
+    np.testing.assert_array_equal(expected['Angular Separation'], found['Angular Separation'])
+    test.assertEqual(expected['Angular Separation'].unit, found['Angular Separation'].unit)
+
+
+class TestQueryCache(unittest.TestCase):
+    def setUp(self):
+        self.catalog = random_catalog(20000)
+        self.cache = QueryCache()
+
+    def search(self, ra1, dec1, radius, cache=None, version='v1'):
+        cache = cache or self.cache
+        table = cache.get(version, ra1, dec1, radius)
+        if table is None:
+            table = self.catalog.cone_search(ra1, dec1, radius)
+            cache.put(version, ra1, dec1, radius, table)
+        return table
+
+    def test_exact_hit(self):
+        first = self.search(150, 20, 3)
+        first.sort('FIRST')  # Sorting a result mustn't change what's cached.
+        second = self.search(150, 20, 3)
+
+        assert_same_result(self, self.catalog.cone_search(150, 20, 3), second)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_smaller_search_at_same_center_filters_cached_rows(self):
+        self.search(150, 20, 4)
+        found = self.search(150, 20, 1.5)
+
+        assert_same_result(self, self.catalog.cone_search(150, 20, 1.5), found)
+        self.assertEqual(self.cache.stats()['superset_hits'], 1)
+
+    def test_contained_search_at_other_center_filters_cached_rows(self):
+        self.search(359, 1, 5)
+        found = self.search(1, 0, 2)  # Across ra = 0, still inside the first cone.
+
+        assert_same_result(self, self.catalog.cone_search(1, 0, 2), found)
+        self.assertEqual(self.cache.stats()['superset_hits'], 1)
+
+    def test_overlapping_search_is_a_miss(self):
+        self.search(150, 20, 2)
+        self.search(152, 20, 2)
+        self.assertEqual(self.cache.stats()['misses'], 2)
+
+    def test_evicts_least_recently_used(self):
+        first = self.search(10, 10, 3)
+        size = sum(np.asarray(first[name]).nbytes for name in first.colnames)
+        cache = QueryCache(max_bytes=int(size * 2.5))
+        for ra1 in (10, 50, 90):
+            self.search(ra1, 10, 3, cache)
+        # Using the first again keeps it; the second is evicted instead.
+        self.search(10, 10, 3, cache)
+        self.search(130, 10, 3, cache)
+
+        self.assertIsNotNone(cache.get('v1', 10, 10, 3))
+        self.assertIsNone(cache.get('v1', 50, 10, 3))
+        self.assertLessEqual(cache.stats()['bytes'], cache.max_bytes)
+
+    def test_new_catalog_version_invalidates(self):
+        self.search(150, 20, 3)
+        self.assertIsNone(self.cache.get('v2', 150, 20, 3))
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+    def test_no_version_is_never_cached(self):
+        self.search(150, 20, 3, version=None)
+        self.assertIsNone(self.cache.get(None, 150, 20, 3))
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+    def test_saved_results_are_reused_by_a_new_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.search(150, 20, 3, QueryCache(directory=directory))
+            cache = QueryCache(directory=directory)
+            found = cache.get('v1', 150, 20, 3)
+
+            self.assertIsNotNone(found)
+            assert_same_result(self, self.catalog.cone_search(150, 20, 3), found)
+
+            # A new catalog version removes the saved results:
+            cache.get('v2', 150, 20, 3)
+            self.assertEqual([name for name in os.listdir(directory) if name.endswith('.npz')], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
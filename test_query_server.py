@@ -0,0 +1,104 @@
+import numpy as np
+
+import threading
+import unittest
+import unittest.mock as mock
+from urllib.error import HTTPError
+from concurrent.futures import ThreadPoolExecutor
+
+from query_client import QueryClient
+import query_server
+from test_catalog import random_catalog
+
+
+class TestQueryServer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.catalog = random_catalog(20000)
+        cls.server = query_server.QueryServer(cls.catalog, port=0)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.client = QueryClient('http://127.0.0.1:{}'.format(cls.server.server_address[1]))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_is_running(self):
+        self.assertTrue(self.client.is_running())
+        self.assertFalse(QueryClient('http://127.0.0.1:1').is_running())
+
+    def test_cone_search_json(self):
+        expected = self.catalog.cone_search(338.12, 11.53, 3)
+        expected.sort('Angular Separation')
+
+        rows = self.client.cone_search(338.12, 11.53, 3)
+        self.assertEqual(list(expected['FIRST']), rows['FIRST'])
+        np.testing.assert_array_equal(expected['Angular Separation'], rows['Angular Separation'])
+
+    def test_cone_search_html(self):
+        html = self.client.cone_search(338.12, 11.53, 3, output_format='html')
+        self.assertIn('<th>Angular Separation</th>', html)
+
+    def test_lookup(self):
+        name = self.catalog.columns['FIRST'][5]
+        self.assertEqual((self.catalog.columns['RAJ2000'][5], self.catalog.columns['DEJ2000'][5], name), self.client.lookup(name))
+        with self.assertRaises(KeyError):
+            self.client.lookup('missing')
+
+    def test_plot(self):
+        self.assertTrue(self.client.plot(338.12, 11.53, 1).startswith(b'\x89PNG'))
+
+    def test_repeated_plot_is_not_drawn_again(self):
+        self.catalog.version = 'test'
+        try:
+            first = self.client.plot(20, 10, 1)
+            with mock.patch('visualization_tool.plot_sources') as mock_plot:
+                second = self.client.plot(20, 10, 1)
+            mock_plot.assert_not_called()
+            self.assertEqual(first, second)
+        finally:
+            self.catalog.version = None
+
+    def test_plot_density_threshold(self):
+        self.catalog.version = 'test'
+        try:
+            self.client.plot(30, 10, 1)
+            # A different threshold is a different plot, not the one already drawn:
+            with mock.patch('visualization_tool.plot_sources', wraps=query_server.visualization_tool.plot_sources) as mock_plot:
+                self.client.plot(30, 10, 1, density_threshold=10)
+            self.assertEqual(10, mock_plot.call_args.args[3])
+        finally:
+            self.catalog.version = None
+
+    def test_rejects_bad_parameters(self):
+        for params in [{'ra': 10, 'dec': 'inf'}, {'ra': 10, 'dec': 10, 'radius': 'nan'}, {'ra': 'nan', 'dec': 0},
+                {'ra': 10, 'dec': 91}, {'ra': 10, 'dec': 10, 'radius': -1}, {'ra': 'ten', 'dec': 10}]:
+            with self.assertRaises(HTTPError) as context:
+                self.client.get('cone', **params)
+            self.assertEqual(400, context.exception.code, params)
+        with self.assertRaises(HTTPError) as context:
+            self.client.get('plot', ra=10, dec=-90.5)
+        self.assertEqual(400, context.exception.code)
+
+    def test_unexpected_error_is_answered_and_counted(self):
+        errors = self.client.stats().get('lookup', {}).get('errors', 0)
+        with mock.patch('helpers.get_coordinates_for_FIRST_source', side_effect=RuntimeError('broken')):
+            with self.assertRaises(HTTPError) as context:
+                self.client.lookup('anything')
+        self.assertEqual(500, context.exception.code)
+        self.assertEqual(errors + 1, self.client.stats()['lookup']['errors'])
+
+    def test_concurrent_clients_and_stats(self):
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(lambda ra: len(self.client.cone_search(ra, 0, 2)['FIRST']), range(0, 360, 10)))
+        self.assertEqual([len(self.catalog.cone_search(ra, 0, 2)) for ra in range(0, 360, 10)], results)
+
+        stats = self.client.stats()
+        self.assertGreaterEqual(stats['cone']['count'], 36)
+        self.assertIn('p95_ms', stats['cone'])
+
+
+if __name__ == '__main__':
+    unittest.main()
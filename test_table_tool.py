@@ -1,10 +1,14 @@
 from astropy.table import Table
 
+import os
+import subprocess
+import sys
 import unittest
 import unittest.mock as mock
 
 import table_tool
 import helpers
+import profiling
 
 
 @mock.patch('table_tool.get_FIRST_sources_within_radius')
@@ -51,6 +55,30 @@ class TestTableTool(unittest.TestCase):
         mock_get_sources.assert_called_with(0, -1, radius=1)
         table.sort.assert_called_with('Angular Separation')
 
+    @mock.patch('table_tool.get_nearest_FIRST_sources')
+    def test_with_limit_and_offset(self, mock_nearest, mock_save, mock_get_sources):
+        table = table_tool.main(338.12, 11.53, limit=10, offset=20)
+
+        # Only the nearest 30 sources are looked up, never a table of the whole cone:
+        mock_nearest.assert_called_with(338.12, 11.53, 30, max_radius=1)
+        mock_get_sources.assert_not_called()
+        mock_nearest.return_value.__getitem__.assert_called_with(slice(20, 30))
+        mock_save.assert_called_with(table, page_size=None)
+
+    def test_with_offset_only(self, mock_save, mock_get_sources):
+        table = table_tool.main(338.12, 11.53, offset=20)
+
+        mock_get_sources.return_value.sort.assert_called_with('Angular Separation')
+        mock_get_sources.return_value.__getitem__.assert_called_with(slice(20, None))
+        mock_save.assert_called_with(table, page_size=None)
+
+    @mock.patch('table_tool.save_table')
+    def test_with_other_format(self, mock_save_table, mock_save, mock_get_sources):
+        table = table_tool.main(338.12, 11.53, output_format='csv')
+
+        mock_save_table.assert_called_with(table, 'csv')
+        mock_save.assert_not_called()
+
     @mock.patch('helpers.get_coordinates_for_FIRST_source')
     def test_with_source_not_found_and_with_coordinates_given(self, mock_coordinates, mock_save, mock_get_sources):
         mock_coordinates.side_effect = KeyError
@@ -59,6 +87,89 @@ class TestTableTool(unittest.TestCase):
         mock_get_sources.assert_called_with(338, 11, radius=1)
         table.sort.assert_called_with('Angular Separation')
 
+    @mock.patch('table_tool.get_nearest_FIRST_sources')
+    def test_nearest(self, mock_nearest, mock_save, mock_get_sources):
+        table = table_tool.main(338.12, 11.53, radius=None, nearest=5)
+
+        mock_nearest.assert_called_with(338.12, 11.53, 5, max_radius=None)
+        mock_get_sources.assert_not_called()
+        table.sort.assert_not_called()  # Already sorted
+        mock_save.assert_called_with(table, page_size=None)
+
+    @mock.patch('table_tool.get_nearest_FIRST_sources')
+    def test_nearest_zero(self, mock_nearest, mock_save, mock_get_sources):
+        # Still a nearest search (with no radius), not a cone search:
+        table_tool.main(338.12, 11.53, radius=None, nearest=0)
+
+        mock_nearest.assert_called_with(338.12, 11.53, 0, max_radius=None)
+        mock_get_sources.assert_not_called()
+
+    def test_filters(self, mock_save, mock_get_sources):
+        table_tool.main(338.12, 11.53, filters={'min_flux': 10, 'classes': ['g'], 'columns': ['FIRST']})
+
+        mock_get_sources.assert_called_with(338.12, 11.53, radius=1, min_flux=10, classes=['g'], columns=['FIRST'])
+
+    def test_profile_stages(self, mock_save, mock_get_sources):
+        with profiling.Recorder() as recorder:
+            table_tool.main(338.12, 11.53)
+
+        self.assertEqual(['sort', 'write html'], [span['name'] for span in recorder.spans])
+
+
+@mock.patch('table_tool.get_FIRST_sources_for_targets')
+@mock.patch('table_tool.read_targets')
+@mock.patch('table_tool.save_html')
+class TestTableToolBatch(unittest.TestCase):
+
+    def test_combined_table(self, mock_save, mock_read, mock_get_sources):
+        mock_read.return_value = Table([[338.12, 0], [11.53, 0]], names=['ra', 'dec'])
+
+        table = table_tool.batch_main('targets.csv', radius=2)
+
+        mock_read.assert_called_with('targets.csv')
+        mock_get_sources.assert_called_with(mock_read.return_value, radius=2)
+        mock_save.assert_called_once_with(table)
+
+    def test_split_writes_one_table_per_target(self, mock_save, mock_read, mock_get_sources):
+        mock_read.return_value = Table([[338.12, 0], [11.53, 0], ['a', 'b']], names=['ra', 'dec', 'id'])
+        mock_get_sources.return_value = Table([['a', 'a'], [1, 2]], names=['Target', 'Angular Separation'])
+
+        table_tool.batch_main('targets.csv', split=True)
+
+        self.assertEqual(['table_a.html', 'table_b.html'], [call.args[1] for call in mock_save.call_args_list])
+        self.assertEqual([2, 0], [len(call.args[0]) for call in mock_save.call_args_list])
+
+
+class TestArguments(unittest.TestCase):
+    def run_tool(self, *args):
+        return subprocess.run([sys.executable, 'table_tool.py'] + list(args), cwd=os.path.dirname(os.path.abspath(table_tool.__file__)), capture_output=True, text=True)
+
+    def assert_rejected(self, message, *args):
+        result = self.run_tool(*args)
+        self.assertEqual(2, result.returncode)
+        self.assertIn(message, result.stderr)
+
+    def test_nearest_must_be_positive(self):
+        self.assert_rejected('--nearest must be at least 1', '-ra', '1', '-dec', '1', '--nearest', '0')
+        self.assert_rejected('--nearest must be at least 1', '-ra', '1', '-dec', '1', '--nearest', '-1')
+
+    def test_limit_and_offset_can_not_be_negative(self):
+        self.assert_rejected('--limit and --offset can not be negative', '-ra', '1', '-dec', '1', '--limit', '-3')
+        self.assert_rejected('--limit and --offset can not be negative', '-ra', '1', '-dec', '1', '--offset', '-3')
+        self.assert_rejected('--page-size must be at least 1', '-ra', '1', '-dec', '1', '--page-size', '0')
+
+    def test_output_options_are_not_ignored_in_batch_mode(self):
+        for option in (['-f', 'csv'], ['--limit', '5'], ['--offset', '5'], ['--page-size', '5']):
+            self.assert_rejected('can not be used with --batch', '--batch', 'targets.csv', *option)
+
+
+class TestStartup(unittest.TestCase):
+    def test_import_does_not_load_heavy_modules(self):
+        # --help and searches answered by a query server shouldn't wait for numpy or astropy to load:
+        code = 'import sys, table_tool; print(sorted(m for m in ("numpy", "astropy", "matplotlib") if m in sys.modules))'
+        result = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(table_tool.__file__)), capture_output=True, text=True, check=True)
+        self.assertEqual('[]', result.stdout.strip())
+
 
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
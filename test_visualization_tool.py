@@ -1,5 +1,10 @@
 from astropy.table import Table
+import numpy as np
 
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
 import unittest.mock as mock
 
@@ -86,5 +91,89 @@ class TestVisualizationTool(unittest.TestCase):
         self.assertEqual('Declination (degree)', plot[1].yaxis.get_label().get_text())
 
 
+class TestDensityRendering(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        n = 1000
+        self.table = Table([rng.uniform(338, 339, n), rng.uniform(11, 12, n), rng.uniform(1, 100, n), rng.choice([' ', 'g', 's'], n)],
+                           names=['RAJ2000', 'DEJ2000', 'Fint', 'c1'])
+
+    def test_class_indexes(self):
+        np.testing.assert_array_equal([2, 0, 1, 2, 2], visualization_tool.class_indexes(np.array([' ', 'g', 's', '', 'x'])))
+        np.testing.assert_array_equal(['blue', 'red', 'green'], visualization_tool.lookup_tables()[0][visualization_tool.class_indexes([' ', 'g', 's'])])
+
+    def test_scatter_below_threshold(self):
+        fig, ax = visualization_tool.plot_sources(self.table, 1, 'here', density_threshold=1000)
+
+        self.assertEqual(0, len(ax.images))
+        self.assertEqual(1000, len(ax.collections[0].get_offsets()))
+
+    def test_density_image_above_threshold(self):
+        fig, ax = visualization_tool.plot_sources(self.table, 1, 'here', density_threshold=100)
+
+        self.assertEqual(1, len(ax.images))
+        self.assertEqual(visualization_tool.BRIGHTEST_SOURCES, len(ax.collections[0].get_offsets()))
+        self.assertEqual(self.table['Fint'].max(), ax.collections[0].get_sizes().max())
+
+
+@mock.patch('visualization_tool.get_FIRST_sources_within_radius')
+@mock.patch('visualization_tool.read_targets')
+@mock.patch('helpers.get_catalog')
+class TestBatchRendering(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory()
+        os.chdir(self.directory.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def test_renders_fields_once_and_writes_gallery(self, mock_catalog, mock_read, mock_get_sources):
+        mock_catalog.return_value.version = 'v1'
+        mock_read.return_value = Table([[338.12, 0.0], [11.53, 1.0], ['first', 'second']], names=['ra', 'dec', 'id'])
+        mock_get_sources.side_effect = lambda *args, **kwargs: Table([[0.086, 0.154, 0.127], [-0.0798, 0.100, -1.994], [0.5, 0.6, 0.2], [' ', 'g', 's']], names=['RAJ2000', 'DEJ2000', 'Fint', 'c1'])
+
+        images = visualization_tool.batch_main('targets.csv')
+
+        self.assertEqual(2, len(images))
+        self.assertTrue(images[0].startswith(os.path.join('plot_cache', 'fig_338.12_11.53_0.25_v1_')))
+        self.assertTrue(images[1].startswith(os.path.join('plot_cache', 'fig_0.0_1.0_0.25_v1_')))
+        self.assertTrue(all(os.path.exists(image) for image in images))
+        with open('plot.html', encoding='utf-8') as file:
+            gallery = file.read()
+        self.assertIn('<img src="{}">'.format(images[1]), gallery)
+        self.assertIn('first', gallery)
+        self.assertEqual(2, mock_get_sources.call_count)
+
+        visualization_tool.batch_main('targets.csv')
+        self.assertEqual(2, mock_get_sources.call_count)
+
+        mock_catalog.return_value.version = 'v2'
+        visualization_tool.batch_main('targets.csv')
+        self.assertEqual(4, mock_get_sources.call_count)
+
+    def test_plots_are_redrawn_with_new_titles_or_thresholds(self, mock_catalog, mock_read, mock_get_sources):
+        mock_catalog.return_value.version = 'v1'
+        mock_read.return_value = Table([[338.12], [11.53], ['first']], names=['ra', 'dec', 'id'])
+        mock_get_sources.side_effect = lambda *args, **kwargs: Table([[0.086, 0.154], [-0.0798, 0.100], [0.5, 0.6], [' ', 'g']], names=['RAJ2000', 'DEJ2000', 'Fint', 'c1'])
+
+        first = visualization_tool.batch_main('targets.csv')
+        mock_read.return_value['id'] = ['renamed']
+        renamed = visualization_tool.batch_main('targets.csv')
+        thresholded = visualization_tool.batch_main('targets.csv', density_threshold=1)
+
+        self.assertEqual(3, len(set(first + renamed + thresholded)))
+        self.assertEqual(3, mock_get_sources.call_count)
+
+
+class TestStartup(unittest.TestCase):
+    def test_import_does_not_load_heavy_modules(self):
+        # Plots drawn by a query server shouldn't wait for numpy, matplotlib or astropy to load:
+        code = 'import sys, visualization_tool; print(sorted(m for m in ("numpy", "astropy", "matplotlib") if m in sys.modules))'
+        result = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(visualization_tool.__file__)), capture_output=True, text=True, check=True)
+        self.assertEqual('[]', result.stdout.strip())
+
+
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
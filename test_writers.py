@@ -0,0 +1,78 @@
+from astropy.table import Table
+import numpy as np
+
+import io
+import os
+import tempfile
+import unittest
+
+import writers
+
+try:
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+class TestWriters(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.table = Table([['J223235.3+114213', 'J223224.6+112534', 'J223139.8+103303'], [338.147, 338.1026, 337.9162],
+                            np.array([8.63, 21.5, 10.11], dtype=np.float32), [' ', 'g', 's']], names=['FIRST', 'RAJ2000', 'Fint', 'c1'])
+        self.table['Angular Separation'] = Table.Column([0.1, 0.2, 0.3], unit='deg')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def test_html_matches_astropy(self):
+        expected = io.StringIO()
+        self.table.write(expected, format='html')
+
+        writers.write_html(self.table, self.path('table.html'), chunk_size=2)
+        with open(self.path('table.html')) as file:
+            self.assertEqual(expected.getvalue(), file.read())
+
+    def test_html_pages(self):
+        writers.write_html(self.table, self.path('table.html'), page_size=2)
+
+        with open(self.path('table.html')) as file:
+            index = file.read()
+        self.assertIn('href="table_1.html"', index)
+        self.assertIn('href="table_2.html"', index)
+        with open(self.path('table_1.html')) as file:
+            self.assertEqual(3, file.read().count('<tr>'))
+        with open(self.path('table_2.html')) as file:
+            page = file.read()
+        self.assertEqual(2, page.count('<tr>'))
+        self.assertIn('<td>J223139.8+103303</td>', page)
+        self.assertIn('href="table_1.html">previous', page)
+
+    def test_csv(self):
+        writers.write_table(self.table, self.path('table.csv'), 'csv', chunk_size=2)
+
+        result = Table.read(self.path('table.csv'), format='ascii.csv')
+        self.assertEqual(self.table.colnames, result.colnames)
+        np.testing.assert_array_equal(self.table['RAJ2000'], result['RAJ2000'])
+
+    def test_votable(self):
+        writers.write_table(self.table, self.path('table.vot'), 'votable')
+
+        result = Table.read(self.path('table.vot'), format='votable')
+        self.assertEqual(list(self.table['FIRST']), list(result['FIRST']))
+        np.testing.assert_array_equal(self.table['Fint'], result['Fint'])
+        self.assertEqual('deg', str(result.columns[-1].unit))
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_parquet(self):
+        writers.write_table(self.table, self.path('table.parquet'), 'parquet', chunk_size=2)
+
+        result = pyarrow.parquet.read_table(self.path('table.parquet'))
+        self.assertEqual(list(self.table['FIRST']), result['FIRST'].to_pylist())
+        self.assertEqual(list(self.table['RAJ2000']), result['RAJ2000'].to_pylist())
+
+
+if __name__ == '__main__':
+    unittest.main()
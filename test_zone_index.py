@@ -0,0 +1,78 @@
+import numpy as np
+
+import os
+import tempfile
+import unittest
+
+from catalog import angular_separations
+import zone_index
+
+
+def random_sky(n, seed=0):
+    rng = np.random.default_rng(seed)
+    ra = rng.uniform(0, 360, n)
+    dec = np.degrees(np.arcsin(rng.uniform(-1, 1, n)))
+    return ra, dec
+
+
+class TestZoneIndex(unittest.TestCase):
+    def setUp(self):
+        self.ra, self.dec = random_sky(20000)
+        self.index = zone_index.ZoneIndex.build(self.ra, self.dec)
+
+    def assertFindsEveryMatch(self, ra1, dec1, radius):
+        separations = angular_separations(ra1, dec1, self.ra, self.dec).degree
+        expected = np.flatnonzero(separations < radius)
+        candidates = self.index.candidates(ra1, dec1, radius)
+
+        self.assertTrue(np.all(np.diff(candidates) > 0))
+        self.assertTrue(np.all(np.isin(expected, candidates)))
+
+    def test_finds_every_match(self):
+        self.assertFindsEveryMatch(338.12, 11.53, 1)
+        self.assertFindsEveryMatch(338.12, 11.53, 5)
+
+    def test_prunes_candidates(self):
+        self.assertLess(len(self.index.candidates(338.12, 11.53, 1)), len(self.ra) / 100)
+
+    def test_ra_wraparound(self):
+        self.assertFindsEveryMatch(359.9, 0.1, 2)
+        self.assertFindsEveryMatch(0.1, -0.1, 2)
+
+    def test_poles(self):
+        self.assertFindsEveryMatch(10, 89.5, 1)
+        self.assertFindsEveryMatch(200, -88.5, 2)
+
+    def test_sources_at_ra_zero_are_found_once(self):
+        # RA 0 in one zone has the same key as RA 360 in the zone below it, next to a zone boundary and at a pole:
+        ra = np.array([0.0, 0.0, 360.0, 359.999, 0.001, -1e-20])
+        dec = np.array([0.2, 89.5, -0.2, 0.1, -0.1, 0.3])
+        index = zone_index.ZoneIndex.build(ra, dec)
+        for ra1, dec1, radius in [(0, 0, 1), (0, 90, 1), (359.5, 0, 1), (0.5, 0, 1)]:
+            candidates = index.candidates(ra1, dec1, radius)
+            self.assertTrue(np.all(np.diff(candidates) > 0))
+            separations = angular_separations(ra1, dec1, ra, dec).degree
+            self.assertTrue(np.all(np.isin(np.flatnonzero(separations < radius), candidates)))
+
+        first, last = index.zone_range(0, 1)
+        bands = [index.candidates(0, 0, 1, (zone, zone)) for zone in range(first, last + 1)]
+        self.assertEqual(list(index.candidates(0, 0, 1)), sorted(np.concatenate(bands)))
+
+    def test_whole_sky(self):
+        self.assertEqual(len(self.ra), len(self.index.candidates(0, 0, 180)))
+
+    def test_load_or_build_reuses_saved_index(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'catalog.fit')
+            open(filename, 'w').close()
+
+            built = zone_index.load_or_build(filename, self.ra, self.dec)
+            self.assertTrue(os.path.exists(filename + '.zones.npz'))
+
+            loaded = zone_index.load_or_build(filename, self.ra, self.dec)
+            np.testing.assert_array_equal(built.order, loaded.order)
+            np.testing.assert_array_equal(built.keys, loaded.keys)
+
+
+if __name__ == '__main__':
+    unittest.main()
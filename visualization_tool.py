@@ -1,16 +1,15 @@
 import argparse
+import hashlib
+import html
+import os
 
-from astropy import units as u
-from astropy.coordinates import SkyCoord
-from astropy.io import fits 
-from astropy.table import Table
+# numpy, matplotlib (and through helpers, astropy) are only imported once a plot is actually drawn,
+# so --help, bad arguments and plots drawn by a query server don't wait for them to load.
 
-import matplotlib.patches as mpatches
-import matplotlib.pyplot as plt
-
-import numpy as np
-
-from helpers import get_FIRST_sources_within_radius, get_search_coordinates
+import helpers
+import profiling
+from helpers import get_FIRST_sources_within_radius, get_search_coordinates, read_targets
+from query_client import QueryClient
 
 
 COLOR_MAP = {
@@ -19,9 +18,19 @@ COLOR_MAP = {
 	' ': ['blue', 'other']  # everything else is blue
 }
 
+# Above this many sources, plots show a density image instead of one marker per source:
+DENSITY_THRESHOLD = 5000
+# Number of bins along each axis of the density image:
+DENSITY_BINS = 200
+# How many of the brightest sources are still drawn as markers on top of the density image:
+BRIGHTEST_SOURCES = 200
+
+# Where batch mode keeps the plots it renders, so fields that were already drawn can be skipped:
+PLOT_CACHE_DIR = 'plot_cache'
 
 
-def main(ra1, dec1, radius=0.25, source=None):	
+
+def main(ra1, dec1, radius=0.25, source=None, density_threshold=DENSITY_THRESHOLD, filters=None):	
 	# Get the search coordinates from user input if no command line arguments were given,
 	# or get the coordinates of the named source if a name was given:
 	ra1, dec1, source = get_search_coordinates(ra1, dec1, source)
@@ -30,39 +39,256 @@ def main(ra1, dec1, radius=0.25, source=None):
 	search_term = source if source else '{:.2f}\u00b0 {:.2f}\u00b0'.format(ra1, dec1)
 
 	# Calculate which sources to display in the visualization:
+	# (filters holds any flux and classification arguments for the search)
+	table = get_FIRST_sources_within_radius(ra1, dec1, radius=radius, **(filters or {}))
+
+	with profiling.span('plot'):
+		fig, ax = plot_sources(table, radius, search_term, density_threshold)
+	
+	with profiling.span('write png'):
+		save_html(ra1, dec1, radius)
+
+	return fig, ax
+
+
+def plot_sources(table, radius, search_term, density_threshold=DENSITY_THRESHOLD):
+	"""
+	Draws the scatterplot of the sources in `table` on a new figure, and returns the figure and its axes.
+
+	If there are more than `density_threshold` sources, the field is drawn as a density image coloured
+	by SDSS classification instead, with only the brightest sources drawn as markers on top.
+	"""
+	renderer = FieldRenderer(density_threshold)
+	renderer.draw(table, radius, search_term)
+
+	return renderer.fig, renderer.ax
+
+
+class FieldRenderer:
+	"""
+	A figure that can be redrawn for field after field.
+
+	The axes, legend and scatterplot are only created once; drawing a new field just updates
+	the data of the existing artists, which is much cheaper than building a new figure each time.
+	"""
+
+	def __init__(self, density_threshold=DENSITY_THRESHOLD):
+		import matplotlib.patches as mpatches
+		import matplotlib.pyplot as plt
+
+		self.density_threshold = density_threshold
+		self.colors, _ = lookup_tables()
+
+		# Create the scatterplot
+		self.fig, self.ax = plt.subplots()
+		self.scatter = self.ax.scatter([], [], alpha=0.5)
+		self.image = None
+
+		# Set the legend and labels
+		patches = [mpatches.Patch(color=value[0], label=value[1]) for value in COLOR_MAP.values()]
+		self.ax.legend(handles=patches, title="SDSS Classification")
+
+		self.ax.set_xlabel('Right Ascension (degree)')
+		self.ax.set_ylabel('Declination (degree)')
+
+	def draw(self, table, radius, search_term):
+		import numpy as np
+
+		# Sort them by size to make the way the points overlap one another a bit more consistent:
+		table.sort('Fint')
+		table.reverse()
+
+		# Add the data to the scatterplot
+		classes = class_indexes(table['c1'])
+		if len(table) > self.density_threshold:
+			self.draw_density(table['RAJ2000'], table['DEJ2000'], classes)
+			table = table[:BRIGHTEST_SOURCES]
+			classes = classes[:BRIGHTEST_SOURCES]
+		elif self.image is not None:
+			self.image.remove()
+			self.image = None
+
+		offsets = np.column_stack([np.asarray(table['RAJ2000'], dtype=float), np.asarray(table['DEJ2000'], dtype=float)])
+		self.scatter.set_offsets(offsets)
+		self.scatter.set_sizes(np.asarray(table['Fint']))
+		self.scatter.set_facecolor(self.colors[classes])
+
+		# The axes only track the data limits of artists as they're added, so redo them for the new field:
+		self.ax.ignore_existing_data_limits = True
+		self.ax.update_datalim(offsets)
+		if self.image is not None:
+			extent = self.image.get_extent()
+			self.ax.update_datalim([extent[::2], extent[1::2]])
+		self.ax.autoscale_view()
+
+		self.ax.set_title('FIRST Sources within {}{} of {}'.format(radius, '\u00b0', search_term))
+
+	def draw_density(self, x, y, classes, bins=DENSITY_BINS):
+		"""
+		Draws the sources at (x, y) as a 2D histogram, each bin coloured by the mix of classifications
+		in it and more opaque the more sources it holds.
+		"""
+		from matplotlib.colors import to_rgba_array
+		import numpy as np
+
+		x = np.asarray(x)
+		y = np.asarray(y)
+		extent = [x.min(), x.max(), y.min(), y.max()]
+
+		# One histogram for all the classes at once, with the class as a third dimension:
+		counts, _ = np.histogramdd((x, y, classes), bins=(bins, bins, len(self.colors)),
+			range=[extent[:2], extent[2:], (-0.5, len(self.colors) - 0.5)])
+		counts = counts.transpose(1, 0, 2)  # imshow wants rows of y
+
+		total = counts.sum(axis=2)
+		image = np.zeros((bins, bins, 4))
+		filled = total > 0
+		image[filled, :3] = counts[filled] @ to_rgba_array(self.colors)[:, :3] / total[filled, None]
+		image[..., 3] = np.log1p(total) / np.log1p(total.max())
+
+		if self.image is None:
+			self.image = self.ax.imshow(image, extent=extent, origin='lower', aspect='auto', interpolation='nearest')
+		else:
+			self.image.set_data(image)
+			self.image.set_extent(extent)
+
+	def save(self, filename):
+		self.fig.savefig(filename)
+
+
+def class_indexes(c1):
+	"""
+	Returns the position in COLOR_MAP of each SDSS classification in `c1`.
+	"""
+	import numpy as np
+
+	_, class_lookup = lookup_tables()
+	codes = np.asarray(c1).astype('S1').view(np.uint8)
+	return class_lookup[codes]
+
+
+# Built by lookup_tables() the first time a plot is drawn:
+_lookup_tables = None
+
+
+def lookup_tables():
+	"""
+	Returns the colours of COLOR_MAP as an array, and a lookup table from the byte value of a classification
+	to its position in COLOR_MAP (anything unknown counts as 'other'), so colouring is done with array indexing.
+	"""
+	global _lookup_tables
+	if _lookup_tables is None:
+		import numpy as np
+
+		colors = np.array([value[0] for value in COLOR_MAP.values()])
+		class_lookup = np.full(256, list(COLOR_MAP).index(' '), dtype=np.uint8)
+		for position, classification in enumerate(COLOR_MAP):
+			class_lookup[ord(classification)] = position
+		_lookup_tables = colors, class_lookup
+
+	return _lookup_tables
+
+
+def batch_main(filename, radius=0.25, workers=1, density_threshold=DENSITY_THRESHOLD):
+	"""
+	Plots every field listed in a CSV or FITS file of targets (see helpers.read_targets), 
+	spread over `workers` processes, and writes a single plot.html showing all of them.
+
+	Plots are kept in PLOT_CACHE_DIR, named after the field, the catalog version and how the plot was drawn
+	(see plot_filename), so fields that were already drawn the same way from the same catalog aren't drawn again.
+	"""
+	targets = read_targets(filename)
+	radii = targets['radius'] if 'radius' in targets.colnames else [radius] * len(targets)
+	fields = []
+	for position, (ra1, dec1, field_radius) in enumerate(zip(targets['ra'], targets['dec'], radii)):
+		search_term = str(targets['id'][position]) if 'id' in targets.colnames else '{:.2f}\u00b0 {:.2f}\u00b0'.format(ra1, dec1)
+		fields.append((float(ra1), float(dec1), float(field_radius), search_term))
+	print('Plotting FIRST sources around {} targets from {}'.format(len(fields), filename))
+
+	version = helpers.get_catalog().version or 'unversioned'
+	os.makedirs(PLOT_CACHE_DIR, exist_ok=True)
+	images = [os.path.join(PLOT_CACHE_DIR, plot_filename(field, version, density_threshold)) for field in fields]
+	todo = [(field, image) for field, image in zip(fields, images) if not os.path.exists(image)]
+	print('{} of them are already cached'.format(len(fields) - len(todo)))
+
+	if workers > 1 and len(todo) > 1:
+		from concurrent.futures import ProcessPoolExecutor
+
+		with ProcessPoolExecutor(workers, initializer=init_render_worker, initargs=(helpers.FILENAME, density_threshold)) as pool:
+			list(pool.map(render_field, todo, chunksize=max(1, len(todo) // (workers * 4))))
+	else:
+		init_render_worker(helpers.FILENAME, density_threshold)
+		for task in todo:
+			render_field(task)
+
+	save_gallery(fields, images)
+
+	return images
+
+
+def plot_filename(field, version, density_threshold):
+	# The field and catalog version, plus a short hash of the rest of what the plot depends on (its title,
+	# and whether it's drawn as a density image), so a renamed target or new threshold gets a plot of its own:
+	ra1, dec1, radius, search_term = field
+	drawn = hashlib.sha1('{}\n{}'.format(search_term, density_threshold).encode()).hexdigest()[:8]
+	return 'fig_{}_{}_{}_{}_{}.png'.format(ra1, dec1, radius, version, drawn)
+
+
+# Each batch render process draws all of its fields on a single FieldRenderer:
+_renderer = None
+
+
+def init_render_worker(filename, density_threshold):
+	global _renderer
+	import matplotlib.pyplot as plt
+
+	plt.switch_backend('Agg')
+	helpers.FILENAME = filename
+	_renderer = FieldRenderer(density_threshold)
+
+
+def render_field(task):
+	(ra1, dec1, radius, search_term), image = task
 	table = get_FIRST_sources_within_radius(ra1, dec1, radius=radius)
+	_renderer.draw(table, radius, search_term)
 
-	# Sort them by size to make the way the points overlap one another a bit more consistent:
-	table.sort('Fint')
-	table.reverse()
+	# Write to a temporary name first, so an interrupted run never leaves a half-written plot in the cache:
+	temp_image = '{}.{}.png'.format(image[:-4], os.getpid())
+	_renderer.save(temp_image)
+	os.replace(temp_image, image)
 
-	# Create the scatterplot
-	fig, ax = plt.subplots()
+	return image
 
-	# Add the data to the scatterplot
-	x = table['RAJ2000']
-	y = table['DEJ2000']
-	sizes = table['Fint']
-	colors = [COLOR_MAP[c][0] for c in table['c1']]
-	scatter = ax.scatter(x, y, s=sizes, c=colors, alpha=0.5)
 
-	# Set the legend and labels
-	patches = [mpatches.Patch(color=value[0], label=value[1]) for value in COLOR_MAP.values()]
-	ax.legend(handles=patches, title="SDSS Classification")
+def save_gallery(fields, images):
+	# One page showing every plot of the batch:
+	with open('plot.html', 'w', encoding='utf-8') as file:
+		file.write('<html><head><meta charset="utf-8"><title>CIRADA Technical Assessment</title></head><body>\n')
+		for (ra1, dec1, radius, search_term), image in zip(fields, images):
+			caption = html.escape('{} (radius {}\u00b0)'.format(search_term, radius))
+			file.write('<figure><img src="{}"><figcaption>{}</figcaption></figure>\n'.format(html.escape(image), caption))
+		file.write('</body></html>')
+	print('Done! View your results by opening plot.html')
 
-	ax.set_xlabel('Right Ascension (degree)')
-	ax.set_ylabel('Declination (degree)')
-	ax.set_title('FIRST Sources within {}{} of {}'.format(radius, '\u00b0', search_term))
-	
-	save_html(ra1, dec1, radius)
 
-	return fig, ax
+def remote_main(client, ra1, dec1, radius=0.25, source=None, density_threshold=DENSITY_THRESHOLD):
+	# Same as main, but the plot is drawn by a running query_server:
+	ra1, dec1, source = get_search_coordinates(ra1, dec1, source, lookup=client.lookup)
+
+	png = client.plot(ra1, dec1, radius=radius, source=source, density_threshold=density_threshold)
+	save_html(ra1, dec1, radius, png=png)
 
 
-def save_html(ra1, dec1, radius):
-	# Save the figure to a png image and then write to an html file. 
+def save_html(ra1, dec1, radius, png=None):
+	# Save the figure (or the already rendered `png`) to a png image and then write to an html file. 
 	title = 'fig_{}_{}_{}.png'.format(ra1, dec1, radius)
-	plt.savefig(title)
+	if png is None:
+		import matplotlib.pyplot as plt
+
+		plt.savefig(title)
+	else:
+		with open(title, 'wb') as file:
+			file.write(png)
 	with open('plot.html', 'w') as file:
 		file.write('<html><head><title>CIRADA Technical Assessment</title></head><img src="{}"></html>'.format(title))
 	print('Done! View your result by opening plot.html')
@@ -79,6 +305,44 @@ if __name__ == "__main__":
 	# Extension #2: Allow user to specify FIRST source around which to perform the query
 	parser.add_argument('-s', '--source', type=str, help='FIRST source around which to perform the query.')
 
+	# Split the catalog scan over several threads, for large searches (or batch plots over several processes):
+	parser.add_argument('-w', '--workers', type=int, default=1, help='Number of threads to split each search over, or in batch mode, number of processes to draw plots with (default: 1).')
+
+	# Batch mode: plot every position listed in a CSV or FITS file
+	parser.add_argument('-b', '--batch', type=str, help='CSV or FITS file of positions to plot, with ra, dec and optional radius and id columns.')
+
+	# Filters, applied before the separations are even computed:
+	parser.add_argument('--min-flux', type=float, help='Only plot sources with an integrated flux density of at least this many mJy.')
+	parser.add_argument('--max-flux', type=float, help='Only plot sources with an integrated flux density of at most this many mJy.')
+	parser.add_argument('--class', dest='classes', nargs='+', choices=list(helpers.CLASS_CODES), help='Only plot sources with these SDSS classifications.')
+
+	# Crowded fields are drawn as a density image:
+	parser.add_argument('--density-threshold', type=int, default=DENSITY_THRESHOLD, help='Draw a density image instead of individual sources above this many sources (default: {}).'.format(DENSITY_THRESHOLD))
+
+	# Keep search results on disk, to answer repeated (or smaller) searches of the same fields quickly:
+	parser.add_argument('--query-cache', type=str, help='Reuse search results saved in this directory, and save new ones there.')
+
+	# Use a running query_server.py when there is one, unless told not to:
+	parser.add_argument('--local', action='store_true', help='Always load the catalog in this process, even if a query server is running.')
+
+	# Show where the time (and memory) went, stage by stage:
+	parser.add_argument('--profile', nargs='?', const='text', choices=profiling.OUTPUTS, help='Print the time and memory of each stage of the query to stderr, as a table (text, the default) or json lines. Implies --local.')
+
 	args = parser.parse_args()
+	filters = {'min_flux': args.min_flux, 'max_flux': args.max_flux,
+		'classes': [helpers.CLASS_CODES[name] for name in args.classes] if args.classes else None}
+	filters = {name: value for name, value in filters.items() if value is not None}
+	if args.batch and filters:
+		parser.error('--min-flux, --max-flux and --class can not be used with --batch')
+	if args.query_cache:
+		helpers.QUERY_CACHE = helpers.QueryCache(directory=args.query_cache)
 
-	main(args.ra, args.dec, args.radius, args.source)
+	client = QueryClient()
+	with profiling.profiled(args.profile, 'visualization_tool'):
+		if args.batch:
+			batch_main(args.batch, args.radius, args.workers, args.density_threshold)
+		elif not filters and not args.local and not args.profile and client.is_running():
+			remote_main(client, args.ra, args.dec, args.radius, args.source, args.density_threshold)
+		else:
+			helpers.WORKERS = args.workers
+			main(args.ra, args.dec, args.radius, args.source, args.density_threshold, filters)
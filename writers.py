@@ -0,0 +1,170 @@
+import csv
+import html
+import os
+
+# numpy is imported by the functions that use it, so table_tool can import this module (for FORMATS)
+# without paying for numpy when it doesn't write anything itself.
+
+# How many rows are converted to text (or handed to pyarrow) at a time:
+CHUNK_SIZE = 1000
+
+FORMATS = ('html', 'csv', 'votable', 'parquet')
+EXTENSIONS = {'html': '.html', 'csv': '.csv', 'votable': '.vot', 'parquet': '.parquet'}
+
+# VOTable datatypes for numpy dtype kinds/sizes:
+VOTABLE_DATATYPES = {
+	('f', 8): 'double', ('f', 4): 'float',
+	('i', 8): 'long', ('i', 4): 'int', ('i', 2): 'short', ('u', 1): 'unsignedByte',
+	('b', 1): 'boolean',
+}
+
+
+def iter_chunks(table, chunk_size=CHUNK_SIZE):
+	"""
+	Yields the table's columns (as plain numpy arrays) `chunk_size` rows at a time,
+	so a writer never has more than one chunk of rows converted at once.
+	"""
+	import numpy as np
+
+	for start in range(0, len(table), chunk_size):
+		yield [np.asarray(table[name][start:start + chunk_size]) for name in table.colnames]
+
+
+def iter_rows(table, chunk_size=CHUNK_SIZE):
+	for columns in iter_chunks(table, chunk_size):
+		yield from zip(*columns)
+
+
+def write_table(table, filename, output_format='html', page_size=None, chunk_size=CHUNK_SIZE):
+	"""
+	Writes `table` to `filename` in the given format (one of FORMATS), streaming the rows out in chunks.
+
+	For html, `page_size` splits the table over several pages, linked from an index page at `filename`.
+	Returns the name of the file to open to see the result.
+	"""
+	if output_format == 'html':
+		return write_html(table, filename, page_size, chunk_size)
+	if output_format == 'csv':
+		return write_csv(table, filename, chunk_size)
+	if output_format == 'votable':
+		return write_votable(table, filename, chunk_size)
+	if output_format == 'parquet':
+		return write_parquet(table, filename, chunk_size)
+
+	raise ValueError('Unknown output format: {}'.format(output_format))
+
+
+def html_table(file, table, start, stop, chunk_size):
+	file.write('  <table>\n   <thead>\n    <tr>\n')
+	for name in table.colnames:
+		file.write('     <th>{}</th>\n'.format(html.escape(name)))
+	file.write('    </tr>\n   </thead>\n')
+	for row in iter_rows(table[start:stop], chunk_size):
+		file.write('   <tr>\n')
+		# Like astropy, leave out surrounding whitespace (such as the blank c1 classification):
+		file.write(''.join('    <td>{}</td>\n'.format(html.escape(str(value).strip())) for value in row))
+		file.write('   </tr>\n')
+	file.write('  </table>\n')
+
+
+def html_page(filename, table, start, stop, chunk_size, links=''):
+	with open(filename, 'w', encoding='utf-8') as file:
+		file.write('<html>\n <head>\n  <meta charset="utf-8"/>\n'
+			'  <meta content="text/html;charset=UTF-8" http-equiv="Content-type"/>\n </head>\n <body>\n')
+		file.write(links)
+		if table is not None:
+			html_table(file, table, start, stop, chunk_size)
+		file.write(' </body>\n</html>\n\n')
+
+
+def write_html(table, filename='table.html', page_size=None, chunk_size=CHUNK_SIZE):
+	"""
+	Writes the table as an html page (laid out like astropy's html writer).
+
+	If the table has more than `page_size` rows, it's split over pages named <filename>_1.html,
+	<filename>_2.html, ..., each linking to its neighbours, and `filename` becomes an index of the pages.
+	"""
+	if not page_size or len(table) <= page_size:
+		html_page(filename, table, 0, len(table), chunk_size)
+		return filename
+
+	stem, extension = os.path.splitext(filename)
+	index = os.path.basename(filename)
+	pages = ['{}_{}{}'.format(stem, number + 1, extension) for number in range(-(-len(table) // page_size))]
+	names = [os.path.basename(page) for page in pages]
+
+	for number, page in enumerate(pages):
+		start = number * page_size
+		links = ['<a href="{}">index</a>'.format(index)]
+		if number > 0:
+			links.append('<a href="{}">previous</a>'.format(names[number - 1]))
+		if number < len(pages) - 1:
+			links.append('<a href="{}">next</a>'.format(names[number + 1]))
+		header = '  <p>Rows {} to {} of {} | {}</p>\n'.format(start + 1, min(start + page_size, len(table)), len(table), ' | '.join(links))
+		html_page(page, table, start, start + page_size, chunk_size, header)
+
+	listing = ''.join('   <li><a href="{}">Rows {} to {}</a></li>\n'.format(name, number * page_size + 1, min((number + 1) * page_size, len(table)))
+		for number, name in enumerate(names))
+	html_page(filename, None, 0, 0, chunk_size, '  <p>{} rows on {} pages</p>\n  <ul>\n{}  </ul>\n'.format(len(table), len(pages), listing))
+
+	return filename
+
+
+def write_csv(table, filename, chunk_size=CHUNK_SIZE):
+	with open(filename, 'w', newline='', encoding='utf-8') as file:
+		writer = csv.writer(file)
+		writer.writerow(table.colnames)
+		for columns in iter_chunks(table, chunk_size):
+			writer.writerows(zip(*columns))
+	return filename
+
+
+def votable_field(name, column):
+	import numpy as np
+
+	column = np.asarray(column)
+	attributes = 'name="{}"'.format(html.escape(name))
+	if column.dtype.kind in 'US':
+		length = column.dtype.itemsize // (4 if column.dtype.kind == 'U' else 1)
+		attributes += ' datatype="{}" arraysize="{}"'.format('unicodeChar' if column.dtype.kind == 'U' else 'char', length)
+	else:
+		attributes += ' datatype="{}"'.format(VOTABLE_DATATYPES.get((column.dtype.kind, column.dtype.itemsize), 'double'))
+	return attributes
+
+
+def write_votable(table, filename, chunk_size=CHUNK_SIZE):
+	"""
+	Writes the table as a VOTable (1.4) with the rows inline as TABLEDATA.
+	"""
+	with open(filename, 'w', encoding='utf-8') as file:
+		file.write('<?xml version="1.0" encoding="utf-8"?>\n'
+			'<VOTABLE version="1.4" xmlns="http://www.ivoa.net/xml/VOTable/v1.3">\n'
+			' <RESOURCE type="results">\n  <TABLE>\n')
+		for name in table.colnames:
+			unit = getattr(table[name], 'unit', None)
+			unit = ' unit="{}"'.format(html.escape(str(unit))) if unit is not None else ''
+			file.write('   <FIELD {}{}/>\n'.format(votable_field(name, table[name][:0]), unit))
+		file.write('   <DATA>\n    <TABLEDATA>\n')
+		for row in iter_rows(table, chunk_size):
+			file.write('     <TR>' + ''.join('<TD>{}</TD>'.format(html.escape(str(value))) for value in row) + '</TR>\n')
+		file.write('    </TABLEDATA>\n   </DATA>\n  </TABLE>\n </RESOURCE>\n</VOTABLE>\n')
+	return filename
+
+
+def write_parquet(table, filename, chunk_size=CHUNK_SIZE):
+	"""
+	Writes the table as a Parquet file, one row group per chunk. Needs pyarrow.
+	"""
+	try:
+		import pyarrow
+		import pyarrow.parquet
+	except ImportError:
+		raise ImportError('Writing parquet files needs pyarrow: pip install pyarrow')
+	import numpy as np
+
+	schema = pyarrow.schema([(name, pyarrow.from_numpy_dtype(np.asarray(table[name][:0]).dtype.newbyteorder('='))) for name in table.colnames])
+	with pyarrow.parquet.ParquetWriter(filename, schema) as writer:
+		for columns in iter_chunks(table, chunk_size):
+			arrays = [pyarrow.array(column.astype(column.dtype.newbyteorder('='))) for column in columns]
+			writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+	return filename
@@ -0,0 +1,199 @@
+import os
+
+import numpy as np
+
+
+# Height of each declination zone, in degrees. Cone searches only look at the zones their cone
+# overlaps, so smaller zones mean fewer candidates but more (cheap) binary searches per query.
+DEFAULT_ZONE_HEIGHT = 0.5
+
+# Extra margin (in degrees) added around every search window, so that rounding error
+# can only ever add candidates, never drop one:
+PADDING = 1e-9
+
+# Likewise for the dot products of the single precision unit vectors (see unit_vectors), whose rounding error
+# is well under this:
+DOT_PADDING = 1e-6
+
+# Whole-catalog arrays are worked on in blocks of this many rows, so the temporary arrays of a calculation
+# never take more than a few blocks' worth of memory however big the catalog is:
+BLOCK_SIZE = 1 << 16
+
+
+class ZoneIndex:
+	"""
+	Spatial index for cone searches over the sky.
+
+	The sky is cut into declination zones of `zone_height` degrees, and within each zone
+	the sources are sorted by right ascension. A cone search then only has to binary search
+	the RA window of each zone its cone overlaps, instead of computing the separation to every
+	source in the catalog.
+
+	The sort key of each source is zone * 360 + ra, so that one sorted array covers every zone.
+	`order` maps positions in that array back to catalog rows.
+	"""
+
+	def __init__(self, zone_height, keys, order):
+		self.zone_height = float(zone_height)
+		self.num_zones = int(np.ceil(180 / self.zone_height))
+		self.keys = keys
+		self.order = order
+
+	@classmethod
+	def build(cls, ra, dec, zone_height=DEFAULT_ZONE_HEIGHT):
+		# Every RA in [0, 360), so each zone's keys stay below the next zone's (a source at RA 360 is the one at RA 0).
+		# The modulo of a tiny negative RA can round up to 360, so those are wrapped too:
+		ra = np.mod(np.asarray(ra, dtype=np.float64), 360)
+		ra[ra >= 360] = 0
+		num_zones = int(np.ceil(180 / zone_height))
+		zones = np.clip(np.floor((np.asarray(dec, dtype=np.float64) + 90) / zone_height), 0, num_zones - 1)
+
+		keys = zones * 360 + ra
+		order = np.argsort(keys, kind='stable').astype(row_dtype(len(keys)))
+
+		return cls(zone_height, keys[order], order)
+
+	@classmethod
+	def load(cls, path):
+		with np.load(path) as index:
+			return cls(index['zone_height'], index['keys'], index['order'])
+
+	def save(self, path, **metadata):
+		"""
+		Writes the index to `path` (an .npz file), along with any extra metadata arrays.
+		"""
+		# Write to a temporary file first so that a reader never sees a half-written index:
+		temp_path = '{}.{}.tmp'.format(path, os.getpid())
+		with open(temp_path, 'wb') as file:
+			np.savez(file, zone_height=self.zone_height, keys=self.keys, order=self.order, **metadata)
+		os.replace(temp_path, path)
+
+	def __len__(self):
+		return len(self.order)
+
+	def zone(self, dec):
+		return int(min(max(np.floor((dec + 90) / self.zone_height), 0), self.num_zones - 1))
+
+	def zone_range(self, dec1, radius):
+		"""
+		Returns the first and last zones that a cone of `radius` degrees centered at declination `dec1` overlaps.
+		"""
+		return self.zone(dec1 - radius - PADDING), self.zone(dec1 + radius + PADDING)
+
+	def candidates(self, ra1, dec1, radius, zones=None):
+		"""
+		Returns the (sorted) catalog rows that could be within `radius` degrees of (ra1, dec1).
+		`zones` can restrict this to a (first, last) range of the zones the cone overlaps.
+
+		This is a superset of the real matches: the exact separations still need to be checked.
+		"""
+		if zones is None:
+			if radius >= 180:
+				return np.arange(len(self))
+			zones = self.zone_range(dec1, radius)
+
+		first_zone, last_zone = zones
+		zone_offsets = np.arange(first_zone, last_zone + 1) * 360.0
+
+		starts = []
+		ends = []
+		for low, high in ra_windows(ra1, ra_half_width(dec1, radius)):
+			starts.append(np.searchsorted(self.keys, zone_offsets + low, side='left'))
+			# A window up to RA 360 stops short of the next zone's key for RA 0, which its own window (0, ...) picks up,
+			# so no source is returned twice:
+			ends.append(np.searchsorted(self.keys, zone_offsets + high, side='left' if high >= 360 else 'right'))
+		starts = np.concatenate(starts)
+		ends = np.concatenate(ends)
+
+		rows = np.concatenate([self.order[start:end] for start, end in zip(starts, ends)] or [self.order[:0]])
+		rows.sort()
+
+		return rows
+
+
+def row_dtype(count):
+	# Row numbers take half the memory as 32 bit integers, which hold them for any catalog of under 2**31 rows:
+	return np.int32 if count < 2**31 else np.int64
+
+
+def unit_vectors(ra, dec):
+	"""
+	Returns the cartesian unit vector of each (ra, dec), in degrees, as an (N, 3) float32 array.
+
+	Single precision is plenty for ruling out sources that are nowhere near a search (see
+	FIRSTCatalog.cone_rows), and takes half the memory; exact separations come from ra and dec.
+	"""
+	vectors = np.empty((len(ra), 3), dtype=np.float32)
+	for start in range(0, len(ra), BLOCK_SIZE):
+		block = slice(start, start + BLOCK_SIZE)
+		ra_block = np.radians(np.asarray(ra[block], dtype=np.float64))
+		dec_block = np.radians(np.asarray(dec[block], dtype=np.float64))
+		cos_dec = np.cos(dec_block)
+		vectors[block, 0] = cos_dec * np.cos(ra_block)
+		vectors[block, 1] = cos_dec * np.sin(ra_block)
+		vectors[block, 2] = np.sin(dec_block)
+	return vectors
+
+
+def ra_half_width(dec1, radius):
+	"""
+	Returns how far (in degrees of right ascension) a cone of `radius` degrees centered at
+	declination `dec1` reaches on either side of its center.
+	"""
+	if abs(dec1) + radius >= 90 - PADDING:
+		# The cone contains a pole, so it covers every right ascension.
+		return 180
+
+	dec1 = np.radians(dec1)
+	radius = np.radians(radius)
+	half_width = np.arctan(np.sin(radius) / np.sqrt(abs(np.cos(dec1 - radius) * np.cos(dec1 + radius))))
+
+	return np.degrees(half_width) * (1 + PADDING) + PADDING
+
+
+def ra_windows(ra1, half_width):
+	"""
+	Returns the (low, high) right ascension ranges, within [0, 360], that are within
+	`half_width` degrees of `ra1`. A window that crosses 0/360 is split in two.
+	"""
+	if half_width >= 180:
+		return [(0, 360)]
+
+	low = (ra1 - half_width) % 360
+	high = (ra1 + half_width) % 360
+	if low <= high:
+		return [(low, high)]
+
+	return [(0, high), (low, 360)]
+
+
+def load_or_build(filename, ra, dec, zone_height=DEFAULT_ZONE_HEIGHT):
+	"""
+	Returns the ZoneIndex for the catalog in `filename`.
+
+	The index is saved next to the catalog (as <filename>.zones.npz) the first time it is built,
+	and reused from there as long as the catalog file hasn't changed since.
+	"""
+	path = filename + '.zones.npz'
+	try:
+		stat = os.stat(filename)
+	except OSError:
+		# No file on disk to tie the index to, so just build it in memory.
+		return ZoneIndex.build(ra, dec, zone_height)
+
+	try:
+		with np.load(path) as saved:
+			if (saved['source_mtime'] == stat.st_mtime_ns and saved['source_size'] == stat.st_size
+					and saved['zone_height'] == zone_height and len(saved['order']) == len(ra)):
+				return ZoneIndex(saved['zone_height'], saved['keys'], saved['order'])
+	except (OSError, KeyError, ValueError):
+		pass
+
+	index = ZoneIndex.build(ra, dec, zone_height)
+	try:
+		index.save(path, source_mtime=stat.st_mtime_ns, source_size=stat.st_size)
+	except OSError:
+		# Read-only location: we can still use the index, it just won't be reused next time.
+		pass
+
+	return index